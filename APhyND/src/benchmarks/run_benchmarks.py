@@ -0,0 +1,510 @@
+# timing of the optimized pipeline stages against the former implementations
+# of tests/fixtures/legacy.py. Every benchmark runs in its own temporary
+# directory, the dataframes it writes are removed after it:
+#   python benchmarks/run_benchmarks.py sent_db block_db
+#   python benchmarks/run_benchmarks.py normalizer --corpus clean_docs
+import argparse
+import os
+import sys
+import pickle
+import random
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules import each other by name, the fixtures live with the tests
+sys.path[:0] = [SRC_DIR, os.path.join(SRC_DIR, "tests")]
+
+import defines
+import common_utils
+import doc_utils_clean
+import pos_yap_process
+import text_normalizer
+from fixtures import legacy, synthetic, yap_stub
+
+
+def time_it(func, *args, **kwargs):
+    start_time = time.time()
+    res = func(*args, **kwargs)
+    return res, time.time() - start_time
+
+
+def feature_utils():
+    # imported on use, it needs fasttext and the crf packages
+    import feature_utils
+    return feature_utils
+
+
+def classes():
+    # imported on use, it needs the training packages
+    import classes
+    return classes
+
+
+### SENTENCE TABLE ###
+
+
+def bench_sent_db(n_sent=5000, merge_short_sent=False, seed=0):
+    block_db = synthetic.make_synthetic_block_db(n_sent, seed=seed)
+    doc_utils_clean.debug_db = pd.DataFrame()
+    doc_utils_clean.block_db = block_db
+    new_db, new_time = time_it(
+        doc_utils_clean.build_doc_sentences, merge_short_sent)
+    old_db, old_time = time_it(legacy.legacy_sent_db, block_db, merge_short_sent)
+    new_csv = new_db[old_db.columns].to_csv(index=False)
+    old_csv = old_db.to_csv(index=False)
+    print("{} sentences: legacy {:.2f}s, columnar {:.2f}s, speedup x{:.1f}, identical csv: {}".format(
+        len(new_db.index), old_time, new_time, old_time / new_time, new_csv == old_csv))
+    return old_time, new_time
+
+
+### TEXT NORMALIZATION ###
+
+
+def get_corpus_block_texts(dir_name):
+    block_db = common_utils.concat_dbs(dir_name, "block_db", cols=["text"])
+    return block_db["text"].dropna().tolist()
+
+
+def bench_normalizer(texts=None, n_repeat=5):
+    if texts is None:
+        texts = synthetic.get_synthetic_block_texts()
+    n_chars = sum(len(text) for text in texts) * n_repeat
+    res = {}
+    for name, func in [
+        ("legacy block", legacy.legacy_block_normalize),
+        ("compiled block", text_normalizer.block_normalizer),
+        ("legacy clean_text", legacy.legacy_clean_text),
+        ("compiled clean_text", text_normalizer.sent_normalizer),
+    ]:
+        _, run_time = time_it(lambda: [func(text) for i in range(n_repeat) for text in texts])
+        res[name] = n_chars / run_time
+        print("{}: {:.2f}M chars/sec".format(name, res[name] / 1e6))
+    return res
+
+
+### BLOCK TABLE ###
+
+
+def bench_block_db(n_par=1000, seed=0):
+    par_db = synthetic.make_synthetic_par_db(n_par, seed=seed)
+    doc_utils_clean.debug_db = pd.DataFrame()
+    doc_utils_clean.par_db = par_db
+    new_db, new_time = time_it(doc_utils_clean.build_doc_blocks)
+    old_db, old_time = time_it(legacy.legacy_block_db, par_db)
+    new_csv = new_db.to_csv(index=False)
+    old_csv = old_db.to_csv(index=False)
+    print("{} blocks: legacy {:.2f}s, columnar {:.2f}s, speedup x{:.1f}, identical csv: {}".format(
+        len(new_db.index), old_time, new_time, old_time / new_time, new_csv == old_csv))
+    return old_time, new_time
+
+
+### SHORT SENTENCE MERGE ###
+
+
+def bench_short_sent_merge(n_sent=20000, seed=0):
+    # one long monologue block: the legacy merge copies it on every short sentence
+    rnd = random.Random(seed)
+    block = " ".join(synthetic.make_synthetic_sentence(rnd, max_words=6) for i in range(n_sent))
+    new_res, new_time = time_it(doc_utils_clean.handle_short_sent_in_block, block)
+    old_res, old_time = time_it(legacy.legacy_handle_short_sent_in_block, block)
+    print("{} chars: legacy {:.3f}s, single pass {:.3f}s, speedup x{:.1f}, identical: {}".format(
+        len(block), old_time, new_time, old_time / new_time, new_res == old_res))
+    return old_time, new_time
+
+
+### BLOCK ORDER IN PARAGRAPH ###
+
+
+def bench_block_order(n_par=50, n_nar=40, seed=0):
+    par_db = synthetic.make_synthetic_marked_par_db(n_par, n_nar, seed=seed)
+    doc_utils_clean.debug_db = pd.DataFrame()
+    doc_utils_clean.par_db = par_db
+    new_res, new_time = time_it(
+        lambda: [doc_utils_clean.split_par_to_blocks_keep_order(i) for i in par_db.index])
+    old_res, old_time = time_it(
+        lambda: [legacy.legacy_split_par_to_blocks_keep_order(i) for i in par_db.index])
+    print("{} paragraphs: legacy {:.3f}s, position map {:.3f}s, speedup x{:.1f}, identical: {}".format(
+        n_par, old_time, new_time, old_time / new_time, new_res == old_res))
+    return old_time, new_time
+
+
+### SENTENCE SPLITTER ###
+
+
+def diff_sent_splitters(texts, merge_short_sent=False):
+    # blocks on which the rule splitter finds other boundaries than nltk,
+    # as [(normalized block, nltk sentences, rule sentences)]
+    diffs = []
+    for text in texts:
+        text = text_normalizer.block_normalizer(text)
+        if merge_short_sent:
+            text = doc_utils_clean.handle_short_sent_in_block(text)
+        nltk_sents = doc_utils_clean.split_text_to_sentences(text, "nltk")
+        rule_sents = doc_utils_clean.split_text_to_sentences(text, "rules")
+        if nltk_sents != rule_sents:
+            diffs.append((text, nltk_sents, rule_sents))
+    return diffs
+
+
+def bench_sent_splitter(texts=None, n_repeat=3, n_show=5):
+    # --corpus passes get_corpus_block_texts(dir_name) to run on a parsed corpus
+    if texts is None:
+        texts = synthetic.get_synthetic_block_texts()
+    norm_texts = [text_normalizer.block_normalizer(text) for text in texts]
+    res = {}
+    for sent_splitter in doc_utils_clean.SENT_SPLITTERS:
+        _, res[sent_splitter] = time_it(lambda: [
+            doc_utils_clean.split_text_to_sentences(text, sent_splitter)
+            for i in range(n_repeat) for text in norm_texts
+        ])
+        print("{}: {:.3f}s".format(sent_splitter, res[sent_splitter]))
+    print("speedup x{:.1f}".format(res["nltk"] / res["rules"]))
+    diffs = diff_sent_splitters(texts)
+    print("{} blocks, {} with other sentence boundaries".format(len(texts), len(diffs)))
+    for text, nltk_sents, rule_sents in diffs[:n_show]:
+        print("block: {}\n nltk:  {}\n rules: {}".format(text, nltk_sents, rule_sents))
+    return diffs
+
+
+### YAP LATTICE TABLE ###
+
+
+def bench_lattice_parser(n_sent=1000, seed=0):
+    lattices = synthetic.get_synthetic_lattices(n_sent, seed)
+    new_db, new_time = time_it(synthetic.columnar_sent_tokens_db, lattices)
+    old_db, old_time = time_it(legacy.legacy_sent_tokens_db, lattices)
+    new_csv = new_db.to_csv(index=False)
+    old_csv = old_db.to_csv(index=False)
+    print("{} tokens: legacy {:.2f}s, columnar {:.2f}s, speedup x{:.1f}, identical csv: {}".format(
+        len(new_db.index), old_time, new_time, old_time / new_time, new_csv == old_csv))
+    return old_time, new_time
+
+
+### YAP TAGGING THROUGHPUT ###
+
+
+def bench_yap_tagging(n_sent=300, latency=0.01, token_latency=0.001, n_servers=4, n_in_flight=8, batch_size=16, port=8700, cpu_bound=True):
+    # sentences per second of parse_all_sentenses against yap_stub servers,
+    # cpu_bound stubs serve one request at a time per process as yap does
+    work_dir = os.getcwd()
+    sent_db_path = os.path.join(work_dir, "01_sent_db.csv")
+    sent_pos_path = os.path.join(work_dir, "01_sent_pos_db.csv")
+    cache_path = os.path.join(work_dir, "yap_cache.sqlite")
+    synthetic.write_synthetic_sent_db(sent_db_path, n_sent)
+    stub_cmd = "{} {} --port {{port}} --latency {} --token-latency {}{}".format(
+        sys.executable, os.path.abspath(yap_stub.__file__), latency, token_latency,
+        " --cpu-bound" if cpu_bound else "")
+    server = yap_stub.start_stub_server(port, latency, token_latency, cpu_bound=cpu_bound)
+    localhost_yap = pos_yap_process.localhost_yap
+    step_print = pos_yap_process.step_print
+    get_yap_session = pos_yap_process.get_yap_session
+    pos_yap_process.localhost_yap = "http://localhost:{}/yap/heb/joint".format(port)
+    pos_yap_process.step_print = n_sent + 1
+    modes = [
+        ("sequential, new connection per sentence", {}),
+        ("sequential, pooled session", {}),
+        ("batched x{}".format(batch_size), {"batch_size": batch_size}),
+        ("{} in flight".format(n_in_flight), {"n_in_flight": n_in_flight}),
+        ("{} servers, {} in flight".format(n_servers, n_in_flight), {"n_in_flight": n_in_flight}),
+        ("cache, cold", {"use_cache": True, "cache_path": cache_path}),
+        ("cache, warm", {"use_cache": True, "cache_path": cache_path}),
+    ]
+    res = {}
+    outputs = {}
+    try:
+        for name, kwargs in modes:
+            if name.startswith("sequential, new"):
+                # the former client: requests.get without a session
+                pos_yap_process.get_yap_session = lambda n_connections=0: pos_yap_process.requests
+            if "servers" in name:
+                pos_yap_process.start_yap_pool(
+                    n_servers, port + 1, "least_loaded", stub_cmd, work_dir, timeout=30)
+            try:
+                _, run_time = time_it(
+                    pos_yap_process.parse_all_sentenses, [sent_db_path], **kwargs)
+            finally:
+                pos_yap_process.get_yap_session = get_yap_session
+                pos_yap_process.stop_yap_pool()
+                pos_yap_process.close_yap_cache()
+            res[name] = n_sent / run_time
+            outputs[name] = synthetic.get_file_md5(sent_pos_path)
+    finally:
+        server.shutdown()
+        server.server_close()
+        pos_yap_process.localhost_yap = localhost_yap
+        pos_yap_process.step_print = step_print
+        pos_yap_process.close_yap_session()
+    print("{} sentences, stub latency {}s + {}s per token{}".format(
+        n_sent, latency, token_latency, ", cpu bound" if cpu_bound else ""))
+    for name, sent_per_sec in res.items():
+        print("{}: {:.1f} sentences/sec".format(name, sent_per_sec))
+    print("identical sent_pos_db: {}".format(len(set(outputs.values())) == 1))
+    return res
+
+
+### POS FEATURES ###
+
+
+def bench_pos_features(n_sent=2000, seed=0, dir_name="bench_pos"):
+    # legacy lemma/count/merge triple read against save_doc_pos_features.
+    # The legacy merge re-reads the count csv, which may move values by one
+    # ulp, so the merged dbs are compared with a tolerance
+    synthetic.write_synthetic_doc_dbs(dir_name, 1, n_sent, seed)
+    dir_path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name)
+    (old_lemma_db, old_merged_db), old_time = time_it(legacy.legacy_save_doc_pos_features, dir_name, 1)
+    dense_size = os.path.getsize(os.path.join(dir_path, "01_merged_db.csv"))
+    new_merged_db, new_time = time_it(
+        feature_utils().save_doc_pos_features, dir_name, 1, sparse_count=False)
+    new_lemma_db = pd.read_csv(os.path.join(dir_path, "01_sent_lemma_db.csv"))
+    same_lemma = new_lemma_db.equals(old_lemma_db)
+    same_merged = new_merged_db.columns.equals(old_merged_db.columns) and np.allclose(
+        new_merged_db.values, old_merged_db.values, rtol=1e-12, atol=0)
+    print("{} sentences: legacy {:.2f}s, single pass {:.2f}s, speedup x{:.1f}, same lemma db: {}, same merged db: {}".format(
+        n_sent, old_time, new_time, old_time / new_time, same_lemma, same_merged))
+    sparse_merged_db, sparse_time = time_it(feature_utils().save_doc_pos_features, dir_name, 1, sparse_count=True)
+    sparse_size = os.path.getsize(os.path.join(dir_path, "01_merged_db.csv")) + sum(
+        os.path.getsize(os.path.join(dir_path, name))
+        for name in ["01_sent_pos_count.npz", "01_sent_pos_count_columns.json"])
+    print("sparse counts {:.2f}s, speedup x{:.1f}, stored {:.0f}KB instead of {:.0f}KB".format(
+        sparse_time, old_time / sparse_time, sparse_size / 1024, dense_size / 1024))
+    return old_time, new_time, sparse_time
+
+
+def get_doc_sent_features(dir_name, doc_idx, neighbor_radius=2, merged_db=None):
+    fu = feature_utils()
+    fu.load_doc_features(dir_name, doc_idx, tf_types=[])
+    if merged_db is not None:
+        fu.curr_doc_db["merged"] = merged_db
+    doc_len = len(fu.curr_doc_db["merged"].index)
+    return [fu.sent2features(sent_idx, sent_idx, doc_len, neighbor_radius, tf_to_use=[])
+            for sent_idx in range(doc_len)]
+
+
+def bench_pos_count_packing(n_sent=2000, seed=0, dir_name="bench_pos"):
+    # sent2features over dense count columns of merged_db against the non
+    # zeros of the sparse count matrix. The dense merged_db is read back with
+    # exact float parsing so the features must be identical
+    fu = feature_utils()
+    synthetic.write_synthetic_doc_dbs(dir_name, 1, n_sent, seed)
+    dir_path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name)
+    pd.DataFrame(np.zeros((n_sent, n_sent))).to_csv(
+        os.path.join(dir_path, "01_sent_sim_vec300_db.csv"), index=False)
+    fu.save_doc_pos_features(dir_name, 1)
+    merged_db = pd.read_csv(os.path.join(dir_path, "01_merged_db.csv"), float_precision="round_trip")
+    dense_features, dense_time = time_it(get_doc_sent_features, dir_name, 1, merged_db=merged_db)
+    fu.save_doc_pos_features(dir_name, 1, sparse_count=True)
+    sparse_features, sparse_time = time_it(get_doc_sent_features, dir_name, 1)
+    print("{} sentences: dense {:.2f}s, sparse {:.2f}s, speedup x{:.1f}, identical features: {}".format(
+        n_sent, dense_time, sparse_time, dense_time / sparse_time, dense_features == sparse_features))
+    return dense_time, sparse_time
+
+
+### SENTENCE VECTORS ###
+
+
+def npy_sent_vectors(dir_name, doc_idx, ft, dim=300):
+    fu = feature_utils()
+    fu.get_and_save_sent_vectors(dir_name, doc_idx, ft, dim)
+    return fu.load_sent_vectors(os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name), doc_idx, dim)
+
+
+def bench_sent_vectors(n_sent=5000, seed=0, dir_name="bench_vec", dim=300):
+    synthetic.write_synthetic_doc_dbs(dir_name, 1, n_sent, seed)
+    ft = synthetic.HashVectorModel(dim)
+    old_vectors, old_time = time_it(legacy.legacy_sent_vectors, dir_name, 1, ft, dim)
+    new_vectors, new_time = time_it(npy_sent_vectors, dir_name, 1, ft, dim)
+    dir_path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name)
+    old_load_time = time_it(pd.read_csv, os.path.join(dir_path, "01_sent_vec{}_db.csv".format(dim)))[1]
+    new_load_time = time_it(feature_utils().load_sent_vectors, dir_path, 1, dim)[1]
+    print("{} sentences: save+load legacy {:.2f}s, npy {:.2f}s, speedup x{:.1f}, identical vectors: {}".format(
+        n_sent, old_time, new_time, old_time / new_time,
+        np.array_equal(old_vectors.astype(np.float32), new_vectors)))
+    print("load only: csv {:.3f}s, memmap npy {:.5f}s, {:.0f}KB instead of {:.0f}KB".format(
+        old_load_time, new_load_time,
+        os.path.getsize(os.path.join(dir_path, "01_sent_vec{}.npy".format(dim))) / 1024,
+        os.path.getsize(os.path.join(dir_path, "01_sent_vec{}_db.csv".format(dim))) / 1024))
+    return old_time, new_time
+
+
+### NEIGHBOR SIMILARITY ###
+
+
+def band_doc_similarity(dir_name, doc_idx, sent_vectors, dim=300):
+    fu = feature_utils()
+    fu.get_and_save_doc_similarity(dir_name, doc_idx, dim, sent_vectors)
+    return fu.load_sim_band(os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name), doc_idx, dim)
+
+
+def get_doc_sim_features(sim_band, sim_vec, sent_vec, neighbor_radius):
+    fu = feature_utils()
+    fu.curr_doc_db.update({"sim_band": sim_band, "sim_vec": sim_vec, "sent_vec": sent_vec})
+    doc_len = len(sent_vec)
+    features = []
+    for sent_idx in range(doc_len):
+        features.append([fu.get_sent_similarity(sent_idx, sent_idx + dist)
+                         for dist in range(-neighbor_radius, neighbor_radius + 1)
+                         if dist != 0 and 0 <= sent_idx + dist < doc_len])
+    return features
+
+
+def bench_doc_similarity(n_sent=2000, seed=0, dir_name="bench_sim", dim=300):
+    # the legacy csv values went through a lossy float parse, the band
+    # features are compared with a tolerance, also past the band radius
+    dir_path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name)
+    os.makedirs(dir_path, exist_ok=True)
+    sent_vectors = np.random.default_rng(seed).standard_normal((n_sent, dim)).astype(np.float32)
+    np.save(os.path.join(dir_path, "01_sent_vec{}.npy".format(dim)), sent_vectors)
+    sim_vec, old_time = time_it(legacy.legacy_doc_similarity, dir_name, 1, sent_vectors, dim)
+    sim_band, new_time = time_it(band_doc_similarity, dir_name, 1, sent_vectors, dim)
+    sent_vec = feature_utils().load_sent_vectors(dir_path, 1, dim)
+    same_features = True
+    for neighbor_radius in [2, feature_utils().SIM_BAND_RADIUS + 2]:
+        old_features = get_doc_sim_features(None, sim_vec, sent_vec, neighbor_radius)
+        new_features = get_doc_sim_features(sim_band, None, sent_vec, neighbor_radius)
+        same_features = same_features and all(np.allclose(old, new, rtol=0, atol=1e-12)
+                                              for old, new in zip(old_features, new_features))
+    old_size = os.path.getsize(os.path.join(dir_path, "01_sent_sim_vec{}_db.csv".format(dim)))
+    new_size = os.path.getsize(os.path.join(dir_path, "01_sent_sim_band{}.npy".format(dim)))
+    print("{} sentences: save+load full csv {:.2f}s, band {:.3f}s, speedup x{:.0f}, {:.0f}KB instead of {:.0f}KB, same features: {}".format(
+        n_sent, old_time, new_time, old_time / new_time, new_size / 1024, old_size / 1024, same_features))
+    return old_time, new_time
+
+
+### CORPUS VECTOR STORE ###
+
+
+def bench_corpus_vectors(n_docs=80, seed=0, dir_name="bench_corpus", dim=300):
+    fu = feature_utils()
+    doc_vectors = synthetic.write_synthetic_doc_vectors(dir_name, n_docs, seed=seed, dim=dim)
+    dir_path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name)
+    build_time = time_it(fu.build_corpus_vectors, dir_name, [], dim)[1]
+    same_rows = all(np.array_equal(fu.load_sent_vectors(dir_path, doc_idx, dim), vectors)
+                    for doc_idx, vectors in doc_vectors.items())
+    old_ids, old_time = time_it(legacy.legacy_nearest_sentences, dir_name, list(doc_vectors), 5, 10, 10, dim)
+    new_db, new_time = time_it(fu.nearest_corpus_sentences, dir_name, 5, 10, 10, dim)
+    new_ids = list(zip(new_db["doc_idx"], new_db["sent_idx"]))
+    print("{} docs: store built in {:.2f}s, same doc rows: {}".format(n_docs, build_time, same_rows))
+    print("nearest sentences: per doc csv {:.2f}s, corpus store {:.3f}s, speedup x{:.0f}, same neighbors: {}".format(
+        old_time, new_time, old_time / new_time, old_ids == new_ids))
+    return old_time, new_time
+
+
+### WORD VECTOR CACHE ###
+
+
+def bench_word_cache(n_sent=5000, seed=0):
+    fu = feature_utils()
+    ft = synthetic.SubwordVectorModel()
+    rnd = random.Random(seed)
+    texts = [synthetic.make_synthetic_sentence(rnd) for i in range(n_sent)]
+    fu.word_vectors.pop(ft, None)
+    old_vectors, old_time = time_it(fu.get_sent_vectors, texts, ft, ft.get_dimension())
+    fu.word_vectors.pop(ft, None)
+    new_vectors, new_time = time_it(fu.get_cached_sent_vectors, texts, ft, ft.get_dimension())
+    warm_time = time_it(fu.get_cached_sent_vectors, texts, ft, ft.get_dimension())[1]
+    print("{} sentences, {} unique words: per sentence {:.2f}s, word cache {:.3f}s (x{:.0f}), warm cache {:.3f}s (x{:.0f}), max abs diff {:.2e}".format(
+        n_sent, len(fu.word_vectors[ft][0]), old_time, new_time, old_time / new_time,
+        warm_time, old_time / warm_time, np.abs(old_vectors - new_vectors).max()))
+    return old_time, new_time
+
+
+### SHARED TF-IDF COUNTS ###
+
+
+def fit_split_tfidfs(dir_name, splits, tf_types, shared_counts):
+    # TfParams.fit_train and a transform of every split document
+    tfs = {}
+    for split_idx in splits:
+        for tf_type in tf_types:
+            tf_params = classes().TfParams(dir_name, tf_type, split_idx, splits, shared_counts=shared_counts)
+            tfs[(split_idx, tf_type)] = (tf_params, {
+                doc_idx: feature_utils().tfidf_transform_doc(dir_name, doc_idx, tf_params.tf, tf_params.per_lemma)
+                for doc_idx in splits[split_idx]["train"] + splits[split_idx]["test"]})
+    return tfs
+
+
+def bench_tfidf_counts(n_docs=12, n_sent=300, n_splits=5, seed=0, dir_name="bench_tfidf",
+                       tf_types=["word", "char_wb", "lemma"]):
+    # a TfidfVectorizer per split and tf type against SplitTfidf over the
+    # corpus counts of feature_utils.get_tf_counts, features and tf-idf
+    # matrices have to be identical
+    fu = feature_utils()
+    doc_indices = list(range(1, n_docs + 1))
+    for doc_idx in doc_indices:
+        synthetic.write_synthetic_doc_dbs(dir_name, doc_idx, n_sent, seed + doc_idx)
+        fu.save_doc_pos_features(dir_name, doc_idx)
+    splits = synthetic.get_synthetic_splits(doc_indices, n_splits, seed=seed)
+    old_tfs, old_time = time_it(fit_split_tfidfs, dir_name, splits, tf_types, False)
+    fu.tf_counts.clear()
+    new_tfs, new_time = time_it(fit_split_tfidfs, dir_name, splits, tf_types, True)
+    same_features = all(np.array_equal(old_tfs[key][0].features, new_tfs[key][0].features) for key in old_tfs)
+    same_matrices = all(synthetic.same_csr(old_tfs[key][1][doc_idx], new_tfs[key][1][doc_idx])
+                        for key in old_tfs for doc_idx in old_tfs[key][1])
+    # new text goes through the kept vocabulary, also after a pickle round trip
+    texts = fu.get_doc_tf_corpus(dir_name, 1, per_lemma=False)
+    same_text = all(synthetic.same_csr(old_tfs[(split_idx, "word")][0].tf.transform(texts),
+                             pickle.loads(pickle.dumps(new_tfs[(split_idx, "word")][0].tf)).transform(texts))
+                    for split_idx in splits)
+    print("{} docs, {} splits x {} tf types: vectorizer per split {:.2f}s, shared counts {:.2f}s, speedup x{:.1f}".format(
+        n_docs, n_splits, len(tf_types), old_time, new_time, old_time / new_time))
+    print("same features: {}, same tf-idf matrices: {}, same transform of new text: {}".format(
+        same_features, same_matrices, same_text))
+    return old_time, new_time
+
+
+BENCHMARKS = {
+    "sent_db": bench_sent_db,
+    "normalizer": bench_normalizer,
+    "block_db": bench_block_db,
+    "short_sent_merge": bench_short_sent_merge,
+    "block_order": bench_block_order,
+    "sent_splitter": bench_sent_splitter,
+    "lattice_parser": bench_lattice_parser,
+    "yap_tagging": bench_yap_tagging,
+    "pos_features": bench_pos_features,
+    "pos_count_packing": bench_pos_count_packing,
+    "sent_vectors": bench_sent_vectors,
+    "doc_similarity": bench_doc_similarity,
+    "corpus_vectors": bench_corpus_vectors,
+    "word_cache": bench_word_cache,
+    "tfidf_counts": bench_tfidf_counts,
+}
+# benchmarks that take the block texts of --corpus instead of synthetic ones
+CORPUS_BENCHMARKS = ["normalizer", "sent_splitter"]
+
+
+def run_benchmark(name, corpus_texts=None):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            print("### {} ###".format(name))
+            if corpus_texts is not None and name in CORPUS_BENCHMARKS:
+                return BENCHMARKS[name](corpus_texts)
+            return BENCHMARKS[name]()
+        finally:
+            os.chdir(cwd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks of the pipeline stages")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help="benchmarks to run, all by default: {}".format(", ".join(BENCHMARKS)))
+    parser.add_argument("--corpus", help="parsed corpus dir under {} for {}".format(
+        defines.PATH_TO_DFS, ", ".join(CORPUS_BENCHMARKS)))
+    args = parser.parse_args()
+    unknown = [name for name in args.names if not name in BENCHMARKS]
+    if len(unknown) != 0:
+        parser.error("unknown benchmarks: {}".format(", ".join(unknown)))
+    # read from the working directory the script is started in
+    corpus_texts = get_corpus_block_texts(args.corpus) if args.corpus else None
+    for name in args.names or list(BENCHMARKS):
+        run_benchmark(name, corpus_texts)
+
+
+if __name__ == "__main__":
+    main()
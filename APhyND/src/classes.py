@@ -27,15 +27,18 @@ from sklearn.metrics import make_scorer, accuracy_score, balanced_accuracy_score
 from sklearn.model_selection import train_test_split, cross_val_score, cross_validate
 from collections import Counter
 from imblearn.under_sampling import RandomUnderSampler
-from sklearn.base import BaseEstimator, TransformerMixin, MetaEstimatorMixin, ClassifierMixin
+from sklearn.base import BaseEstimator, TransformerMixin, MetaEstimatorMixin, ClassifierMixin, clone
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+import numbers
 sys.path.append('./src/')
 
 
 class TfParams:
 
-    def __init__(self, dir_name, tf_type,  split_idx, splits, stop_list=[]):
+    def __init__(self, dir_name, tf_type,  split_idx, splits, stop_list=[], shared_counts=True):
         self.tf_type = tf_type
         self.stop_list = stop_list
+        self.shared_counts = shared_counts  # fit from feature_utils.tf_counts
         self.split_idx = split_idx
         self.splits = splits
         self.dir_name = dir_name
@@ -72,7 +75,8 @@ class TfParams:
             per_word=self.per_word,
             per_lemma=self.per_lemma,
             analyzer=self.analyzer,
-            doc_indices=doc_indices)
+            doc_indices=doc_indices,
+            shared_counts=self.shared_counts)
         self.features = self.tf.get_feature_names_out()
 
     def transform_save(self, doc_indices):
@@ -83,6 +87,113 @@ class TfParams:
                 doc, self.split_idx, self.tf_type, self.suffix), doc_tf)
 
 
+class TfCounts:
+    # raw term counts of the documents of a directory for one analyzer
+    # setting: every document is tokenized once and kept as a count csr over
+    # a vocabulary that grows with the documents
+    def __init__(self, dir_name, per_word=True, per_lemma=True, analyzer='char', n_min=3, n_max=5, stop_words=[]):
+        self.dir_name = dir_name
+        self.per_lemma = per_lemma
+        if per_word:
+            count_vectorizer = CountVectorizer(lowercase=False, stop_words=stop_words)
+        else:
+            count_vectorizer = CountVectorizer(
+                lowercase=False, analyzer=analyzer, ngram_range=(n_min, n_max))
+        self.count_vectorizer = count_vectorizer
+        self.analyze = count_vectorizer.build_analyzer()
+        self.vocabulary = {}
+        self.doc_counts = {}
+        self.doc_mtimes = {}
+
+    def get_doc_mtime(self, doc_idx):
+        return os.stat(feature_utils.get_doc_tf_path(self.dir_name, doc_idx, self.per_lemma)).st_mtime_ns
+
+    def is_doc_counted(self, doc_idx):
+        # False also when the doc was parsed again after it was counted
+        return doc_idx in self.doc_counts and self.doc_mtimes[doc_idx] == self.get_doc_mtime(doc_idx)
+
+    def count_doc(self, doc_idx):
+        # the counting of CountVectorizer._count_vocab, new terms get the
+        # next column. Terms of an older version of the doc keep their
+        # column, they are no more in its counts
+        self.doc_mtimes[doc_idx] = self.get_doc_mtime(doc_idx)
+        j_indices = []
+        values = []
+        indptr = [0]
+        for text in feature_utils.get_doc_tf_corpus(self.dir_name, doc_idx, self.per_lemma):
+            feature_counter = {}
+            for feature in self.analyze(text):
+                feature_idx = self.vocabulary.setdefault(feature, len(self.vocabulary))
+                feature_counter[feature_idx] = feature_counter.get(feature_idx, 0) + 1
+            j_indices.extend(feature_counter.keys())
+            values.extend(feature_counter.values())
+            indptr.append(len(j_indices))
+        self.doc_counts[doc_idx] = sparse.csr_matrix(
+            (np.asarray(values, dtype=np.float64), np.asarray(j_indices, dtype=np.int64),
+             np.asarray(indptr, dtype=np.int64)), shape=(len(indptr) - 1, len(self.vocabulary)))
+
+    def get_doc_counts(self, doc_idx):
+        # raw counts of a document over the current vocabulary
+        if not self.is_doc_counted(doc_idx):
+            self.count_doc(doc_idx)
+        counts = self.doc_counts[doc_idx]
+        return sparse.csr_matrix((counts.data, counts.indices, counts.indptr),
+                                 shape=(counts.shape[0], len(self.vocabulary)))
+
+    def get_counts(self, doc_indices):
+        for doc_idx in doc_indices:
+            if not self.is_doc_counted(doc_idx):
+                self.count_doc(doc_idx)
+        return sparse.vstack([self.get_doc_counts(doc_idx) for doc_idx in sorted(doc_indices)], format='csr')
+
+    def get_feature_names(self):
+        feature_names = np.empty(len(self.vocabulary), dtype=object)
+        for feature, feature_idx in self.vocabulary.items():
+            feature_names[feature_idx] = feature
+        return feature_names
+
+
+class SplitTfidf:
+    # tf-idf fit on the train documents of a split from shared TfCounts:
+    # same features, idf and transform as a TfidfVectorizer fit on the same
+    # sentences, the documents are not tokenized again
+    def __init__(self, counts, doc_indices, min_df=5):
+        self.counts = counts
+        train_counts = counts.get_counts(doc_indices)
+        if not isinstance(min_df, numbers.Integral):
+            min_df = min_df * train_counts.shape[0]
+        df = np.bincount(train_counts.indices, minlength=train_counts.shape[1])
+        feature_names = counts.get_feature_names()
+        # TfidfVectorizer orders the features by name, terms of other docs
+        # (df 0) are never features
+        self.columns = np.array(sorted(np.flatnonzero((df >= min_df) & (df > 0)),
+                                       key=feature_names.__getitem__), dtype=np.int64)
+        if len(self.columns) == 0:
+            raise ValueError("After pruning, no terms remain. Try a lower min_df or a higher max_df.")
+        self.features = feature_names[self.columns]
+        self.tfidf = TfidfTransformer().fit(train_counts[:, self.columns])
+        # for new text, counts over the kept features only
+        self.count_vectorizer = clone(counts.count_vectorizer).set_params(
+            vocabulary=self.features.tolist(), dtype=np.float64)
+
+    def get_feature_names_out(self):
+        return self.features
+
+    def transform_counts(self, counts):
+        counts = counts[:, self.columns]
+        counts.sort_indices()
+        return self.tfidf.transform(counts)
+
+    def transform(self, corpus):
+        return self.tfidf.transform(self.count_vectorizer.transform(corpus))
+
+    def __getstate__(self):
+        # the corpus counts stay in the process, pickles keep the fit only
+        state = self.__dict__.copy()
+        state['counts'] = None
+        return state
+
+
 class Sentence:
     def __init__(self,
                  doc_idx,
@@ -197,7 +308,7 @@ class Document:
         self.colored_ind_df = pd.DataFrame()
         self.nar_df = pd.DataFrame()
         self.nar_map = {}
-        self.db_names = ['merged', 'sent_db', 'sim_vec']
+        self.db_names = ['merged', 'sent_db', 'sim_vec', 'sim_band', 'pos_count', 'pos_count_columns', 'sent_vec']
         self.doc_splits = {}
         self.get_doc_splits()
 
@@ -211,8 +322,11 @@ class Document:
             self.path, "{:02d}_{}.csv".format(self.doc_idx, self.merged_str)))
         self.doc_db['sent_db'] = pd.read_csv(os.path.join(
             self.path, "{:02d}_sent_db.csv".format(self.doc_idx)), usecols=['text', 'par_type', 'nar_idx'])
-        self.doc_db['sim_vec'] = pd.read_csv(os.path.join(
-            self.path, "{:02d}_sent_sim_vec300_db.csv".format(self.doc_idx)))
+        self.doc_db['sim_band'], self.doc_db['sim_vec'] = feature_utils.load_doc_similarity(
+            self.path, self.doc_idx)
+        self.doc_db['pos_count'], self.doc_db['pos_count_columns'] = feature_utils.load_sent_pos_count(
+            self.path, self.doc_idx)
+        self.doc_db['sent_vec'] = feature_utils.load_sent_vectors(self.path, self.doc_idx)
         self.doc_len = self.doc_db['merged'].shape[0]
         for split_idx, split in self.doc_splits.items():
             if not split_idx in self.doc_db:
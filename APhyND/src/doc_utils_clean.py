@@ -1,5 +1,6 @@
 #!pip install python-docx
 import docx
+import io
 import os
 import sys
 import glob
@@ -12,6 +13,10 @@ import pandas as pd
 import seaborn as sns
 from nltk import tokenize
 import common_utils
+import text_normalizer
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
 
 pd.options.display.float_format = "{:f}".format
 
@@ -21,6 +26,55 @@ global block_db
 global sent_db
 global debug_db
 
+PUNCT_TABLE = str.maketrans("", "", text_normalizer.PUNCTUATION_TO_REMOVE)  # keep ?
+# bump when a parser change should invalidate parse_manifest.json
+PARSER_VERSION = 1
+PARSE_MANIFEST = "parse_manifest.json"
+# sentence splitters selectable by the sent_splitter parameter
+SENT_SPLITTERS = ["nltk", "rules"]
+# per document statistics written to doc_db.csv while parsing
+DOC_STAT_COLUMNS = ["par_count", "sent_count", "nar_sent_count"]
+# block table columns, in the order they are written to NN_block_db.csv
+BLOCK_DB_COLUMNS = [
+    "text",
+    "is_nar",
+    "doc_idx",
+    "par_idx_in_doc",
+    "par_pos_in_doc",
+    "par_db_idx",
+    "par_type",
+    "block_type",
+    "nar_idx",
+]
+BLOCK_DB_TEXT_COLUMNS = ["text", "par_type", "block_type"]
+# sentence table columns, in the order they are written to NN_sent_db.csv
+SENT_DB_COLUMNS = [
+    "is_question",
+    "text",
+    "sent_idx_in_block",
+    "block_idx",
+    "is_nar",
+    "doc_idx",
+    "par_db_idx",
+    "par_idx_in_doc",
+    "par_pos_in_doc",
+    "par_type",
+    "block_type",
+    "nar_idx",
+    "sent_len",
+]
+SENT_DB_TEXT_COLUMNS = ["text", "par_type", "block_type"]
+# columns copied as is from the block the sentence belongs to
+SENT_DB_BLOCK_COLUMNS = [
+    "is_nar",
+    "doc_idx",
+    "par_db_idx",
+    "par_idx_in_doc",
+    "par_pos_in_doc",
+    "par_type",
+    "block_type",
+    "nar_idx",
+]
 
 def get_random_paragraph(query):
     match = par_db.query(query)
@@ -87,24 +141,32 @@ def get_dummies_is_client():
 
 
 def handle_short_sent_in_block(block):
-    handled_block = block
-    block_len = len(handled_block)
-    curr_dot_idx = block_len - 1
+    # a sentence of at most MIN_SENT_LEN words is merged into the next one by
+    # turning its closing dot into a space. Dots are visited once (a dot at
+    # index 0 never closes a sentence) and the merged text is joined at the end.
+    # The sentence text starts at the previous dot, so a kept dot followed by
+    # a space counts as a word of the next sentence, a merged one does not.
+    pieces = []
+    piece_start = 0
     prev_dot_idx = 0
-    # step = 0
-    while curr_dot_idx < block_len:
-        # step+=1
-        curr_dot_idx = find_dot_idx(handled_block, prev_dot_idx + 1)
-        # print("step {} curr_dot_idx {} prev_dot_idx {}".format(step,curr_dot_idx,prev_dot_idx))
-        if curr_dot_idx < 1:
-            break
-        focus = handled_block[prev_dot_idx:curr_dot_idx]
+    lead = block[:1]  # char at prev_dot_idx in the merged text
+    curr_dot_idx = find_dot_idx(block, 1)
+    while curr_dot_idx > 0:
+        focus = block[prev_dot_idx + 1 : curr_dot_idx]
         word_count = count_words(focus)
-        # print ("\tword count in {} is {}".format(word_count,focus))
+        if lead and not lead.isspace() and not focus[:1].strip():
+            word_count += 1
         if word_count > 0 and word_count <= defines.MIN_SENT_LEN:
-            handled_block = replace_char_at_index(handled_block, curr_dot_idx)
+            pieces.append(block[piece_start:curr_dot_idx])
+            pieces.append(" ")
+            piece_start = curr_dot_idx + 1
+            lead = " "
+        else:
+            lead = "."
         prev_dot_idx = curr_dot_idx
-    return handled_block
+        curr_dot_idx = find_dot_idx(block, prev_dot_idx + 1)
+    pieces.append(block[piece_start:])
+    return "".join(pieces)
 
 
 def replace_char_at_index(org_str, index, replacement=" "):
@@ -127,20 +189,25 @@ def remove_multi_x(text):
     return re.sub(r'X{3,4}.*?X{1,4}|X{3,}',' XXX ',text)
 
 
-def split_block_to_sentences(text_, merge_short):
-    text = text_
-    text = remove_lr_annotation(text)
-    # important to remove before we split into sentences
-    text = replace_brackets(text)
-    text = remove_multi_dots(text)
-    text = remove_multi_x(text)
-    text = remove_symbols(text)
-    text = unify_numbers(text)
-    text = replase_shekel_char(text)
+def split_text_to_sentences(text, sent_splitter="nltk"):
+    if sent_splitter == "nltk":
+        return tokenize.sent_tokenize(text)
+    if sent_splitter == "rules":
+        return text_normalizer.split_sentences(text)
+    raise ValueError(
+        "sent_splitter should be one of {}, got {}".format(SENT_SPLITTERS, sent_splitter)
+    )
+
+
+def split_block_to_sentences(text_, merge_short, sent_splitter="nltk"):
+    # remove_lr_annotation, replace_brackets (important to remove before we
+    # split into sentences), remove_multi_dots, remove_multi_x, remove_symbols,
+    # unify_numbers and replase_shekel_char with precompiled rules
+    text = text_normalizer.block_normalizer(text_)
     if merge_short:
         text = handle_short_sent_in_block(text)
 
-    sent_list = tokenize.sent_tokenize(text)
+    sent_list = split_text_to_sentences(text, sent_splitter)
     for i, item in enumerate(sent_list):
         clean_item = clean_text(item)
         check_text_for_symbols(clean_item)
@@ -169,129 +236,88 @@ def check_text_for_symbols(text):
         quit()
 
 
-def add_sentences_of_blocks_to_db(block_db_idx,merge_short_sent):
-    global sent_db
-    block_line = block_db.iloc[block_db_idx]
-    block = block_line["text"]
-    sent_list = split_block_to_sentences(block,merge_short_sent)
-    for i, sentence in enumerate(sent_list):
-        if not text_contains_char(sentence):
-            # print("Sentence wihtout char! \n {}".format(sentence))
-            add_to_debug_df([("block_no_char", block), ("sent_no_char", sentence)])
-            continue
-        curr_db_idx = sent_db.shape[0]
-        sent_db.loc[curr_db_idx, "is_question"] = 1 if "?" in sentence else 0
-        sent_db.loc[curr_db_idx,'text'] = re.sub(r'\?','',sentence)
-        sent_db.loc[curr_db_idx, "sent_idx_in_block"] = i
-        sent_db.loc[curr_db_idx, "block_idx"] = block_db_idx
-        sent_db.loc[curr_db_idx, "is_nar"] = block_line["is_nar"]
-        sent_db.loc[curr_db_idx, "doc_idx"] = block_line["doc_idx"]
-        sent_db.loc[curr_db_idx, "par_db_idx"] = block_line["par_db_idx"]
-        sent_db.loc[curr_db_idx, "par_idx_in_doc"] = block_line["par_idx_in_doc"]
-        sent_db.loc[curr_db_idx, "par_pos_in_doc"] = block_line["par_pos_in_doc"]
-        sent_db.loc[curr_db_idx, "par_type"] = block_line["par_type"]
-        sent_db.loc[curr_db_idx, "block_type"] = block_line["block_type"]
-        sent_db.loc[curr_db_idx, "nar_idx"] = block_line["nar_idx"]
-        sent_db.loc[curr_db_idx, "sent_len"] = len(sentence)
+def new_sent_columns():
+    return {col: [] for col in SENT_DB_COLUMNS}
+
+
+def build_db_from_columns(columns, col_order, text_cols):
+    # single DataFrame construction per document, dtypes match the former
+    # cell by cell .loc growth (numeric columns end up float64)
+    db = pd.DataFrame(columns, columns=col_order)
+    num_cols = [col for col in col_order if not col in text_cols]
+    db[num_cols] = db[num_cols].astype(float)
+    return db
+
+
+def build_sent_db(columns):
+    return build_db_from_columns(columns, SENT_DB_COLUMNS, SENT_DB_TEXT_COLUMNS)
 
 
 def add_to_debug_df(tupple_list):
     global debug_db
-    idx = debug_db.shape[0]
-    for tupple in tupple_list:
-        debug_db.loc[idx, tupple[0]] = tupple[1]
+    parser = get_module_parser()
+    parser.add_to_debug_df(tupple_list)
+    debug_db = parser.debug_db
+
+
+NAR_BLOCK_RES = [
+    # [start:end]
+    ("whole", re.compile(defines.START_CHAR + ".*?" + defines.END_CHAR)),
+    # [start:]
+    ("start", re.compile(defines.START_CHAR + ".*")),
+    # [:end], a match can only begin at a line start: anchoring it keeps
+    # findall / sub from rescanning the line from every char
+    ("end", re.compile("^.*" + defines.END_CHAR, re.MULTILINE)),
+]
 
 
 def split_par_to_blocks_keep_order(par_db_idx):
-    par = par_db.loc[par_db_idx, "text"]
-    startNum = par.count(defines.START_CHAR)
-    endNum = par.count(defines.END_CHAR)
-    block_list = []  # holds tupple ("tag", "block string")
-    tag = ""
-    outside_nar = ""
-    splited = []
-
-    if startNum == 0 and endNum == 0:  # text is missing start and end symbols
-        if par_db.loc[par_db_idx, "is_nar"] == 0:  # entire paragraph is not narrative
-            tag = "not_nar"
-        else:  # entire paragraph is narrative
-            tag = "middle"
-        block_list.insert(0, (tag, par))
-    else:
-        # used for keeping original order between blocks
-        splited = re.split("&|#", par)
-        splited_clean = splited.copy()
-        for i, block in enumerate(splited):
-            if block_has_summary(block):  # TBD handle story summary
-                block,summ = extract_narrative_summary(block)
-            splited_clean[i] = clean_text(block)
-        my_regex = {
-            # [start:end]
-            "whole": defines.START_CHAR + ".*?" + defines.END_CHAR,
-            "start": defines.START_CHAR + ".*",  # [start:]
-            "end": ".*" + defines.END_CHAR,  # [:end]
-        }
-        outside_nar = par
-        for tag, regex in my_regex.items():
-            nar_blocks = re.findall(regex, outside_nar)
-            for j, block in enumerate(nar_blocks):
-                if len(block) != 0:
-                    block_idx = get_index_of_block_in_par(
-                        splited_clean, block, par_db_idx
-                    )
-                    # erase narrative blocks from splited paragraph
-                    splited[block_idx] = ""
-                    block_list.insert(block_idx, (tag, block))
-            outside_nar = re.sub(regex, "", outside_nar)
-
-        # handle the rest items in list - that must be non-narrative
-        for i, block in enumerate(splited):
-            if len(block) != 0:
-                if block_has_summary(block):
-                    block,summ = extract_narrative_summary(block)  # TBD handle story summary
-                block_idx = get_index_of_block_in_par(splited_clean, block, par_db_idx)
-                block_list.insert(block_idx, ("not_nar", block))
-    check_block_list(par, splited, block_list)
+    global debug_db
+    parser = get_module_parser()
+    block_list = parser.split_par_to_blocks_keep_order(par_db_idx)
+    debug_db = parser.debug_db
     return block_list
 
 
 def block_has_summary(text):
-    if not "%" in text:
-        return 0
-    else:
-        occur = text.count("%")
-        if occur % 2 == 0:
-            return 1
-        else:
-            add_to_debug_df([("odd_%", text)])
-            return 0
+    global debug_db
+    parser = get_module_parser()
+    res = parser.block_has_summary(text)
+    debug_db = parser.debug_db
+    return res
 
 
 def check_block_list(par, splited, block_list):
     global debug_db
-    for i, block in enumerate(block_list):
-        if not isinstance(block[1], str):
-            spl = "".join(splited) if isinstance(splited, list) else "empty"
-            add_to_debug_df(
-                [
-                    ("block_idx", i),
-                    ("empty_block", str(block)),
-                    ("splited", spl),
-                    ("par", par),
-                ]
-            )
-            # TBD remove
-            # debug_db.to_csv(os.path.join(os.getcwd(),defines.PATH_TO_DFS,"debug_db.csv"),index=False)
-            # sys.exit()
+    parser = get_module_parser()
+    parser.check_block_list(par, splited, block_list)
+    debug_db = parser.debug_db
+
 
+def get_block_position_map(splited_clean):
+    # cleaned block -> its first position in the paragraph, as list.index gives
+    position_map = {}
+    for i, cl_block in enumerate(splited_clean):
+        position_map.setdefault(cl_block, i)
+    return position_map
 
-def get_index_of_block_in_par(splited, block, par_db_idx):
-    cl_block = clean_text(block)
-    if not cl_block in splited:
-        print("{} \n par[{}]not in \n{}".format(par_db_idx, cl_block, splited))
+
+def get_index_of_block_in_par(position_map, cl_block, par_db_idx):
+    if not cl_block in position_map:
+        print("{} \n par[{}]not in \n{}".format(par_db_idx, cl_block, list(position_map)))
         return -1
     else:
-        return splited.index(cl_block)
+        return position_map[cl_block]
+
+
+def new_block_columns():
+    return {col: [] for col in BLOCK_DB_COLUMNS}
+
+
+def append_db_rows(db, rows_db):
+    if db is None or db.empty:
+        return rows_db
+    return pd.concat([db, rows_db], ignore_index=True)
 
 
 def get_last_nar_idx_from_block_db():
@@ -300,25 +326,27 @@ def get_last_nar_idx_from_block_db():
 
 
 def add_blocks_of_par_to_db(par_db_idx):
-    global par_db, block_db
-    is_nar = 0
-    block_list = split_par_to_blocks_keep_order(par_db_idx)
-    par_db_line = par_db.iloc[par_db_idx]
-    for i, tupple in enumerate(block_list):
-        curr_db_idx = block_db.shape[0]
-        curr_nar_idx = 0 if curr_db_idx == 0 else get_last_nar_idx_from_block_db()
-        if tupple[0] in ["start", "whole"]:
-            curr_nar_idx += 1
-        is_nar = 1 if tupple[0] != "not_nar" else 0
-        block_db.loc[curr_db_idx, "text"] = tupple[1]
-        block_db.loc[curr_db_idx, "is_nar"] = is_nar
-        block_db.loc[curr_db_idx, "doc_idx"] = par_db_line["doc_idx"]
-        block_db.loc[curr_db_idx, "par_idx_in_doc"] = par_db_line["par_idx_in_doc"]
-        block_db.loc[curr_db_idx, "par_pos_in_doc"] = par_db_line["par_pos_in_doc"]
-        block_db.loc[curr_db_idx, "par_db_idx"] = par_db_idx
-        block_db.loc[curr_db_idx, "par_type"] = par_db_line["par_type"]
-        block_db.loc[curr_db_idx, "block_type"] = tupple[0]
-        block_db.loc[curr_db_idx, "nar_idx"] = curr_nar_idx if is_nar else 0
+    # appends the blocks of par_db row par_db_idx to block_db, nar_idx
+    # continues from the blocks already there
+    global par_db, block_db, debug_db
+    parser = get_module_parser()
+    parser.block_columns = new_block_columns()
+    has_blocks = parser.block_db is not None and not parser.block_db.empty
+    parser.curr_nar_idx = get_last_nar_idx_from_block_db() if has_blocks else 0
+    parser.add_blocks_of_par_to_db(par_db_idx, par_db.iloc[par_db_idx])
+    block_db = append_db_rows(parser.block_db, build_db_from_columns(
+        parser.block_columns, BLOCK_DB_COLUMNS, BLOCK_DB_TEXT_COLUMNS
+    ))
+    debug_db = parser.debug_db
+
+
+def get_doc_csv_path(dir_name, doc_idx_from_name, db_name):
+    return os.path.join(
+        os.getcwd(),
+        defines.PATH_TO_DFS,
+        dir_name,
+        "{:02d}_{}.csv".format(doc_idx_from_name, db_name),
+    )
 
 
 def read_csv(base_filename):
@@ -336,66 +364,57 @@ def save_df_to_csv(df_name, is_global=True):
         return 0
 
 
+def build_doc_blocks():
+    global par_db, block_db, debug_db
+    parser = get_module_parser()
+    block_db = parser.build_blocks()
+    debug_db = parser.debug_db
+    return block_db
+
+
 def save_doc_blocks(dir_name,doc_idx_from_name):
     global par_db, block_db
-    block_db = pd.DataFrame()
-    par_db = pd.read_csv(
-        os.path.join(
-            os.getcwd(),
-            defines.PATH_TO_DFS,
-            dir_name,
-            "{:02d}_par_db.csv".format(doc_idx_from_name),
-        )
-    )
-    for i in par_db.index:
-        add_blocks_of_par_to_db(i)
+    par_db = pd.read_csv(get_doc_csv_path(dir_name, doc_idx_from_name, "par_db"))
+    build_doc_blocks()
     del par_db
-    block_db.to_csv(
-        os.path.join(
-            os.getcwd(),
-            defines.PATH_TO_DFS,
-            dir_name,
-            "{:02d}_block_db.csv".format(doc_idx_from_name),
-        ),
-        index=False,
-    )
+    block_db.to_csv(get_doc_csv_path(dir_name, doc_idx_from_name, "block_db"), index=False)
     del block_db
     # print("Doc {} blocks saved".format(doc_idx_from_name))
 
 
-
 def calc_position_in_grp(x):
     return ((x+1)/len(x))
 
 
-def save_doc_sentences(dir_name,doc_idx_from_name,merge_short_sent):
+def add_sentences_of_blocks_to_db(block_db_idx, merge_short_sent, sent_splitter="nltk"):
+    # appends the sentences of block_db row block_db_idx to sent_db
+    global block_db, sent_db, debug_db
+    parser = get_module_parser(merge_short_sent, sent_splitter)
+    parser.sent_columns = new_sent_columns()
+    parser.add_sentences_of_blocks_to_db(block_db_idx, block_db.iloc[block_db_idx])
+    sent_db = append_db_rows(globals().get("sent_db"), build_sent_db(parser.sent_columns))
+    debug_db = parser.debug_db
+
+
+def build_doc_sentences(merge_short_sent, sent_splitter="nltk"):
+    global block_db, sent_db, debug_db
+    parser = get_module_parser(merge_short_sent, sent_splitter)
+    sent_db = parser.build_sentences()
+    debug_db = parser.debug_db
+    return sent_db
+
+
+def save_doc_sentences(dir_name,doc_idx_from_name,merge_short_sent,sent_splitter="nltk"):
     global block_db, sent_db
-    sent_db = pd.DataFrame()
-    block_db = pd.read_csv(
-        os.path.join(
-            os.getcwd(),
-            defines.PATH_TO_DFS,
-            dir_name,
-            "{:02d}_block_db.csv".format(doc_idx_from_name),
-        )
-    )
-    for i in block_db.index:
-        add_sentences_of_blocks_to_db(i,merge_short_sent)
+    block_db = pd.read_csv(get_doc_csv_path(dir_name, doc_idx_from_name, "block_db"))
+    build_doc_sentences(merge_short_sent, sent_splitter)
     del block_db
-    # add_sent_column_for_labels()
-    get_dummies_is_client()
-    sent_db["sent_idx_in_par"] = sent_db.groupby("par_idx_in_doc").cumcount()
-    sent_db['sent_pos_in_par'] = sent_db.groupby('par_idx_in_doc')['sent_idx_in_par'].transform(calc_position_in_grp)
-    sent_db['sent_pos_in_doc'] = (sent_db.index.values+1)/len(sent_db.index)
-    sent_db.to_csv(
-        os.path.join(
-            os.getcwd(),
-            defines.PATH_TO_DFS,
-            dir_name,
-            "{:02d}_sent_db.csv".format(doc_idx_from_name),
-        ),
-        index=False,
-    )
+    write_doc_sentences(dir_name, doc_idx_from_name)
+
+
+def write_doc_sentences(dir_name, doc_idx_from_name):
+    global sent_db
+    sent_db.to_csv(get_doc_csv_path(dir_name, doc_idx_from_name, "sent_db"), index=False)
     doc_db_update_stat(
         get_dbIdx_by_docIdx(doc_idx_from_name), "sent_count", len(sent_db.index)
     )
@@ -408,61 +427,68 @@ def save_doc_sentences(dir_name,doc_idx_from_name,merge_short_sent):
     del sent_db
 
 
-def save_doc_paragraphs(dir_name,doc_idx_from_name):
-    global par_db, doc_db
-    inside_narrative = 0
-    doc_path = doc_db.loc[get_dbIdx_by_docIdx(doc_idx_from_name), "path"].values[0]
-    if os.path.isfile(doc_path):
-        doc = docx.Document(doc_path)
-    else:
+def get_doc_path(doc_idx_from_name):
+    global doc_db
+    return doc_db.loc[get_dbIdx_by_docIdx(doc_idx_from_name), "path"].values[0]
+
+
+def build_doc_paragraphs(doc_idx_from_name):
+    global par_db, debug_db
+    doc_path = get_doc_path(doc_idx_from_name)
+    if not os.path.isfile(doc_path):
         print("Error: doc {} does not exist".format(doc_idx_from_name))
+        return None
+    parser = get_module_parser()
+    par_db = parser.build_paragraphs(doc_path, doc_idx_from_name)
+    debug_db = parser.debug_db
+    set_doc_stats(doc_idx_from_name, parser.get_stats())
+    return par_db
+
+
+def save_doc_paragraphs(dir_name,doc_idx_from_name):
+    global par_db
+    if build_doc_paragraphs(doc_idx_from_name) is None:
         return
-    par_db = pd.DataFrame()
-    for i, par in enumerate(doc.paragraphs):
-        curr_par_db_idx = par_db.shape[0]
-        text, par_type = get_par_type_erase(par.text)
-        if not par_type in ["client", "therapist"]:
-            print(
-                "ERROR got par_type is {}, doc {}, par {} text\{}".format(
-                    par_type, doc_idx_from_name, i, text
-                )
-            )
-            os.exit()
-        if len(text) == 0:
-            continue
-        par_db.loc[curr_par_db_idx, "doc_idx"] = doc_idx_from_name
-        par_db.loc[curr_par_db_idx, "text"] = text
-        par_db.loc[curr_par_db_idx, "par_len"] = len(text)
-        par_db.loc[curr_par_db_idx, "par_type"] = par_type
-        par_db.loc[curr_par_db_idx, "par_idx_in_doc"] = i
-        if defines.START_CHAR in par.text:
-            inside_narrative = 1
-        par_db.loc[curr_par_db_idx, "is_nar"] = inside_narrative
-        # if [...# ] or [ ...&...#]
-        if par.text.rfind(defines.END_CHAR) > par.text.rfind(defines.START_CHAR):
-            inside_narrative = 0
-    par_db["par_pos_in_doc"] = (par_db.index.values+1)/len(par_db.index)
-    par_db.to_csv(
-        os.path.join(
-            os.getcwd(),
-            defines.PATH_TO_DFS,
-            dir_name,
-            "{:02d}_par_db.csv".format(doc_idx_from_name),
-        ),
-        index=False,
-    )
-    doc_db_update_stat(
-        get_dbIdx_by_docIdx(doc_idx_from_name), "par_count", len(doc.paragraphs)
-    )
+    par_db.to_csv(get_doc_csv_path(dir_name, doc_idx_from_name, "par_db"), index=False)
     del par_db
     # print("Doc {} paragraphs saved".format(doc_idx_from_name))
 
 
+def parse_doc_in_memory(dir_name, doc_idx_from_name, merge_short_sent, save_intermediate=True, sent_splitter="nltk"):
+    # paragraphs -> blocks -> sentences without reading the intermediate
+    # tables back from csv, par_db and block_db are only dumped on request
+    global debug_db
+    parsed = DocumentParser(merge_short_sent, sent_splitter=sent_splitter).parse(
+        get_doc_path(doc_idx_from_name), doc_idx_from_name
+    )
+    if parsed is None:
+        return
+    parsed.save(dir_name, save_intermediate)
+    set_doc_stats(doc_idx_from_name, parsed.stats)
+    debug_db = concat_debug_dbs(globals().get("debug_db"), parsed.debug_db)
+    print("{} sentences".format(len(parsed.sent_db.index)), end = ' ')
+
+
 def doc_db_update_stat(idx, val_name, value):
     global goc_db
     doc_db.loc[idx, val_name] = value
 
 
+def get_doc_stats(doc_idx):
+    global doc_db
+    db_idx = get_dbIdx_by_docIdx(doc_idx)
+    return [
+        (col, doc_db.loc[db_idx, col].values[0])
+        for col in DOC_STAT_COLUMNS
+        if col in doc_db.columns
+    ]
+
+
+def set_doc_stats(doc_idx, stats):
+    for val_name, value in stats:
+        doc_db_update_stat(get_dbIdx_by_docIdx(doc_idx), val_name, value)
+
+
 def save_all_docs_paragraphs():
     global doc_db
     for doc_idx in doc_db.index:
@@ -492,9 +518,7 @@ def save_docs_db(doc_path_list=None,dir_name=""):
 
 
 def remove_punctuation(_text):
-    punct = re.sub("\?", "", string.punctuation)  # keep ?
-    text = _text.translate(str.maketrans("", "", punct))
-    return text
+    return _text.translate(PUNCT_TABLE)
 
 
 def get_labeled_files():
@@ -521,9 +545,8 @@ def replace_brackets(text, replace=""):  # remove [..] , (..), [..[.]..]
 
 
 def clean_text(text):
-    text_, _ = extract_narrative_summary(text)
-    text_ = remove_punctuation(text_)
-    return text_
+    # extract_narrative_summary + remove_punctuation
+    return text_normalizer.sent_normalizer(text)
 
 
 def remove_symbols(text):
@@ -532,9 +555,9 @@ def remove_symbols(text):
 
 def extract_narrative_summary(text):
     text_ = text
-    summary = re.findall("%.*?%", text_)
+    summary = text_normalizer.SUMMARY_RE.findall(text_)
     for i in summary:
-        text_ = re.sub(i, "", text_)
+        text_ = text_.replace(i, "")
     return text_, summary
 
 
@@ -554,17 +577,459 @@ def get_par_type_erase(par):
     return par, par_type
 
 
-def parse_all_docs(dir_name,merge_short_sent,doc_path_list=None):
+def get_n_workers(n_jobs):
+    if n_jobs is None or n_jobs == 0:
+        return 1
+    if n_jobs < 0:  # same convention as sklearn: -1 means all cores
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return n_jobs
+
+
+### DOCUMENT PARSER ###
+
+
+class ParsedDoc:
+    # tables and statistics of one parsed transcript
+    def __init__(self, doc_idx, path, par_db, block_db, sent_db, debug_db, stats):
+        self.doc_idx = doc_idx
+        self.path = path
+        self.par_db = par_db
+        self.block_db = block_db
+        self.sent_db = sent_db
+        self.debug_db = debug_db
+        self.stats = stats  # [(stat name, value)] in DOC_STAT_COLUMNS order
+
+    def save(self, dir_name, save_intermediate=True):
+        if save_intermediate:
+            self.par_db.to_csv(get_doc_csv_path(dir_name, self.doc_idx, "par_db"), index=False)
+            self.block_db.to_csv(get_doc_csv_path(dir_name, self.doc_idx, "block_db"), index=False)
+        self.sent_db.to_csv(get_doc_csv_path(dir_name, self.doc_idx, "sent_db"), index=False)
+
+
+class DocumentParser:
+    # owns the tables of the document being parsed, nothing is shared through
+    # module globals: use one parser per thread / concurrently parsed document
+    def __init__(self, merge_short_sent=False, debug_db=None, sent_splitter="nltk"):
+        self.merge_short_sent = merge_short_sent
+        self.sent_splitter = sent_splitter
+        self.debug_db = pd.DataFrame() if debug_db is None else debug_db
+        self.par_db = None
+        self.block_db = None
+        self.sent_db = None
+        self.stats = {}
+
+    def parse(self, path, doc_idx=None):
+        if doc_idx is None:
+            doc_idx = common_utils.get_doc_idx_from_name(path)
+        if not os.path.isfile(path):
+            print("Error: doc {} does not exist".format(doc_idx))
+            return None
+        self.debug_db = pd.DataFrame()
+        self.stats = {}
+        par_db = self.build_paragraphs(path, doc_idx)
+        self.par_db = par_db.assign(par_pos_in_doc=get_csv_read_floats(par_db["par_pos_in_doc"]))
+        block_db = self.build_blocks()
+        self.block_db = block_db.assign(par_pos_in_doc=get_csv_read_floats(block_db["par_pos_in_doc"]))
+        self.build_sentences()
+        return ParsedDoc(
+            doc_idx,
+            path,
+            par_db,
+            block_db,
+            self.sent_db,
+            self.debug_db,
+            self.get_stats(),
+        )
+
+    def get_stats(self):
+        return [(col, self.stats[col]) for col in DOC_STAT_COLUMNS if col in self.stats]
+
+    def add_to_debug_df(self, tupple_list):
+        idx = self.debug_db.shape[0]
+        for tupple in tupple_list:
+            self.debug_db.loc[idx, tupple[0]] = tupple[1]
+
+    ### paragraphs ###
+
+    def build_paragraphs(self, path, doc_idx_from_name):
+        inside_narrative = 0
+        doc = docx.Document(path)
+        par_db = pd.DataFrame()
+        for i, par in enumerate(doc.paragraphs):
+            curr_par_db_idx = par_db.shape[0]
+            text, par_type = get_par_type_erase(par.text)
+            if not par_type in ["client", "therapist"]:
+                print(
+                    "ERROR got par_type is {}, doc {}, par {} text\{}".format(
+                        par_type, doc_idx_from_name, i, text
+                    )
+                )
+                os.exit()
+            if len(text) == 0:
+                continue
+            par_db.loc[curr_par_db_idx, "doc_idx"] = doc_idx_from_name
+            par_db.loc[curr_par_db_idx, "text"] = text
+            par_db.loc[curr_par_db_idx, "par_len"] = len(text)
+            par_db.loc[curr_par_db_idx, "par_type"] = par_type
+            par_db.loc[curr_par_db_idx, "par_idx_in_doc"] = i
+            if defines.START_CHAR in par.text:
+                inside_narrative = 1
+            par_db.loc[curr_par_db_idx, "is_nar"] = inside_narrative
+            # if [...# ] or [ ...&...#]
+            if par.text.rfind(defines.END_CHAR) > par.text.rfind(defines.START_CHAR):
+                inside_narrative = 0
+        par_db["par_pos_in_doc"] = (par_db.index.values+1)/len(par_db.index)
+        self.stats["par_count"] = len(doc.paragraphs)
+        self.par_db = par_db
+        return par_db
+
+    ### blocks ###
+
+    def block_has_summary(self, text):
+        if not "%" in text:
+            return 0
+        else:
+            occur = text.count("%")
+            if occur % 2 == 0:
+                return 1
+            else:
+                self.add_to_debug_df([("odd_%", text)])
+                return 0
+
+    def check_block_list(self, par, splited, block_list):
+        for i, block in enumerate(block_list):
+            if not isinstance(block[1], str):
+                spl = "".join(splited) if isinstance(splited, list) else "empty"
+                self.add_to_debug_df(
+                    [
+                        ("block_idx", i),
+                        ("empty_block", str(block)),
+                        ("splited", spl),
+                        ("par", par),
+                    ]
+                )
+
+    def split_par_to_blocks_keep_order(self, par_db_idx):
+        par = self.par_db.loc[par_db_idx, "text"]
+        startNum = par.count(defines.START_CHAR)
+        endNum = par.count(defines.END_CHAR)
+        block_list = []  # holds tupple ("tag", "block string")
+        tag = ""
+        outside_nar = ""
+        splited = []
+
+        if startNum == 0 and endNum == 0:  # text is missing start and end symbols
+            if self.par_db.loc[par_db_idx, "is_nar"] == 0:  # entire paragraph is not narrative
+                tag = "not_nar"
+            else:  # entire paragraph is narrative
+                tag = "middle"
+            block_list.insert(0, (tag, par))
+        else:
+            # used for keeping original order between blocks
+            splited = re.split("&|#", par)
+            splited_clean = splited.copy()
+            for i, block in enumerate(splited):
+                if self.block_has_summary(block):  # TBD handle story summary
+                    block,summ = extract_narrative_summary(block)
+                splited_clean[i] = clean_text(block)
+            position_map = get_block_position_map(splited_clean)
+            outside_nar = par
+            for tag, regex in NAR_BLOCK_RES:
+                nar_blocks = regex.findall(outside_nar)
+                for j, block in enumerate(nar_blocks):
+                    if len(block) != 0:
+                        block_idx = get_index_of_block_in_par(
+                            position_map, clean_text(block), par_db_idx
+                        )
+                        # erase narrative blocks from splited paragraph
+                        splited[block_idx] = ""
+                        block_list.insert(block_idx, (tag, block))
+                outside_nar = regex.sub("", outside_nar)
+
+            # handle the rest items in list - that must be non-narrative
+            for i, block in enumerate(splited):
+                if len(block) != 0:
+                    if self.block_has_summary(block):
+                        block,summ = extract_narrative_summary(block)  # TBD handle story summary
+                    # splited_clean[i] is already the cleaned form of this block
+                    block_idx = get_index_of_block_in_par(
+                        position_map, splited_clean[i], par_db_idx
+                    )
+                    block_list.insert(block_idx, ("not_nar", block))
+        self.check_block_list(par, splited, block_list)
+        return block_list
+
+    def add_blocks_of_par_to_db(self, par_db_idx, par_db_line):
+        # nar_idx runs over the whole document: it is incremented by every block
+        # opening a narrative ("start" / "whole") and kept by the blocks after it
+        block_columns = self.block_columns
+        block_list = self.split_par_to_blocks_keep_order(par_db_idx)
+        for i, tupple in enumerate(block_list):
+            if tupple[0] in ["start", "whole"]:
+                self.curr_nar_idx += 1
+            is_nar = 1 if tupple[0] != "not_nar" else 0
+            block_columns["text"].append(tupple[1])
+            block_columns["is_nar"].append(is_nar)
+            block_columns["doc_idx"].append(par_db_line["doc_idx"])
+            block_columns["par_idx_in_doc"].append(par_db_line["par_idx_in_doc"])
+            block_columns["par_pos_in_doc"].append(par_db_line["par_pos_in_doc"])
+            block_columns["par_db_idx"].append(par_db_idx)
+            block_columns["par_type"].append(par_db_line["par_type"])
+            block_columns["block_type"].append(tupple[0])
+            block_columns["nar_idx"].append(self.curr_nar_idx if is_nar else 0)
+
+    def build_blocks(self):
+        self.block_columns = new_block_columns()
+        self.curr_nar_idx = 0
+        for i, par_db_line in enumerate(self.par_db.to_dict("records")):
+            self.add_blocks_of_par_to_db(i, par_db_line)
+        self.block_db = build_db_from_columns(
+            self.block_columns, BLOCK_DB_COLUMNS, BLOCK_DB_TEXT_COLUMNS
+        )
+        del self.block_columns
+        return self.block_db
+
+    ### sentences ###
+
+    def add_sentences_of_blocks_to_db(self, block_db_idx, block_line):
+        sent_columns = self.sent_columns
+        block = block_line["text"]
+        sent_list = split_block_to_sentences(block, self.merge_short_sent, self.sent_splitter)
+        for i, sentence in enumerate(sent_list):
+            if not text_contains_char(sentence):
+                # print("Sentence wihtout char! \n {}".format(sentence))
+                self.add_to_debug_df([("block_no_char", block), ("sent_no_char", sentence)])
+                continue
+            sent_columns["is_question"].append(1 if "?" in sentence else 0)
+            sent_columns["text"].append(re.sub(r'\?','',sentence))
+            sent_columns["sent_idx_in_block"].append(i)
+            sent_columns["block_idx"].append(block_db_idx)
+            sent_columns["sent_len"].append(len(sentence))
+            for col in SENT_DB_BLOCK_COLUMNS:
+                sent_columns[col].append(block_line[col])
+
+    def build_sentences(self):
+        self.sent_columns = new_sent_columns()
+        for i, block_line in enumerate(self.block_db.to_dict("records")):
+            self.add_sentences_of_blocks_to_db(i, block_line)
+        sent_db = build_sent_db(self.sent_columns)
+        del self.sent_columns
+        sent_db["is_client"] = np.where(sent_db["par_type"] == "client", 1, 0)
+        sent_db["sent_idx_in_par"] = sent_db.groupby("par_idx_in_doc").cumcount()
+        sent_db['sent_pos_in_par'] = sent_db.groupby('par_idx_in_doc')['sent_idx_in_par'].transform(calc_position_in_grp)
+        sent_db['sent_pos_in_doc'] = (sent_db.index.values+1)/len(sent_db.index)
+        self.stats["sent_count"] = len(sent_db.index)
+        self.stats["nar_sent_count"] = len(sent_db[sent_db["is_nar"] == 1].index)
+        self.sent_db = sent_db
+        return sent_db
+
+
+def get_csv_read_floats(values):
+    # the floats as the csv to csv chain read them back from NN_*_db.csv:
+    # pandas parses some of them (par_pos_in_doc) a few ulps off the written
+    # value, kept so the csv outputs stay byte identical to the chain
+    column = pd.Series(values, name="value").to_csv(index=False)
+    return pd.read_csv(io.StringIO(column))["value"].values
+
+
+def get_module_parser(merge_short_sent=False, sent_splitter="nltk"):
+    # parser working on the module tables, backs the function API above
+    parser = DocumentParser(merge_short_sent, globals().get("debug_db"), sent_splitter)
+    parser.par_db = globals().get("par_db")
+    parser.block_db = globals().get("block_db")
+    return parser
+
+
+def concat_debug_dbs(debug_db_, doc_debug_db):
+    if debug_db_ is None or debug_db_.empty:
+        return doc_debug_db
+    if doc_debug_db.empty:
+        return debug_db_
+    return pd.concat([debug_db_, doc_debug_db], ignore_index=True)
+
+
+### INCREMENTAL RE-PARSE ###
+
+
+def get_file_hash(path):
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_parse_params(merge_short_sent, sent_splitter="nltk"):
+    # everything besides the .docx content that changes the parse output
+    return {
+        "merge_short_sent": bool(merge_short_sent),
+        "sent_splitter": sent_splitter,
+        "version": PARSER_VERSION,
+    }
+
+
+def get_manifest_path(dir_name):
+    return os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name, PARSE_MANIFEST)
+
+
+def load_parse_manifest(dir_name):
+    path = get_manifest_path(dir_name)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r") as fp:
+        return json.load(fp)
+
+
+def save_parse_manifest(dir_name, manifest):
+    path = get_manifest_path(dir_name)
+    with open(path + ".tmp", "w") as fp:
+        json.dump(manifest, fp, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def get_doc_output_names(save_intermediate=True):
+    return ["par_db", "block_db", "sent_db"] if save_intermediate else ["sent_db"]
+
+
+def doc_outputs_exist(dir_name, doc_idx, save_intermediate=True):
+    return all(
+        os.path.isfile(get_doc_csv_path(dir_name, doc_idx, db_name))
+        for db_name in get_doc_output_names(save_intermediate)
+    )
+
+
+def is_doc_parse_cached(manifest, dir_name, doc_idx, doc_hash, params, save_intermediate=True):
+    # the csv files on disk only count if the parse of this entry wrote them,
+    # files left by an older parse of the doc are not up to date
+    entry = manifest.get(str(doc_idx))
+    return (
+        entry is not None
+        and entry["hash"] == doc_hash
+        and entry["params"] == params
+        and set(get_doc_output_names(save_intermediate)) <= set(entry.get("outputs", []))
+        and doc_outputs_exist(dir_name, doc_idx, save_intermediate)
+    )
+
+
+def drop_manifest_entries(dir_name, doc_indices):
+    # a parse rewrites the csv files of the doc, its entry is out of date
+    # until the new one is saved: a later cached run must not match the new
+    # files against it
+    manifest = load_parse_manifest(dir_name)
+    if any(str(doc_idx) in manifest for doc_idx in doc_indices):
+        for doc_idx in doc_indices:
+            manifest.pop(str(doc_idx), None)
+        save_parse_manifest(dir_name, manifest)
+
+
+def get_manifest_entry(doc_hash, params, stats, doc_debug_db, save_intermediate=True):
+    debug_rows = [
+        {key: val for key, val in row.items() if not pd.isna(val)}
+        for row in doc_debug_db.to_dict("records")
+    ]
+    return {
+        "hash": doc_hash,
+        "params": params,
+        "outputs": get_doc_output_names(save_intermediate),
+        "stats": [
+            (val_name, common_utils.convert_item_to_python_types(value))
+            for val_name, value in stats
+        ],
+        "debug_columns": doc_debug_db.columns.tolist(),
+        "debug": debug_rows,
+    }
+
+
+def restore_from_manifest_entry(entry):
+    doc_debug_db = pd.DataFrame(entry["debug"], columns=entry["debug_columns"])
+    return entry["stats"], doc_debug_db
+
+
+### PARSE DRIVER ###
+
+
+def parse_doc_worker(args):
+    # may run in a worker process: module globals are private to that process
+    global doc_db, debug_db
+    # the manifest is left to parse_all_docs, workers do not write it
+    dir_name, doc_idx, merge_short_sent, doc_db_, save_intermediate, sent_splitter = args
+    doc_db = doc_db_
+    debug_db = pd.DataFrame()
+    parse_doc_in_memory(dir_name, doc_idx, merge_short_sent, save_intermediate, sent_splitter)
+    return doc_idx, get_doc_stats(doc_idx), debug_db
+
+
+def parse_docs(dir_name, doc_indices, merge_short_sent, n_workers, save_intermediate=True, sent_splitter="nltk"):
+    global doc_db
+    tasks = [
+        (dir_name, int(doc_idx), merge_short_sent, doc_db, save_intermediate, sent_splitter)
+        for doc_idx in doc_indices
+    ]
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for i, (doc_idx, stats, doc_debug_db) in enumerate(
+                executor.map(parse_doc_worker, tasks)
+            ):
+                print("{}".format(i), end=' ')
+                yield doc_idx, stats, doc_debug_db
+    else:
+        for i, task in enumerate(tasks):
+            res = parse_doc_worker(task)
+            print("{}".format(i), end=' ')
+            yield res
+
+
+def parse_all_docs(dir_name,merge_short_sent,doc_path_list=None,n_jobs=1,use_cache=False,save_intermediate=True,sent_splitter="nltk"):
     global doc_db, debug_db
     save_docs_db(doc_path_list,dir_name)
     doc_db_path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name,"doc_db.csv")
     doc_db = pd.read_csv(doc_db_path)
-    debug_db = pd.DataFrame()
     doc_indices = doc_db["doc_idx_from_name"].values
     doc_indices.sort()
-    for i, doc_idx in enumerate(doc_indices):
-        parse_doc(dir_name,int(doc_idx),merge_short_sent)
-        print("{}".format(i),end=' ')
+    if use_cache:
+        params = get_parse_params(merge_short_sent, sent_splitter)
+        manifest = load_parse_manifest(dir_name)
+        doc_hashes = {
+            int(doc_idx): get_file_hash(path)
+            for doc_idx, path in zip(doc_db["doc_idx_from_name"], doc_db["path"])
+        }
+    else:
+        drop_manifest_entries(dir_name, doc_indices)
+    doc_results = {}
+    to_parse = []
+    for doc_idx in doc_indices:
+        doc_idx = int(doc_idx)
+        if use_cache and is_doc_parse_cached(
+            manifest, dir_name, doc_idx, doc_hashes[doc_idx], params, save_intermediate
+        ):
+            doc_results[doc_idx] = restore_from_manifest_entry(manifest[str(doc_idx)])
+        else:
+            to_parse.append(doc_idx)
+    if use_cache:
+        print("{} docs unchanged, parsing {}".format(len(doc_results), len(to_parse)))
+        # a parse stopped halfway must not leave the old entries
+        for doc_idx in to_parse:
+            manifest.pop(str(doc_idx), None)
+        drop_manifest_entries(dir_name, to_parse)
+    n_workers = min(get_n_workers(n_jobs), max(1, len(to_parse)))
+    for doc_idx, stats, doc_debug_db in parse_docs(
+        dir_name, to_parse, merge_short_sent, n_workers, save_intermediate, sent_splitter
+    ):
+        doc_results[doc_idx] = (stats, doc_debug_db)
+        if use_cache:
+            manifest[str(doc_idx)] = get_manifest_entry(
+                doc_hashes[doc_idx], params, stats, doc_debug_db, save_intermediate
+            )
+    # merge in doc order, so the output does not depend on cache hits or
+    # on which worker finished first
+    debug_db = pd.DataFrame()
+    for doc_idx in doc_indices:
+        stats, doc_debug_db = doc_results[int(doc_idx)]
+        set_doc_stats(doc_idx, stats)
+        if not doc_debug_db.empty:
+            debug_db = pd.concat([debug_db, doc_debug_db], ignore_index=True)
+    if use_cache:
+        save_parse_manifest(dir_name, manifest)
     doc_db.to_csv(
         os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name,"doc_db.csv"), index=False
     )
@@ -575,15 +1040,34 @@ def parse_all_docs(dir_name,merge_short_sent,doc_path_list=None):
     del debug_db
 
 
-def parse_doc(dir_name,doc_idx, merge_short_sent, single=False):
+def parse_doc(dir_name,doc_idx, merge_short_sent, single=False, use_cache=False, save_intermediate=True, sent_splitter="nltk"):
     global doc_db, debug_db
+    if use_cache and not single:
+        raise ValueError("use_cache needs single=True, parse_all_docs caches the docs it parses")
     if single:
         doc_db_path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name, "doc_db.csv")
         doc_db = pd.read_csv(doc_db_path)
         debug_db = pd.DataFrame()
-    save_doc_paragraphs(dir_name,doc_idx)
-    save_doc_blocks(dir_name,doc_idx)
-    save_doc_sentences(dir_name,doc_idx,merge_short_sent)
+    if single and use_cache:
+        manifest = load_parse_manifest(dir_name)
+        params = get_parse_params(merge_short_sent, sent_splitter)
+        doc_hash = get_file_hash(
+            doc_db.loc[get_dbIdx_by_docIdx(doc_idx), "path"].values[0]
+        )
+    if single and use_cache and is_doc_parse_cached(
+        manifest, dir_name, doc_idx, doc_hash, params, save_intermediate
+    ):
+        stats, debug_db = restore_from_manifest_entry(manifest[str(doc_idx)])
+        set_doc_stats(doc_idx, stats)
+        print("Doc {} unchanged".format(doc_idx), end=' ')
+    else:
+        drop_manifest_entries(dir_name, [doc_idx])
+        parse_doc_in_memory(dir_name, doc_idx, merge_short_sent, save_intermediate, sent_splitter)
+        if single and use_cache:
+            manifest[str(doc_idx)] = get_manifest_entry(
+                doc_hash, params, get_doc_stats(doc_idx), debug_db, save_intermediate
+            )
+            save_parse_manifest(dir_name, manifest)
     if single:
         debug_db.to_csv(
             os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name, "debug_db.csv"), index=False
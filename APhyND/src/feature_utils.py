@@ -1,4 +1,7 @@
 import time
+import re
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from scipy.sparse import hstack,vstack
 
 from sklearn.model_selection import LeaveOneGroupOut, LeavePGroupsOut, GroupKFold
@@ -53,40 +56,320 @@ regressors_type = [
 scores_df = pd.DataFrame(dtype=float)
 
 
+FASTTEXT_MODEL_PATH = './external_src/cc.he.300.bin'
+# fastText models by dimension, each loaded once per process. Loaded before
+# the embedding workers fork, they are shared copy on write
+ft_models = {}
+
+
 def load_fasstex_model():
-    ft = fasttext.load_model('./external_src/cc.he.300.bin')
-    return ft
+    return get_fasttext_model(300)
+
+
+def get_fasttext_model_path(dim=300):
+    return FASTTEXT_MODEL_PATH.replace('.300.', '.{}.'.format(dim))
+
+
+def get_fasttext_model(dim=300):
+    if not dim in ft_models:
+        path = get_fasttext_model_path(dim)
+        if not os.path.isfile(path):
+            save_reduced_fasttext_model(dim)
+        ft_models[dim] = fasttext.load_model(path)
+    return ft_models[dim]
+
+
+def save_reduced_fasttext_model(dim):
+    # the PCA of reduce_model runs once per dim on a copy of its own, the
+    # shared full model is not changed
+    ft = fasttext.load_model(FASTTEXT_MODEL_PATH)
+    fasttext.util.reduce_model(ft, dim)
+    path = get_fasttext_model_path(dim)
+    ft.save_model(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    print("reduced fasttext model saved: {}".format(path))
 
 
 ### EMBEDDED VECTORS ###
 
-def get_and_save_sent_vectors(dir_name, doc_idx, ft, dim=300):
-    sent_db = pd.read_csv(os.path.join(
-        os.getcwd(), defines.PATH_TO_DFS, dir_name, "{:02d}_sent_db.csv".format(doc_idx)))
-    sent_vec_db = get_vector_per_sentence(sent_db, ft, dim)
-    sent_vec_db.to_csv(os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name,
-                       "{:02d}_sent_vec{}_db.csv".format(doc_idx, dim)), index=False)
+def get_and_save_sent_vectors(dir_name, doc_idx, ft, dim=300, sent_db=None, word_cache=False):
+    if sent_db is None:
+        sent_db = read_sent_texts(dir_name, doc_idx)
+    if word_cache:
+        sent_vectors = get_cached_sent_vectors(sent_db['text'], ft, dim)
+    else:
+        sent_vectors = get_sent_vectors(sent_db['text'], ft, dim)
+    np.save(os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name,
+            "{:02d}_sent_vec{}.npy".format(doc_idx, dim)), sent_vectors)
     print("{} doc sent saved".format(doc_idx, dim))
+    return sent_vectors
+
+
+def get_sent_vectors(texts, ft, dim=300):
+    # float32 (n_sent, dim) array filled in place, straight from the text
+    # column instead of building a row Series per sentence
+    if ft.get_dimension() != dim:
+        ft = get_fasttext_model(dim)  # reduced model from disk, ft is not changed
+    sent_vectors = np.empty((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        sent_vectors[i] = ft.get_sentence_vector(text)
+    return sent_vectors
+
+
+# word vector cache: fastText sentence vectors of an unsupervised model are
+# the average of the L2 normalized vectors of the whitespace separated words,
+# words with a zero vector are skipped. Each unique word is looked up once
+# per model and kept normalized in a matrix, sentences are averaged from it
+WORD_RE = re.compile(r"[^ \t\n\v\f\r]+")  # the separators of fastText, not str.split
+word_vectors = {}  # model -> ({word: row}, normalized float32 matrix)
+
+
+def add_word_vectors(texts, ft):
+    # looks up the words of texts that are not cached yet
+    word_index, matrix = word_vectors.get(ft, ({}, np.zeros((0, ft.get_dimension()), dtype=np.float32)))
+    new_words = []
+    for text in texts:
+        for word in WORD_RE.findall(text):
+            if not word in word_index:
+                word_index[word] = len(word_index)
+                new_words.append(word)
+    if len(new_words) > 0:
+        new_vectors = np.array([ft.get_word_vector(word) for word in new_words], dtype=np.float32)
+        norms = np.linalg.norm(new_vectors, axis=1)
+        new_vectors[norms > 0] /= norms[norms > 0, None]
+        matrix = np.concatenate([matrix, new_vectors])
+    word_vectors[ft] = (word_index, matrix)
+    return word_index, matrix
+
+
+def get_cached_sent_vectors(texts, ft, dim=300):
+    # same vectors as get_sent_vectors up to float32 rounding: one sparse
+    # (sentence x word) count matrix times the normalized word matrix
+    if ft.get_dimension() != dim:
+        ft = get_fasttext_model(dim)
+    word_index, matrix = add_word_vectors(texts, ft)
+    rows = [[word_index[word] for word in WORD_RE.findall(text)] for text in texts]
+    counts = sparse.csr_matrix(
+        (np.ones(sum(len(row) for row in rows), dtype=np.float32),
+         np.array([i for row in rows for i in row], dtype=np.int64),
+         np.cumsum([0] + [len(row) for row in rows])),
+        shape=(len(rows), len(matrix)))
+    n_valid = counts @ (matrix.any(axis=1)).astype(np.float32)
+    sent_vectors = np.asarray(counts @ matrix, dtype=np.float32)
+    sent_vectors[n_valid > 0] /= n_valid[n_valid > 0, None]
+    return sent_vectors
 
 
 def get_vector_per_sentence(db, ft, dim=300):
-    if (dim < 300):
-        fasttext.util.reduce_model(ft, dim)
-    sent_vectors = [ft.get_sentence_vector(
-        row['text']) for index, row in db.iterrows()]
-    # sent_array = np.vstack(sent_vectors)
-    sent_vec_db = pd.DataFrame(sent_vectors)
-    return sent_vec_db
-
-
-def get_and_save_doc_similarity(dir_name, doc_idx, dim=300):
-    sent_vec_db = pd.read_csv(os.path.join(os.getcwd(
-    ), defines.PATH_TO_DFS, dir_name, "{:02d}_sent_vec{}_db.csv".format(doc_idx, dim)))
-    sim_db = pd.DataFrame(cosine_similarity(sent_vec_db))
-    sim_db.to_csv(os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name,
-                  "{:02d}_sent_sim_vec{}_db.csv".format(doc_idx, dim)), index=False)
+    return pd.DataFrame(get_sent_vectors(db['text'], ft, dim))
+
+
+def read_sent_texts(dir_name, doc_idx):
+    return pd.read_csv(os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name,
+                       "{:02d}_sent_db.csv".format(doc_idx)), usecols=['text'])
+
+
+def save_doc_sent_vectors_worker(args):
+    dir_name, doc_idx, dim, word_cache = args
+    sent_vectors = get_and_save_sent_vectors(
+        dir_name, doc_idx, get_fasttext_model(dim), dim, word_cache=word_cache)
+    get_and_save_doc_similarity(dir_name, doc_idx, dim, sent_vectors)
+    return doc_idx
+
+
+def get_fork_context():
+    # forked workers inherit the loaded model, with spawn every worker
+    # loads a copy of its own
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+
+def save_docs_sent_vectors(dir_name, doc_indices, dim=300, n_workers=1, word_cache=False):
+    # sentence vectors and similarity band of many documents, the model is
+    # loaded once here before the workers start. With word_cache the corpus
+    # vocabulary is looked up here too, so the workers share the word vectors
+    ft = get_fasttext_model(dim)
+    if word_cache:
+        word_index, matrix = add_word_vectors(itertools.chain.from_iterable(
+            read_sent_texts(dir_name, int(doc_idx))['text'] for doc_idx in doc_indices), ft)
+        print("{} words cached".format(len(word_index)))
+    tasks = [(dir_name, int(doc_idx), dim, word_cache) for doc_idx in doc_indices]
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=get_fork_context()) as executor:
+            for i, doc_idx in enumerate(executor.map(save_doc_sent_vectors_worker, tasks)):
+                print("{}".format(i), end=' ')
+    else:
+        for i, task in enumerate(tasks):
+            save_doc_sent_vectors_worker(task)
+            print("{}".format(i), end=' ')
+    print("\n{} docs embedded".format(len(tasks)))
+
+
+def load_sent_vectors(path, doc_idx, dim=300):
+    # memory mapped float32 vectors of a document directory, read only and
+    # without a copy. Rows of the corpus store when it is not older than the
+    # document file, documents saved before the .npy are read from csv,
+    # None when the document has no vectors
+    file_name = os.path.join(path, "{:02d}_sent_vec{}.npy".format(doc_idx, dim))
+    matrix, offsets = open_corpus_vectors(path, dim)
+    if doc_idx in offsets and not (os.path.isfile(file_name) and os.path.getmtime(
+            file_name) > os.path.getmtime(get_corpus_vectors_path(path, dim))):
+        start, end = offsets[doc_idx]
+        return matrix[start:end]
+    if os.path.isfile(file_name):
+        return np.load(file_name, mmap_mode='r')
+    csv_name = os.path.join(path, "{:02d}_sent_vec{}_db.csv".format(doc_idx, dim))
+    if os.path.isfile(csv_name):
+        return pd.read_csv(csv_name).values.astype(np.float32)
+    return None
+
+
+### CORPUS VECTOR STORE ###
+
+# all sentence vectors of a directory in one float32 matrix, documents are
+# row ranges kept in an index csv: doc_idx, start, end. Opened once per
+# process with np.load(mmap_mode='r'), so workers share the page cache
+corpus_vectors = {}  # (path, dim) -> (mtimes, matrix, {doc_idx: (start, end)})
+
+
+def get_corpus_vectors_path(path, dim=300):
+    return os.path.join(path, "corpus_sent_vec{}.npy".format(dim))
+
+
+def get_corpus_index_path(path, dim=300):
+    return os.path.join(path, "corpus_sent_vec{}_index.csv".format(dim))
+
+
+def build_corpus_vectors(dir_name, doc_indices=[], dim=300):
+    # copies the per document vectors into the corpus matrix one document at
+    # a time, all documents of the directory when doc_indices is empty
+    path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name)
+    if len(doc_indices) == 0:
+        doc_indices = sorted(common_utils.get_doc_idx_from_name(name) for name in glob.glob(
+            os.path.join(path, "[0-9]*_sent_vec{}.npy".format(dim))))
+    doc_vectors = [np.load(os.path.join(path, "{:02d}_sent_vec{}.npy".format(doc_idx, dim)),
+                           mmap_mode='r') for doc_idx in doc_indices]
+    lengths = np.array([len(vectors) for vectors in doc_vectors], dtype=int)
+    index_db = pd.DataFrame({'doc_idx': doc_indices, 'start': np.cumsum(lengths) - lengths,
+                             'end': np.cumsum(lengths)})
+    tmp_path = get_corpus_vectors_path(path, dim) + ".tmp"
+    matrix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                       shape=(lengths.sum(), dim))
+    for start, end, vectors in zip(index_db['start'], index_db['end'], doc_vectors):
+        matrix[start:end] = vectors
+    matrix.flush()
+    del matrix
+    # both files are complete before either replaces the old store, the
+    # index goes last: open_corpus_vectors ignores an index that does not
+    # match the matrix
+    tmp_index_path = get_corpus_index_path(path, dim) + ".tmp"
+    index_db.to_csv(tmp_index_path, index=False)
+    os.replace(tmp_path, get_corpus_vectors_path(path, dim))
+    os.replace(tmp_index_path, get_corpus_index_path(path, dim))
+    corpus_vectors.pop((path, dim), None)
+    print("corpus vectors saved: {} sentences of {} docs".format(lengths.sum(), len(doc_indices)))
+    return index_db
+
+
+def open_corpus_vectors(path, dim=300):
+    # (memory mapped corpus matrix, {doc_idx: (start, end)}), (None, {})
+    # when the directory has no corpus store
+    file_name = get_corpus_vectors_path(path, dim)
+    index_name = get_corpus_index_path(path, dim)
+    if not os.path.isfile(file_name) or not os.path.isfile(index_name):
+        return None, {}
+    mtimes = (os.path.getmtime(file_name), os.path.getmtime(index_name))
+    if not (path, dim) in corpus_vectors or corpus_vectors[(path, dim)][0] != mtimes:
+        index_db = pd.read_csv(index_name)
+        matrix = np.load(file_name, mmap_mode='r')
+        if index_db['end'].values.max(initial=0) != len(matrix):
+            # the build stopped between the matrix and the index
+            print("corpus vectors index does not match {}, ignored".format(file_name))
+            return None, {}
+        offsets = {doc_idx: (start, end) for doc_idx, start, end in zip(
+            index_db['doc_idx'], index_db['start'], index_db['end'])}
+        corpus_vectors[(path, dim)] = (mtimes, matrix, offsets)
+    return corpus_vectors[(path, dim)][1:]
+
+
+def nearest_corpus_sentences(dir_name, doc_idx, sent_idx, top_n=10, dim=300, chunk_size=20000):
+    # the top_n sentences of the corpus most similar to sentence sent_idx of
+    # doc_idx: db of doc_idx, sent_idx, similarity. The matrix is scanned in
+    # chunks so it is never loaded whole
+    matrix, offsets = open_corpus_vectors(
+        os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name), dim)
+    row_idx = offsets[doc_idx][0] + sent_idx
+    query = normalize(np.asarray(matrix[[row_idx]], dtype=np.float64))[0]
+    similarity = np.empty(len(matrix))
+    for start in range(0, len(matrix), chunk_size):
+        similarity[start:start + chunk_size] = normalize(
+            np.asarray(matrix[start:start + chunk_size], dtype=np.float64)) @ query
+    similarity[row_idx] = -np.inf
+    rows = np.argsort(-similarity, kind='stable')[:top_n]
+    docs = sorted(offsets, key=offsets.get)
+    starts = np.array([offsets[doc][0] for doc in docs])
+    row_docs = np.searchsorted(starts, rows, side='right') - 1
+    return pd.DataFrame({'doc_idx': [docs[i] for i in row_docs],
+                         'sent_idx': rows - starts[row_docs],
+                         'similarity': similarity[rows]})
+
+#########################
+
+
+SIM_BAND_RADIUS = 5  # neighbor offsets kept in the similarity band
+
+
+def get_band_similarity(sent_vectors, radius=SIM_BAND_RADIUS):
+    # band[i, d - 1] is the cosine similarity of sentences i and i + d, nan
+    # past the end of the document: the diagonals of cosine_similarity within
+    # radius, O(n * radius) instead of the full n x n matrix
+    vectors = normalize(np.asarray(sent_vectors, dtype=np.float64))
+    band = np.full((len(vectors), radius), np.nan)
+    for dist in range(1, min(radius, len(vectors) - 1) + 1):
+        band[:-dist, dist - 1] = np.einsum('ij,ij->i', vectors[:-dist], vectors[dist:])
+    return band
+
+
+def get_and_save_doc_similarity(dir_name, doc_idx, dim=300, sent_vectors=None, radius=SIM_BAND_RADIUS):
+    if sent_vectors is None:
+        sent_vectors = load_sent_vectors(os.path.join(
+            os.getcwd(), defines.PATH_TO_DFS, dir_name), doc_idx, dim)
+    np.save(os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name,
+            "{:02d}_sent_sim_band{}.npy".format(doc_idx, dim)), get_band_similarity(sent_vectors, radius))
     print("{} sim_db sent saved".format(doc_idx))
 
+
+def load_sim_band(path, doc_idx, dim=300):
+    # memory mapped similarity band, None for documents saved with the full
+    # sent_sim_vec csv
+    file_name = os.path.join(path, "{:02d}_sent_sim_band{}.npy".format(doc_idx, dim))
+    if not os.path.isfile(file_name):
+        return None
+    return np.load(file_name, mmap_mode='r')
+
+
+def load_doc_similarity(path, doc_idx, dim=300):
+    # (similarity band, full similarity db), only one of them is loaded
+    sim_band = load_sim_band(path, doc_idx, dim)
+    if sim_band is not None:
+        return sim_band, None
+    return None, pd.read_csv(os.path.join(path, "{:02d}_sent_sim_vec{}_db.csv".format(doc_idx, dim)))
+
+
+def get_sent_similarity(sent_idx, other_idx):
+    # cosine similarity of two sentences of the current document: from the
+    # band, from the normalized vectors when the offset is past the band, or
+    # from the full matrix of documents saved before the band
+    sim_band = curr_doc_db.get('sim_band')
+    if sim_band is None:
+        return curr_doc_db['sim_vec'].iloc[sent_idx, other_idx].item()
+    first, dist = min(sent_idx, other_idx), abs(sent_idx - other_idx)
+    if dist <= sim_band.shape[1]:
+        return sim_band[first, dist - 1].item()
+    vectors = normalize(np.asarray(curr_doc_db['sent_vec'][[first, first + dist]], dtype=np.float64))
+    return np.dot(vectors[0], vectors[1]).item()
+
 #########################
 
 ### STOP WORDS RATE ###
@@ -131,16 +414,25 @@ def get_docs_sentenses(dir_name,doc_indices):
     return docs_sent
 
 
-def tfidf_transform_doc(dir_name, doc_idx, tfidf, per_lemma=True):
+def get_doc_tf_path(dir_name, doc_idx, per_lemma=True):
+    db_name = "sent_lemma_db" if per_lemma else "sent_db"
+    return os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name, "{:02d}_{}.csv".format(doc_idx, db_name))
+
+
+def get_doc_tf_corpus(dir_name, doc_idx, per_lemma=True):
     if per_lemma:
-        sent_lemma_db = pd.read_csv(os.path.join(os.getcwd(
-        ), defines.PATH_TO_DFS, dir_name, "{:02d}_sent_lemma_db.csv".format(doc_idx)), usecols=['sent_lemma'])
-        corpus = sent_lemma_db['sent_lemma'].tolist()
-    else:
-        sent_db = pd.read_csv(os.path.join(os.getcwd(), defines.PATH_TO_DFS,
-                              dir_name, "{:02d}_sent_db.csv".format(doc_idx)), usecols=['text'])
-        corpus = sent_db['text'].tolist()
-    return tfidf.transform(corpus)
+        sent_lemma_db = pd.read_csv(get_doc_tf_path(dir_name, doc_idx, per_lemma), usecols=['sent_lemma'])
+        return sent_lemma_db['sent_lemma'].tolist()
+    sent_db = pd.read_csv(get_doc_tf_path(dir_name, doc_idx, per_lemma), usecols=['text'])
+    return sent_db['text'].tolist()
+
+
+def tfidf_transform_doc(dir_name, doc_idx, tfidf, per_lemma=True):
+    # counted once, no tokenizing. A SplitTfidf loaded from a pickle has no
+    # counts and transforms the text
+    if isinstance(tfidf, classes.SplitTfidf) and tfidf.counts is not None:
+        return tfidf.transform_counts(tfidf.counts.get_doc_counts(doc_idx))
+    return tfidf.transform(get_doc_tf_corpus(dir_name, doc_idx, per_lemma))
 
 
 def tfidf_fit(dir_name, per_word=True, per_lemma=True, analyzer='char', n_min=3, n_max=5, min_df=5, stop_words=[], doc_indices=[]):
@@ -165,7 +457,12 @@ def tfidf_fit(dir_name, per_word=True, per_lemma=True, analyzer='char', n_min=3,
                                 )
     return tfidf.fit(data_list)
 
-def tfidf_selected_fit(dir_name, per_word=True, per_lemma=True, analyzer='char', n_min=3, n_max=5, min_df=5, stop_words=[], doc_indices=[]):
+def tfidf_selected_fit(dir_name, per_word=True, per_lemma=True, analyzer='char', n_min=3, n_max=5, min_df=5, stop_words=[], doc_indices=[], shared_counts=False):
+    # with shared_counts the vocabulary and idf come from the corpus counts
+    # of get_tf_counts, the result transforms as the TfidfVectorizer fit here
+    if shared_counts:
+        counts = get_tf_counts(dir_name, per_word, per_lemma, analyzer, n_min, n_max, stop_words)
+        return classes.SplitTfidf(counts, doc_indices, min_df)
     data_list = []
     if per_word:
         if per_lemma:
@@ -188,6 +485,22 @@ def tfidf_selected_fit(dir_name, per_word=True, per_lemma=True, analyzer='char',
     return tfidf.fit(data_list)
 
 
+# corpus counts for tf-idf, one classes.TfCounts per analyzer settings for
+# the process, shared by all the splits. A doc is counted again when its
+# csv changed since it was counted
+tf_counts = {}  # (dir_name, settings) -> TfCounts
+
+
+def get_tf_counts(dir_name, per_word=True, per_lemma=True, analyzer='char', n_min=3, n_max=5, stop_words=[]):
+    if per_word:
+        key = (dir_name, 'word', per_lemma, tuple(stop_words))
+    else:
+        key = (dir_name, analyzer, per_lemma, n_min, n_max)
+    if not key in tf_counts:
+        tf_counts[key] = classes.TfCounts(dir_name, per_word, per_lemma, analyzer, n_min, n_max, stop_words)
+    return tf_counts[key]
+
+
 def tfidf_build_all_save_per_doc(dir_name, per_word=True, per_lemma=True, analyzer='char', tf_suffix='', stop_words=[], doc_indices=[]):
     tf = tfidf_fit(dir_name=dir_name, per_word=per_word,
                    per_lemma=per_lemma, analyzer=analyzer, stop_words=stop_words)
@@ -213,54 +526,163 @@ def tfidf_build_all_save_per_doc(dir_name, per_word=True, per_lemma=True, analyz
 
 ## POS from YAP ###
 
-def get_and_save_sent_lemma_db(dir_name, doc_idx):
-    doc_name = os.path.join(os.getcwd(), defines.PATH_TO_DFS,
-                            dir_name, "{:02d}_sent_pos_db.csv".format(doc_idx))
-    if not (os.path.isfile(doc_name) or os.path.islink(doc_name)):
-        print("ERROR: {} does not exists".format(doc_name))
-        return
-    sent_pos_db = pd.read_csv(doc_name, usecols=['sent_idx', 'LEMMA'])
+POS_COUNT_COLUMNS = ['POSTAG', 'f_gen', 'f_num',
+                     'f_suf_gen', 'f_suf_num', 'f_suf_per', 'f_per', 'f_tense']
+
+
+def get_sent_pos_db_path(dir_name, doc_idx):
+    return os.path.join(os.getcwd(), defines.PATH_TO_DFS,
+                        dir_name, "{:02d}_sent_pos_db.csv".format(doc_idx))
+
+
+def get_sent_lemma_db(sent_pos_db):
+    # lemmas of each sentence joined by spaces, in sent_idx order: one
+    # stable sort and a join per run of equal sent_idx instead of
+    # groupby().apply(lambda)
+    sent_pos_db = sent_pos_db[sent_pos_db['sent_idx'].notna()]
+    order = np.argsort(sent_pos_db['sent_idx'].values, kind='stable')
+    sent_idx = sent_pos_db['sent_idx'].values[order]
+    lemmas = sent_pos_db['LEMMA'].values[order].tolist()
+    bounds = np.flatnonzero(sent_idx[1:] != sent_idx[:-1]) + 1
+    bounds = [0] + bounds.tolist() + [len(lemmas)]
     sent_lemma_db = pd.DataFrame()
-    sent_lemma_db['sent_lemma'] = sent_pos_db.groupby(
-        'sent_idx')['LEMMA'].apply(lambda x: "%s" % ' '.join(x)).tolist()
+    sent_lemma_db['sent_lemma'] = [' '.join(lemmas[start:end])
+                                   for start, end in zip(bounds[:-1], bounds[1:])]
+    return sent_lemma_db
+
+
+def get_sent_pos_count_matrix(sent_pos_db):
+    # POS/feature counts per sentence normalized on the sentence length as a
+    # csr matrix, one row per sent_idx in sorted order and one column per
+    # value of POS_COUNT_COLUMNS, named and ordered as pd.get_dummies names
+    # them. Returns (count matrix, column names, TOKEN per sentence)
+    sent_pos_db = sent_pos_db[sent_pos_db['sent_idx'].notna()]
+    sent_indices, rows = np.unique(sent_pos_db['sent_idx'].values, return_inverse=True)
+    token = sent_pos_db['TOKEN'].fillna(value=0).groupby(rows).max()
+    columns = []
+    row_list = []
+    col_list = []
+    for col in POS_COUNT_COLUMNS:
+        values = pd.Categorical(sent_pos_db[col])
+        has_value = values.codes >= 0
+        row_list.append(rows[has_value])
+        col_list.append(values.codes[has_value] + len(columns))
+        columns += ["{}_{}".format(col, value) for value in values.categories]
+    row_list = np.concatenate(row_list)
+    count_matrix = sparse.coo_matrix(
+        (np.ones(len(row_list)), (row_list, np.concatenate(col_list))),
+        shape=(len(sent_indices), len(columns))).tocsr()  # duplicates are summed
+    count_matrix.sort_indices()
+    count_matrix.data = count_matrix.data / np.repeat(token.values, np.diff(count_matrix.indptr))
+    return count_matrix, columns, token.reset_index(drop=True)
+
+
+def get_sent_pos_count_db(sent_pos_db):
+    # dense table of get_sent_pos_count_matrix: TOKEN and then the counts
+    count_matrix, columns, token = get_sent_pos_count_matrix(sent_pos_db)
+    count_db = pd.DataFrame(count_matrix.toarray(), columns=columns)
+    count_db.insert(0, 'TOKEN', token)
+    return count_db
+
+
+def get_and_save_sent_lemma_db(dir_name, doc_idx, sent_pos_db=None):
+    doc_name = get_sent_pos_db_path(dir_name, doc_idx)
+    if sent_pos_db is None:
+        if not (os.path.isfile(doc_name) or os.path.islink(doc_name)):
+            print("ERROR: {} does not exists".format(doc_name))
+            return
+        sent_pos_db = pd.read_csv(doc_name, usecols=['sent_idx', 'LEMMA'])
+    sent_lemma_db = get_sent_lemma_db(sent_pos_db)
     sent_lemma_db.to_csv(os.path.join(os.getcwd(), defines.PATH_TO_DFS,
                          dir_name, "{:02d}_sent_lemma_db.csv".format(doc_idx)), index=False)
     print("{} sent lemma db saved".format(doc_idx))
+    return sent_lemma_db
 
 
-def get_and_save_sent_pos_count_db(dir_name, doc_idx):
-    columns_to_count = ['POSTAG', 'f_gen', 'f_num',
-                        'f_suf_gen', 'f_suf_num', 'f_suf_per', 'f_per', 'f_tense']
-    sent_pos_db = pd.read_csv(os.path.join(os.getcwd(
-    ), defines.PATH_TO_DFS, dir_name, "{:02d}_sent_pos_db.csv".format(doc_idx)))
-    sent_pos_dummies = pd.get_dummies(sent_pos_db, columns=columns_to_count)
-    sent_pos_dummies.fillna(value=0, inplace=True)
-    count_db = sent_pos_dummies.groupby('sent_idx').sum()
-    count_db['TOKEN'] = sent_pos_dummies.groupby('sent_idx')['TOKEN'].max()
-    count_db.drop(['FROM', 'TO', 'doc_idx'], inplace=True, axis=1)
-    normalize_pos_count_on_sent_len(count_db)
+def get_and_save_sent_pos_count_db(dir_name, doc_idx, sent_pos_db=None):
+    if sent_pos_db is None:
+        sent_pos_db = pd.read_csv(get_sent_pos_db_path(dir_name, doc_idx))
+    count_db = get_sent_pos_count_db(sent_pos_db)
     count_db.to_csv(os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name,
                     "{:02d}_sent_pos_count_db.csv".format(doc_idx)), index=False)
     print("{} sent count db saved".format(doc_idx))
+    return count_db
 
 
 def normalize_pos_count_on_sent_len(count_db):
     count_db.iloc[:, 1:] = count_db.iloc[:, 1:].div(count_db.TOKEN, axis=0)
+
+
+def save_sent_pos_count(dir_name, doc_idx, count_matrix, columns):
+    common_utils.save_sparse(dir_name, "{:02d}_sent_pos_count.npz".format(doc_idx), count_matrix)
+    with open(os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name,
+                           "{:02d}_sent_pos_count_columns.json".format(doc_idx)), "w") as fp:
+        json.dump(columns, fp, ensure_ascii=False)
+    print("{} sent count matrix saved".format(doc_idx))
+
+
+def remove_sent_pos_count(dir_name, doc_idx):
+    # counts saved dense in merged_db replace an older sparse save
+    for name in ["{:02d}_sent_pos_count.npz", "{:02d}_sent_pos_count_columns.json"]:
+        file_name = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name, name.format(doc_idx))
+        if os.path.isfile(file_name):
+            os.remove(file_name)
+
+
+def load_sent_pos_count(path, doc_idx):
+    # (csr counts, column names) of a document directory, (None, []) for
+    # documents whose counts are dense columns of merged_db
+    file_name = os.path.join(path, "{:02d}_sent_pos_count.npz".format(doc_idx))
+    if not os.path.isfile(file_name):
+        return None, []
+    with open(os.path.join(path, "{:02d}_sent_pos_count_columns.json".format(doc_idx))) as fp:
+        columns = json.load(fp)
+    return common_utils.open_sparse(file_name), columns
 #########################
 
 ### Merge all sentense features into single DB ###
 
 
-def merge_sent_pos_db(dir_name, doc_idx):
-    sent_db = pd.read_csv(os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name,
-                          "{:02d}_sent_db.csv".format(doc_idx)), usecols=defines.SENT_FEATURES)
-    count_db = pd.read_csv(os.path.join(os.getcwd(
-    ), defines.PATH_TO_DFS, dir_name, "{:02d}_sent_pos_count_db.csv".format(doc_idx)))
-    merged_db = pd.merge(sent_db, count_db, left_index=True,
+def read_sent_db(dir_name, doc_idx):
+    return pd.read_csv(os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name,
+                       "{:02d}_sent_db.csv".format(doc_idx)))
+
+
+def get_sent_features_db(sent_db):
+    # same columns as read_csv(usecols=SENT_FEATURES): file order
+    return sent_db[[col for col in sent_db.columns if col in defines.SENT_FEATURES]]
+
+
+def merge_sent_pos_db(dir_name, doc_idx, sent_db=None, count_db=None):
+    if sent_db is None:
+        sent_db = pd.read_csv(os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name,
+                              "{:02d}_sent_db.csv".format(doc_idx)), usecols=defines.SENT_FEATURES)
+    if count_db is None:
+        count_db = pd.read_csv(os.path.join(os.getcwd(
+        ), defines.PATH_TO_DFS, dir_name, "{:02d}_sent_pos_count_db.csv".format(doc_idx)))
+    merged_db = pd.merge(get_sent_features_db(sent_db), count_db, left_index=True,
                          right_index=True, validate="one_to_one")
     merged_db.to_csv(os.path.join(os.getcwd(), defines.PATH_TO_DFS,
                      dir_name, "{:02d}_merged_db.csv".format(doc_idx)), index=False)
     print("{} sent features db saved".format(doc_idx))
+    return merged_db
+
+
+def save_doc_pos_features(dir_name, doc_idx, sent_db=None, sparse_count=False):
+    # lemma and merged dbs of a document from a single read of its
+    # sent_pos_db. The POS counts are dense columns of merged_db, as the
+    # notebooks and the scaled merged dbs read them. With sparse_count they
+    # are saved as a csr matrix instead and merged_db keeps only TOKEN
+    sent_pos_db = pd.read_csv(get_sent_pos_db_path(dir_name, doc_idx))
+    if sent_db is None:
+        sent_db = read_sent_db(dir_name, doc_idx)
+    get_and_save_sent_lemma_db(dir_name, doc_idx, sent_pos_db)
+    if not sparse_count:
+        remove_sent_pos_count(dir_name, doc_idx)
+        return merge_sent_pos_db(dir_name, doc_idx, sent_db, get_sent_pos_count_db(sent_pos_db))
+    count_matrix, columns, token = get_sent_pos_count_matrix(sent_pos_db)
+    save_sent_pos_count(dir_name, doc_idx, count_matrix, columns)
+    return merge_sent_pos_db(dir_name, doc_idx, sent_db, token.to_frame('TOKEN'))
 
 #########################
 
@@ -274,8 +696,12 @@ def load_doc_features(dir_name, doc_idx, tf_types=['word', 'char_wb', 'lemma'],
     global curr_doc_db
     curr_doc_db['merged'] = pd.read_csv(os.path.join(os.getcwd(
     ), defines.PATH_TO_DFS, dir_name, "{:02d}_{}.csv".format(doc_idx, merged_str)))
-    curr_doc_db['sim_vec'] = pd.read_csv(os.path.join(os.getcwd(
-    ), defines.PATH_TO_DFS, dir_name, "{:02d}_sent_sim_vec300_db.csv".format(doc_idx)))
+    curr_doc_db['sim_band'], curr_doc_db['sim_vec'] = load_doc_similarity(
+        os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name), doc_idx)
+    curr_doc_db['pos_count'], curr_doc_db['pos_count_columns'] = load_sent_pos_count(
+        os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name), doc_idx)
+    curr_doc_db['sent_vec'] = load_sent_vectors(
+        os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name), doc_idx)
     for tf_type in tf_types:
         if 'char' in tf_type:
             tf_suffix = ''
@@ -567,6 +993,7 @@ def sent2features(sent_idx, idx_in_seq, seq_len=6, neighbor_radius=2, tf_to_use=
                 col)] = curr_doc_db['merged'].loc[sent_idx, col].item()
         # features["{}".format(col)]= curr_doc_db['merged'].loc[sent_idx,col].item()
     # features['sent_idx'] = sent_idx
+    features.update(get_pos_count_features(sent_idx))
 
     for neighbor_dist in range(1, neighbor_radius+1):
         if idx_in_seq > neighbor_dist - 1:
@@ -576,6 +1003,8 @@ def sent2features(sent_idx, idx_in_seq, seq_len=6, neighbor_radius=2, tf_to_use=
                     update["-{}:{}".format(neighbor_dist, col)
                            ] = curr_doc_db['merged'].loc[sent_idx-neighbor_dist, col].item()
                 # update["-{}:{}".format(neighbor_dist,col)]=curr_doc_db['merged'].loc[sent_idx-neighbor_dist,col].item()
+            update.update(get_pos_count_features(
+                sent_idx-neighbor_dist, "-{}:".format(neighbor_dist)))
             features.update(update)
         if idx_in_seq < seq_len - neighbor_dist:
             update = {}
@@ -584,16 +1013,18 @@ def sent2features(sent_idx, idx_in_seq, seq_len=6, neighbor_radius=2, tf_to_use=
                     update["+{}:{}".format(neighbor_dist, col)
                            ] = curr_doc_db['merged'].loc[sent_idx+neighbor_dist, col].item()
                 # update["+{}:{}".format(neighbor_dist,col)]=curr_doc_db['merged'].loc[sent_idx+neighbor_dist,col].item()
+            update.update(get_pos_count_features(
+                sent_idx+neighbor_dist, "+{}:".format(neighbor_dist)))
             features.update(update)
 
     update = {}
     for neighbor_dist in range(1, neighbor_radius+1):
         if idx_in_seq > neighbor_dist - 1:
-            update["-{}.sim".format(neighbor_dist)] = curr_doc_db['sim_vec'].iloc[sent_idx,
-                                                                                  sent_idx-neighbor_dist].item()
+            update["-{}.sim".format(neighbor_dist)] = get_sent_similarity(sent_idx,
+                                                                          sent_idx-neighbor_dist)
         if idx_in_seq < seq_len - neighbor_dist:
-            update["+{}.sim".format(neighbor_dist)] = curr_doc_db['sim_vec'].iloc[sent_idx,
-                                                                                  sent_idx+neighbor_dist].item()
+            update["+{}.sim".format(neighbor_dist)] = get_sent_similarity(sent_idx,
+                                                                          sent_idx+neighbor_dist)
 
     features.update(update)
 
@@ -614,6 +1045,18 @@ def sent2features(sent_idx, idx_in_seq, seq_len=6, neighbor_radius=2, tf_to_use=
     return features
 
 
+def get_pos_count_features(sent_idx, prefix=''):
+    # non zero POS counts of a sentence from the sparse count matrix, no
+    # features when the counts are dense columns of merged
+    count_matrix = curr_doc_db.get('pos_count')
+    if count_matrix is None:
+        return {}
+    columns = curr_doc_db['pos_count_columns']
+    start, end = count_matrix.indptr[sent_idx], count_matrix.indptr[sent_idx + 1]
+    return {"{}{}".format(prefix, columns[i]): value for i, value in zip(
+        count_matrix.indices[start:end], count_matrix.data[start:end].tolist())}
+
+
 def get_tf_feature_name(tf_str, tf_idx, tf_features):
     return tf_features[tf_str].features[tf_idx]
 
@@ -629,12 +1072,14 @@ def sent2features_orig(sent_idx, idx_in_seq, seq_len=6, neighbor_radius=2):
         if save_feature_value(curr_doc_db['merged'].loc[sent_idx, col], col):
             features["{}".format(
                 col)] = curr_doc_db['merged'].loc[sent_idx, col]
+    features.update(get_pos_count_features(sent_idx))
     if idx_in_seq > 1:
         update = {}
         for col in columns:
             if save_feature_value(curr_doc_db['merged'].loc[sent_idx-1, col], col):
                 update["-1:{}".format(col)
                        ] = curr_doc_db['merged'].loc[sent_idx-1, col]
+        update.update(get_pos_count_features(sent_idx-1, "-1:"))
         features.update(update)
 
     if idx_in_seq > 2:
@@ -643,16 +1088,17 @@ def sent2features_orig(sent_idx, idx_in_seq, seq_len=6, neighbor_radius=2):
             if save_feature_value(curr_doc_db['merged'].loc[sent_idx-2, col], col):
                 update["-2:{}".format(col)
                        ] = curr_doc_db['merged'].loc[sent_idx-2, col]
+        update.update(get_pos_count_features(sent_idx-2, "-2:"))
         features.update(update)
 
     update = {}
     for neighbor_dist in range(1, neighbor_radius+1):
         if idx_in_seq > neighbor_dist - 1:
             update["-{}.sim".format(neighbor_dist)
-                   ] = curr_doc_db['sim_vec'].iloc[sent_idx, sent_idx-neighbor_dist]
+                   ] = get_sent_similarity(sent_idx, sent_idx-neighbor_dist)
         if idx_in_seq < seq_len - neighbor_dist:
             update["+{}.sim".format(neighbor_dist)
-                   ] = curr_doc_db['sim_vec'].iloc[sent_idx, sent_idx+neighbor_dist]
+                   ] = get_sent_similarity(sent_idx, sent_idx+neighbor_dist)
 
     features.update(update)
 
@@ -673,6 +1119,7 @@ def sent2features_orig(sent_idx, idx_in_seq, seq_len=6, neighbor_radius=2):
             if save_feature_value(curr_doc_db['merged'].loc[sent_idx+1, col], col):
                 update["+1:{}".format(col)
                        ] = curr_doc_db['merged'].loc[sent_idx+1, col]
+        update.update(get_pos_count_features(sent_idx+1, "+1:"))
         features.update(update)
 
     if idx_in_seq < seq_len-2:
@@ -681,6 +1128,7 @@ def sent2features_orig(sent_idx, idx_in_seq, seq_len=6, neighbor_radius=2):
             if save_feature_value(curr_doc_db['merged'].loc[sent_idx+2, col], col):
                 update["+2:{}".format(col)
                        ] = curr_doc_db['merged'].loc[sent_idx+2, col]
+        update.update(get_pos_count_features(sent_idx+2, "+2:"))
         features.update(update)
 
     return features
@@ -1041,11 +1489,10 @@ def save_doc_features(dir_name, doc_idx, ft):
     if not os.path.isfile(doc_name):
         print("ERROR: {} does not exists".format(doc_name))
         return
-    get_and_save_sent_lemma_db(dir_name, doc_idx)
-    get_and_save_sent_pos_count_db(dir_name, doc_idx)
-    merge_sent_pos_db(dir_name, doc_idx)
-    get_and_save_sent_vectors(dir_name, doc_idx, ft)
-    get_and_save_doc_similarity(dir_name, doc_idx)
+    sent_db = read_sent_db(dir_name, doc_idx)
+    save_doc_pos_features(dir_name, doc_idx, sent_db)
+    sent_vectors = get_and_save_sent_vectors(dir_name, doc_idx, ft, sent_db=sent_db)
+    get_and_save_doc_similarity(dir_name, doc_idx, sent_vectors=sent_vectors)
 
 
 ######
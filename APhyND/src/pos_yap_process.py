@@ -8,6 +8,7 @@ Original file is located at
 """
 
 import os
+import numpy as np
 import pandas as pd
 import subprocess
 import requests
@@ -16,14 +17,36 @@ from requests.packages.urllib3.util.retry import Retry
 import re
 import glob
 import defines
+import hashlib
+import json
+import sqlite3
+import shlex
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 global sent_tex_db
 global sent_tokens_db
+global lattice_columns
 import common_utils
 
 localhost_yap = "http://localhost:8000/yap/heb/joint"
+YAP_DIR = "./external_src/yapproj/src/yap/"
+YAP_URL = "http://localhost:{port}/yap/heb/joint"
+# active YapServerPool, requests go to localhost_yap when None
+yap_pool = None
 step_print = 100
-db_step = 300
+db_step = 300  # sentences tagged and flushed to disk per chunk
+# persistent http session to the yap server, see get_yap_session
+yap_session = None
+yap_session_pool_size = 0
+n_retries = 3
+pool_size = 10
+# on-disk cache of cleaned lattices, see open_yap_cache
+YAP_CACHE = "yap_cache.sqlite"
+yap_cache = None
+cache_hits = 0
+cache_misses = 0
 # Commented out IPython magic to ensure Python compatibility.
 def start_yap_api():
     cmd = "! ./yap api "
@@ -33,18 +56,160 @@ def start_yap_api():
     return process
 
 
-def try_yap():
+def try_yap(url=None, timeout=None):
     try_text = "גנן גידל דגן בגן"
-    localhost_yap = "http://localhost:8000/yap/heb/joint"
+    if url is None:
+        url = localhost_yap
     data = '{{"text": "{}  "}}'.format(try_text).encode(
         "utf-8"
     )  # input string ends with two space characters
     headers = {"content-type": "application/json"}
-    response = requests.get(url=localhost_yap, data=data, headers=headers)
+    response = requests.get(url=url, data=data, headers=headers, timeout=timeout)
     json_response = response.json()
     return json_response
 
 
+### YAP SERVER POOL ###
+
+
+class YapServerPool:
+    # K yap servers on consecutive ports, requests are spread round robin
+    # ("round_robin") or to the server with fewest requests in flight
+    # ("least_loaded"). cmd starts one server and is formatted with its
+    # {port}, the stock ./yap api always serves on 8000 so it needs a yap
+    # build that takes the port. Pass urls to use servers that are already
+    # running
+    def __init__(
+        self,
+        n_servers=None,
+        first_port=8000,
+        policy="round_robin",
+        cmd=None,
+        cwd=YAP_DIR,
+        urls=None,
+    ):
+        if not policy in ["round_robin", "least_loaded"]:
+            raise ValueError("unknown yap pool policy {}".format(policy))
+        if urls is None and (cmd is None or not n_servers):
+            raise ValueError(
+                "a yap server pool needs urls of running servers, or cmd "
+                "(with a {port} placeholder) and n_servers to start them"
+            )
+        if urls is None and "{port}" not in cmd:
+            raise ValueError("yap pool cmd has no {{port}} placeholder: {}".format(cmd))
+        self.policy = policy
+        self.cmd = cmd
+        self.cwd = cwd
+        self.processes = []
+        if urls is None:
+            self.ports = [first_port + i for i in range(n_servers)]
+            self.urls = [YAP_URL.format(port=port) for port in self.ports]
+        else:
+            self.ports = []
+            self.urls = list(urls)
+        self.in_flight = {url: 0 for url in self.urls}
+        self.next_idx = 0
+        self.lock = threading.Lock()
+
+    def start(self, timeout=600):
+        try:
+            for port in self.ports:
+                self.processes.append(
+                    subprocess.Popen(
+                        shlex.split(self.cmd.format(port=port)),
+                        cwd=self.cwd,
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                    )
+                )
+            self.wait_ready(timeout)
+        except Exception:
+            self.shutdown()
+            raise
+        return self
+
+    def is_healthy(self, url):
+        try:
+            return "md_lattice" in try_yap(url, timeout=10)
+        except (requests.exceptions.RequestException, ValueError):
+            return False
+
+    def wait_ready(self, timeout=600, poll=1):
+        # yap loads its models before it answers, poll until all servers are up
+        deadline = time.time() + timeout
+        waiting = list(self.urls)
+        while len(waiting) != 0:
+            for i, process in enumerate(self.processes):
+                if process.poll() is not None:
+                    raise RuntimeError(
+                        "yap server on {} exited with code {}".format(
+                            self.urls[i], process.returncode
+                        )
+                    )
+            waiting = [url for url in waiting if not self.is_healthy(url)]
+            if len(waiting) == 0:
+                break
+            if time.time() > deadline:
+                raise RuntimeError("yap servers not ready: {}".format(waiting))
+            time.sleep(poll)
+        print("{} yap servers ready".format(len(self.urls)))
+
+    def acquire(self):
+        with self.lock:
+            if self.policy == "least_loaded":
+                n = len(self.urls)
+                order = [self.urls[(self.next_idx + i) % n] for i in range(n)]
+                url = min(order, key=lambda url: self.in_flight[url])
+            else:
+                url = self.urls[self.next_idx % len(self.urls)]
+            self.next_idx = (self.urls.index(url) + 1) % len(self.urls)
+            self.in_flight[url] += 1
+            return url
+
+    def release(self, url):
+        with self.lock:
+            self.in_flight[url] -= 1
+
+    def shutdown(self, timeout=30):
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+
+def start_yap_pool(n_servers=None, first_port=8000, policy="round_robin", cmd=None, cwd=YAP_DIR, urls=None, timeout=600):
+    # starts (or attaches to) the servers and routes get_md_lattice to them
+    global yap_pool
+    stop_yap_pool()
+    pool = YapServerPool(n_servers, first_port, policy, cmd, cwd, urls)
+    if urls is None:
+        pool.start(timeout)
+    else:
+        pool.wait_ready(timeout)
+    yap_pool = pool
+    close_yap_session()  # new session sized for all the servers
+    return pool
+
+
+def stop_yap_pool():
+    global yap_pool
+    if yap_pool is not None:
+        yap_pool.shutdown()
+        yap_pool = None
+
+
 yap_tag_list = ["FROM", "TO", "FORM", "LEMMA", "CPOSTAG", "POSTAG", "FEATS", "TOKEN"]
 # FROM: Index of the outgoing vertex of the edge
 # TO: Index of the incoming vertex of the edge
@@ -56,23 +221,108 @@ yap_tag_list = ["FROM", "TO", "FORM", "LEMMA", "CPOSTAG", "POSTAG", "FEATS", "TO
 # TOKEN: Source token index
 
 
-def get_server_response(text, sent_idx):
+def get_yap_session(n_connections=0):
+    # one pooled keep-alive session per process, connection errors and
+    # server errors are retried with backoff
+    global yap_session, yap_session_pool_size
+    n_connections = max(pool_size, n_connections)
+    if yap_session is not None and yap_session_pool_size < n_connections:
+        close_yap_session()
+    if yap_session is None:
+        retry = Retry(
+            total=n_retries,
+            backoff_factor=0.5,
+            status_forcelist=[500, 502, 503, 504],
+        )
+        n_hosts = len(yap_pool.urls) if yap_pool is not None else 1
+        adapter = HTTPAdapter(
+            max_retries=retry,
+            pool_connections=max(pool_size, n_hosts),
+            pool_maxsize=n_connections,
+        )
+        yap_session = requests.Session()
+        yap_session.mount("http://", adapter)
+        yap_session.mount("https://", adapter)
+        yap_session.headers.update({"content-type": "application/json"})
+        yap_session_pool_size = n_connections
+    return yap_session
+
+
+def close_yap_session():
+    global yap_session
+    if yap_session is not None:
+        yap_session.close()
+        yap_session = None
+
+
+def get_md_lattice(text):
     data = '{{"text": "{}  "}}'.format(text).encode(
         "utf-8"
     )  # input string ends with two space characters
-    headers = {"content-type": "application/json"}
-    response = requests.get(url=localhost_yap, data=data, headers=headers)
+    if yap_pool is None:
+        response = get_yap_session().get(url=localhost_yap, data=data)
+    else:
+        url = yap_pool.acquire()
+        try:
+            response = get_yap_session().get(url=url, data=data)
+        finally:
+            yap_pool.release(url)
     json_response = response.json()
-    md_string = json_response.get("md_lattice", "")
+    return json_response.get("md_lattice", "")
+
+
+def get_server_response(text, sent_idx):
+    md_string = get_md_lattice(text)
     if len(md_string) == 0:
         print(
             "ERROR in get_server_response for {}\n{}".format(
-                sent_idx, sent_text_db.iloc[sent_idx]
+                sent_idx, text
             )
         )
     return md_string
 
 
+### BATCHED REQUESTS ###
+
+
+def is_batch_safe(text):
+    # yap ends a sentence at a double space: only single spaced sentences can
+    # be packed together and still be tagged exactly as when sent alone
+    return len(text) != 0 and " ".join(text.split()) == text
+
+
+def split_md_lattice(md_string):
+    # lattices of consecutive sentences are separated by an empty line
+    md_string = md_string.strip("\n")
+    if len(md_string) == 0:
+        return []
+    return [lattice + "\n" for lattice in re.split(r"\n\s*\n", md_string)]
+
+
+def get_batch_server_response(texts, sent_indices):
+    # one request for all batch safe sentences, the rest are sent alone; falls
+    # back to one request per sentence if the lattices do not split back
+    responses = {}
+    packed = [
+        (sent_idx, text) for sent_idx, text in zip(sent_indices, texts) if is_batch_safe(text)
+    ]
+    if len(packed) > 1:
+        lattices = split_md_lattice(get_md_lattice("  ".join(text for _, text in packed)))
+        if len(lattices) == len(packed):
+            for (sent_idx, text), lattice in zip(packed, lattices):
+                responses[sent_idx] = lattice
+        else:
+            print(
+                "batch of {} sentences returned {} lattices, sending one by one".format(
+                    len(packed), len(lattices)
+                )
+            )
+    for sent_idx, text in zip(sent_indices, texts):
+        if not sent_idx in responses:
+            responses[sent_idx] = get_server_response(text, sent_idx)
+    return [responses[sent_idx] for sent_idx in sent_indices]
+
+
 def clean_server_response(text, sent_idx):
     clean_text = re.sub(r"(^./|.$/)", "", text)
     clean_text = re.sub("\\t", "\t", clean_text)
@@ -80,54 +330,413 @@ def clean_server_response(text, sent_idx):
     return clean_text
 
 
+def new_lattice_columns():
+    return {col: [] for col in yap_tag_list + ["sent_idx"]}
+
+
+# lattice rows tagged since the last collect_sent_tokens_db, by column
+lattice_columns = new_lattice_columns()
+
+
 def parse_server_response(text, sent_idx):
-    rows = text.split("\n")
-    for i, r in enumerate(rows):
-        curr_word_idx = sent_tokens_db.shape[0]
+    # appends the lattice rows to lattice_columns, sent_tokens_db is built
+    # once per document by collect_sent_tokens_db
+    n_tags = len(yap_tag_list)
+    for r in text.split("\n"):
         row_split = r.split("\t")
-        for j, token in enumerate(row_split):
-            if len(token) == 0:
-                continue
-            sent_tokens_db.loc[curr_word_idx, yap_tag_list[j]] = token
-            sent_tokens_db.loc[curr_word_idx, "sent_idx"] = sent_idx
-            if yap_tag_list[j] == "FEATS" and "|" in token:
-                feats_list = token.split("|")
-                for n, fea in enumerate(feats_list):
-                    [name, value] = fea.split("=")
-                    sent_tokens_db.loc[curr_word_idx, "f_{}".format(name)] = value
+        if not any(row_split):
+            continue
+        if len(row_split) > n_tags and any(row_split[n_tags:]):
+            raise IndexError("lattice row has more than {} fields: {}".format(n_tags, r))
+        row_split += [""] * (n_tags - len(row_split))
+        for tag, token in zip(yap_tag_list, row_split):
+            lattice_columns[tag].append(token if len(token) != 0 else np.nan)
+        lattice_columns["sent_idx"].append(sent_idx)
+
+
+def expand_feats(feats):
+    # FEATS "name=value|name=value" -> one f_name column per feature, only
+    # tokens with more than one feature are expanded. Also returns the
+    # (first row, position in FEATS) where every feature shows up
+    with_feats = feats[feats.str.contains("|", regex=False, na=False)]
+    pairs = with_feats.str.split("|").explode()
+    name_value = pairs.str.split("=")
+    if (name_value.str.len() != 2).any():
+        raise ValueError(
+            "bad FEATS {}".format(with_feats[name_value.str.len() != 2].iloc[0])
+        )
+    feat_db = pd.DataFrame(
+        {
+            "row": pairs.index,
+            "pos": pairs.groupby(level=0).cumcount().values,
+            "name": ("f_" + name_value.str[0]).values,
+            "value": name_value.str[1].values,
+        }
+    )
+    first_seen = feat_db.drop_duplicates("name")
+    feat_wide = (
+        feat_db.drop_duplicates(["row", "name"], keep="last")
+        .pivot(index="row", columns="name", values="value")
+        .reindex(index=feats.index, columns=first_seen["name"])
+    )
+    return feat_wide, list(zip(first_seen["name"], first_seen["row"], first_seen["pos"]))
+
+
+def build_sent_tokens_db(columns):
+    # same table as the former cell by cell .loc growth: rows in lattice
+    # order, columns in the order they were first set (sent_idx after the
+    # first field, f_* features right after FEATS), absent cells NaN
+    if len(columns["sent_idx"]) == 0:
+        return pd.DataFrame()
+    db = pd.DataFrame({tag: pd.Series(columns[tag], dtype=object) for tag in yap_tag_list})
+    order = {}
+    for j, tag in enumerate(yap_tag_list):
+        first_row = db[tag].first_valid_index()
+        if first_row is not None:
+            order[tag] = (first_row, j, 0)
+    first_field = db.iloc[0].notna().values.argmax()
+    db["sent_idx"] = np.array(columns["sent_idx"], dtype=float)
+    order["sent_idx"] = (0, first_field, 1)
+    if "FEATS" in order:
+        feat_wide, first_seen = expand_feats(db["FEATS"])
+        db = pd.concat([db, feat_wide], axis=1)
+        feats_j = yap_tag_list.index("FEATS")
+        for name, first_row, pos in first_seen:
+            order[name] = (first_row, feats_j, 2 + pos)
+    return db[sorted(order, key=order.get)]
+
+
+def collect_sent_tokens_db():
+    # sent_tokens_db of the sentences tagged since the last collect, the
+    # table is built once and the rows start over
+    global sent_tokens_db, lattice_columns
+    sent_tokens_db = build_sent_tokens_db(lattice_columns)
+    lattice_columns = new_lattice_columns()
+    return sent_tokens_db
 
 
 def sent_to_tags(sent_idx):
+    # adds the tokens of the sentence to lattice_columns
     global sent_text_db
     text = sent_text_db.loc[sent_idx, "text"]
-    resp = get_server_response(text, sent_idx)
+    for sent_idx, lattice in iter_tagged_lattices([text], [sent_idx]):
+        handle_lattice(lattice, sent_idx)
+
+
+def sents_to_tags(sent_indices):
+    global sent_text_db
+    texts = sent_text_db.loc[sent_indices, "text"].tolist()
+    for sent_idx, lattice in iter_tagged_lattices(texts, sent_indices, len(sent_indices)):
+        handle_lattice(lattice, sent_idx)
+
+
+### RESPONSE CACHE ###
+
+
+def get_yap_cache_path(dir_name=""):
+    return os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name, YAP_CACHE)
+
+
+def open_yap_cache(path=None):
+    # sentence text hash -> cleaned md_lattice, shared by all runs tagging
+    # with the same yap server: delete the file when the yap model changes
+    global yap_cache
+    if yap_cache is not None:
+        return yap_cache
+    if path is None:
+        path = get_yap_cache_path()
+    yap_cache = sqlite3.connect(path)
+    yap_cache.execute(
+        "CREATE TABLE IF NOT EXISTS lattice (key TEXT PRIMARY KEY, md_lattice TEXT)"
+    )
+    reset_cache_stats()
+    return yap_cache
+
+
+def close_yap_cache():
+    global yap_cache
+    if yap_cache is not None:
+        yap_cache.commit()
+        yap_cache.close()
+        yap_cache = None
+
+
+def reset_cache_stats():
+    global cache_hits, cache_misses
+    cache_hits = 0
+    cache_misses = 0
+
+
+def get_cache_stats():
+    n_lookups = cache_hits + cache_misses
+    return {
+        "hits": cache_hits,
+        "misses": cache_misses,
+        "hit_rate": cache_hits / n_lookups if n_lookups else 0.0,
+    }
+
+
+def print_cache_stats():
+    stats = get_cache_stats()
+    print(
+        "yap cache: {} hits, {} misses, hit rate {:.1%}".format(
+            stats["hits"], stats["misses"], stats["hit_rate"]
+        )
+    )
+
+
+def get_cache_key(text):
+    # the exact text sent to yap: spacing changes the lattice
+    return hashlib.sha256(str(text).encode("utf-8")).hexdigest()
+
+
+def get_cached_lattices(texts):
+    # cleaned lattice per text, None when not cached or the cache is closed
+    global cache_hits, cache_misses
+    if yap_cache is None:
+        return [None] * len(texts)
+    keys = [get_cache_key(text) for text in texts]
+    found = {}
+    chunk = 500  # stay below the sqlite variable limit
+    for start in range(0, len(keys), chunk):
+        chunk_keys = keys[start : start + chunk]
+        found.update(
+            yap_cache.execute(
+                "SELECT key, md_lattice FROM lattice WHERE key IN ({})".format(
+                    ",".join("?" * len(chunk_keys))
+                ),
+                chunk_keys,
+            ).fetchall()
+        )
+    lattices = [found.get(key) for key in keys]
+    n_found = sum(lattice is not None for lattice in lattices)
+    cache_hits += n_found
+    cache_misses += len(lattices) - n_found
+    return lattices
+
+
+def add_cached_lattices(texts, lattices):
+    if yap_cache is None or len(texts) == 0:
+        return
+    yap_cache.executemany(
+        "INSERT OR REPLACE INTO lattice (key, md_lattice) VALUES (?, ?)",
+        [(get_cache_key(text), lattice) for text, lattice in zip(texts, lattices)],
+    )
+    yap_cache.commit()
+
+
+def iter_tagged_lattices(texts, sent_indices, batch_size=1, n_in_flight=1):
+    # (sent_idx, cleaned md_lattice) in sent_idx order. When the cache is open
+    # only the sentences missing from it are sent to yap, non empty answers
+    # are added to it
+    cached = get_cached_lattices(texts)
+    to_tag = [i for i, lattice in enumerate(cached) if lattice is None]
+    responses = iter_server_responses(
+        [texts[i] for i in to_tag], [sent_indices[i] for i in to_tag], batch_size, n_in_flight
+    )
+    new_texts = []
+    new_lattices = []
+    for i, sent_idx in enumerate(sent_indices):
+        if cached[i] is not None:
+            yield sent_idx, cached[i]
+            continue
+        _, resp = next(responses)
+        if len(resp) != 0:
+            resp = clean_server_response(resp, sent_idx)
+            new_texts.append(texts[i])
+            new_lattices.append(resp)
+        yield sent_idx, resp
+    for _ in responses:  # let the request pool shut down
+        pass
+    add_cached_lattices(new_texts, new_lattices)
+
+
+### CONCURRENT REQUESTS ###
+
+
+def get_request_units(sent_indices, batch_size=1):
+    # sentences sent together in one request
+    if batch_size > 1:
+        return [
+            sent_indices[start : start + batch_size]
+            for start in range(0, len(sent_indices), batch_size)
+        ]
+    return [[sent_idx] for sent_idx in sent_indices]
+
+
+def get_unit_responses(texts, sent_indices):
+    if len(sent_indices) > 1:
+        return get_batch_server_response(texts, sent_indices)
+    return [get_server_response(texts[0], sent_indices[0])]
+
+
+def iter_server_responses(texts, sent_indices, batch_size=1, n_in_flight=1):
+    # (sent_idx, md_lattice) in sent_idx order. With n_in_flight > 1 up to
+    # that many requests wait on the server at once, only the http calls run
+    # in the worker threads
+    units = get_request_units(list(range(len(sent_indices))), batch_size)
+    unit_args = [
+        ([texts[i] for i in unit], [sent_indices[i] for i in unit]) for unit in units
+    ]
+    if n_in_flight > 1:
+        get_yap_session(n_in_flight)
+        with ThreadPoolExecutor(max_workers=n_in_flight) as executor:
+            for (unit_texts, unit_indices), responses in zip(
+                unit_args, executor.map(lambda args: get_unit_responses(*args), unit_args)
+            ):
+                for sent_idx, resp in zip(unit_indices, responses):
+                    yield sent_idx, resp
+    else:
+        for unit_texts, unit_indices in unit_args:
+            for sent_idx, resp in zip(
+                unit_indices, get_unit_responses(unit_texts, unit_indices)
+            ):
+                yield sent_idx, resp
+
+
+def handle_lattice(lattice, sent_idx):
+    # lattice is already cleaned
     if sent_idx % step_print == 0:
         print("{} got response".format(sent_idx))
-    if len(resp) != 0:
-        resp = clean_server_response(resp, sent_idx)
-        # if(sent_idx%step_print == 0):
-        #   print("\t{} response cleaned".format(sent_idx))
-        parse_server_response(resp, sent_idx)
-        # if(sent_idx%step_print == 0):
-        #   print("\t{} response parsed".format(sent_idx))
+    if len(lattice) != 0:
+        parse_server_response(lattice, sent_idx)
+
+
+### CHUNKED, RESUMABLE WRITING ###
+
+
+def get_checkpoint_path(sent_pos_path):
+    return sent_pos_path.replace(".csv", ".checkpoint.json")
+
+
+def get_part_path(sent_pos_path, part_idx):
+    return sent_pos_path.replace(".csv", ".part{:05d}.csv".format(part_idx))
+
+
+def get_texts_hash(texts):
+    # a checkpoint is only resumed for the same sentences
+    return get_cache_key("\n".join(str(text) for text in texts))
+
+
+def remove_part_files(sent_pos_path):
+    # also parts written after the last saved checkpoint
+    for part_path in glob.glob(glob.escape(sent_pos_path.replace(".csv", ".part")) + "*.csv"):
+        os.remove(part_path)
+
 
+def load_checkpoint(sent_pos_path, texts_hash, resume=True):
+    # without resume an existing checkpoint is dropped, the new one still
+    # gets the texts hash so a crash of this run can be resumed
+    path = get_checkpoint_path(sent_pos_path)
+    if os.path.isfile(path):
+        with open(path, "r") as fp:
+            checkpoint = json.load(fp)
+        if resume and checkpoint["texts_hash"] == texts_hash and all(
+            os.path.isfile(part) for part in checkpoint["parts"]
+        ):
+            return checkpoint
+        print("Ignoring {} checkpoint {}".format("stale" if resume else "previous", path))
+        os.remove(path)
+    remove_part_files(sent_pos_path)
+    return {"texts_hash": texts_hash, "next_sent_idx": 0, "n_rows": 0, "parts": []}
 
-def parse_all_sentenses(doc_list):
+
+def save_checkpoint(sent_pos_path, checkpoint):
+    path = get_checkpoint_path(sent_pos_path)
+    with open(path + ".tmp", "w") as fp:
+        json.dump(checkpoint, fp)
+    os.replace(path + ".tmp", path)
+
+
+def flush_chunk(sent_pos_path, checkpoint, next_sent_idx):
+    # writes the tokens of the chunk and moves the checkpoint past it
+    chunk_db = collect_sent_tokens_db()
+    if len(chunk_db.index) != 0:
+        part_path = get_part_path(sent_pos_path, len(checkpoint["parts"]))
+        chunk_db.to_csv(part_path, index=False)
+        checkpoint["parts"].append(part_path)
+        checkpoint["n_rows"] += len(chunk_db.index)
+    checkpoint["next_sent_idx"] = next_sent_idx
+    save_checkpoint(sent_pos_path, checkpoint)
+
+
+def read_part(part_path):
+    # cells back exactly as written
+    return pd.read_csv(part_path, dtype=str, keep_default_na=False)
+
+
+def merge_sent_pos_parts(sent_pos_path, checkpoint, doc_idx_col):
+    # streams the parts into one csv with the columns a single build would
+    # give: union of the part columns in order of appearance, then doc_idx
+    # aligned by row index as sent_tokens_db.assign(doc_idx=...) did
+    columns = []
+    for part_path in checkpoint["parts"]:
+        for col in pd.read_csv(part_path, nrows=0).columns:
+            if not col in columns:
+                columns.append(col)
+    n_rows = checkpoint["n_rows"]
+    if len(columns) == 0:
+        pd.DataFrame().assign(doc_idx=doc_idx_col).to_csv(sent_pos_path, index=False)
+        return
+    doc_idx_col = doc_idx_col.reindex(range(n_rows))
+    offset = 0
+    for i, part_path in enumerate(checkpoint["parts"]):
+        part_db = read_part(part_path).reindex(columns=columns)
+        part_db.index = range(offset, offset + len(part_db.index))
+        part_db["doc_idx"] = doc_idx_col[part_db.index]
+        part_db.to_csv(sent_pos_path, index=False, header=(i == 0), mode="w" if i == 0 else "a")
+        offset += len(part_db.index)
+
+
+def remove_checkpoint(sent_pos_path, checkpoint):
+    for part_path in checkpoint["parts"]:
+        os.remove(part_path)
+    os.remove(get_checkpoint_path(sent_pos_path))
+
+
+def tag_doc_sentences(sent_pos_path, batch_size=1, n_in_flight=1, resume=True):
+    # tags sent_text_db db_step sentences at a time: each chunk goes to a part
+    # file and the checkpoint, so only the current chunk is held in memory and
+    # a restarted run continues after the last flushed chunk
+    global lattice_columns
+    texts = sent_text_db["text"].tolist()
+    sent_indices = sent_text_db.index.tolist()
+    texts_hash = get_texts_hash(texts)
+    checkpoint = load_checkpoint(sent_pos_path, texts_hash, resume)
+    if checkpoint["next_sent_idx"] != 0:
+        print("Resuming from sentence {}".format(checkpoint["next_sent_idx"]))
+    lattice_columns = new_lattice_columns()
+    for start in range(checkpoint["next_sent_idx"], len(sent_indices), db_step):
+        end = min(start + db_step, len(sent_indices))
+        for sent_idx, lattice in iter_tagged_lattices(
+            texts[start:end], sent_indices[start:end], batch_size, n_in_flight
+        ):
+            handle_lattice(lattice, sent_idx)
+        flush_chunk(sent_pos_path, checkpoint, end)
+    merge_sent_pos_parts(sent_pos_path, checkpoint, sent_text_db["doc_idx"])
+    remove_checkpoint(sent_pos_path, checkpoint)
+
+
+def parse_all_sentenses(doc_list, batch_size=1, n_in_flight=1, use_cache=False, cache_path=None, resume=True):
+    # batch_size > 1 packs up to that many sentences into one yap request,
+    # n_in_flight > 1 keeps that many requests running concurrently,
+    # use_cache only sends sentences missing from the yap cache,
+    # resume continues a document from its checkpoint after a crash
     global sent_text_db
-    global sent_tokens_db
+    if use_cache:
+        open_yap_cache(cache_path)
+        reset_cache_stats()
     doc_num = len(doc_list)
     for doc_idx, doc_path in enumerate(doc_list):
         print("Started doc {} of {}".format(doc_idx, doc_num))
         sent_text_db = pd.read_csv(doc_path, usecols=["text", "doc_idx"])
-        sent_tokens_db = pd.DataFrame()
         doc_idx_from_name = common_utils.get_doc_idx_from_name(doc_path)
         doc_location = os.path.dirname(doc_path)
         local_name = "{:02d}_sent_pos_db.csv".format(doc_idx_from_name)
-        for sent_idx in sent_text_db.index:
-            sent_to_tags(sent_idx)
-        sent_tokens_db = sent_tokens_db.assign(doc_idx=sent_text_db["doc_idx"])
-        sent_tokens_db.to_csv(os.path.join(doc_location, local_name), index=False)
-        del sent_tokens_db
+        tag_doc_sentences(
+            os.path.join(doc_location, local_name), batch_size, n_in_flight, resume
+        )
         del sent_text_db
-        # sent_tokens_db.to_csv(local_name,index=False)
         print("Saved db {}".format(local_name))
+    if use_cache:
+        print_cache_stats()
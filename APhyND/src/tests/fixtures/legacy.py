@@ -0,0 +1,248 @@
+# former implementations of the optimized pipeline stages, the tests and
+# benchmarks check the current ones against them
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import defines
+import doc_utils_clean
+import pos_yap_process
+
+
+def feature_utils():
+    # imported on use, it needs fasttext and the crf packages
+    import feature_utils
+    return feature_utils
+
+
+### SENTENCE TABLE ###
+
+
+def legacy_sent_db(block_db, merge_short_sent):
+    # reference: sentence table grown one cell at a time with .loc
+    sent_db = pd.DataFrame()
+    for block_db_idx in block_db.index:
+        block_line = block_db.iloc[block_db_idx]
+        sent_list = doc_utils_clean.split_block_to_sentences(
+            block_line["text"], merge_short_sent)
+        for i, sentence in enumerate(sent_list):
+            if not doc_utils_clean.text_contains_char(sentence):
+                continue
+            curr_db_idx = sent_db.shape[0]
+            sent_db.loc[curr_db_idx, "is_question"] = 1 if "?" in sentence else 0
+            sent_db.loc[curr_db_idx, 'text'] = re.sub(r'\?', '', sentence)
+            sent_db.loc[curr_db_idx, "sent_idx_in_block"] = i
+            sent_db.loc[curr_db_idx, "block_idx"] = block_db_idx
+            for col in doc_utils_clean.SENT_DB_BLOCK_COLUMNS:
+                sent_db.loc[curr_db_idx, col] = block_line[col]
+            sent_db.loc[curr_db_idx, "sent_len"] = len(sentence)
+    return sent_db
+
+
+### TEXT NORMALIZATION ###
+
+
+def legacy_block_normalize(text):
+    # chain of single rule functions applied by split_block_to_sentences before
+    text = doc_utils_clean.remove_lr_annotation(text)
+    text = doc_utils_clean.replace_brackets(text)
+    text = doc_utils_clean.remove_multi_dots(text)
+    text = doc_utils_clean.remove_multi_x(text)
+    text = doc_utils_clean.remove_symbols(text)
+    text = doc_utils_clean.unify_numbers(text)
+    text = doc_utils_clean.replase_shekel_char(text)
+    return text
+
+
+def legacy_clean_text(text):
+    # clean_text before: every found summary compiled as a regex
+    text_ = text
+    for summary in re.findall("%.*?%", text_):
+        text_ = re.sub(summary, "", text_)
+    return doc_utils_clean.remove_punctuation(text_)
+
+
+### BLOCK TABLE ###
+
+
+def legacy_block_db(par_db):
+    # reference: block table grown one cell at a time with .loc, narrative
+    # index taken from the max over the table built so far
+    block_db = pd.DataFrame()
+    for par_db_idx in par_db.index:
+        block_list = doc_utils_clean.split_par_to_blocks_keep_order(par_db_idx)
+        par_db_line = par_db.iloc[par_db_idx]
+        for i, tupple in enumerate(block_list):
+            curr_db_idx = block_db.shape[0]
+            curr_nar_idx = 0 if curr_db_idx == 0 else block_db["nar_idx"].max()
+            if tupple[0] in ["start", "whole"]:
+                curr_nar_idx += 1
+            is_nar = 1 if tupple[0] != "not_nar" else 0
+            block_db.loc[curr_db_idx, "text"] = tupple[1]
+            block_db.loc[curr_db_idx, "is_nar"] = is_nar
+            block_db.loc[curr_db_idx, "doc_idx"] = par_db_line["doc_idx"]
+            block_db.loc[curr_db_idx, "par_idx_in_doc"] = par_db_line["par_idx_in_doc"]
+            block_db.loc[curr_db_idx, "par_pos_in_doc"] = par_db_line["par_pos_in_doc"]
+            block_db.loc[curr_db_idx, "par_db_idx"] = par_db_idx
+            block_db.loc[curr_db_idx, "par_type"] = par_db_line["par_type"]
+            block_db.loc[curr_db_idx, "block_type"] = tupple[0]
+            block_db.loc[curr_db_idx, "nar_idx"] = curr_nar_idx if is_nar else 0
+    return block_db
+
+
+### SHORT SENTENCE MERGE ###
+
+
+def legacy_handle_short_sent_in_block(block):
+    # reference: block rebuilt with replace_char_at_index on every merged dot
+    handled_block = block
+    block_len = len(handled_block)
+    curr_dot_idx = block_len - 1
+    prev_dot_idx = 0
+    while curr_dot_idx < block_len:
+        curr_dot_idx = doc_utils_clean.find_dot_idx(handled_block, prev_dot_idx + 1)
+        if curr_dot_idx < 1:
+            break
+        focus = handled_block[prev_dot_idx:curr_dot_idx]
+        word_count = doc_utils_clean.count_words(focus)
+        if word_count > 0 and word_count <= defines.MIN_SENT_LEN:
+            handled_block = doc_utils_clean.replace_char_at_index(handled_block, curr_dot_idx)
+        prev_dot_idx = curr_dot_idx
+    return handled_block
+
+
+### BLOCK ORDER IN PARAGRAPH ###
+
+
+def legacy_split_par_to_blocks_keep_order(par_db_idx):
+    # reference: every block cleaned again and searched with list.index
+    par_db = doc_utils_clean.par_db
+    par = par_db.loc[par_db_idx, "text"]
+    if par.count(defines.START_CHAR) == 0 and par.count(defines.END_CHAR) == 0:
+        return doc_utils_clean.split_par_to_blocks_keep_order(par_db_idx)
+
+    def get_index(splited_clean, block):
+        cl_block = doc_utils_clean.clean_text(block)
+        return splited_clean.index(cl_block) if cl_block in splited_clean else -1
+
+    block_list = []
+    splited = re.split("&|#", par)
+    splited_clean = splited.copy()
+    for i, block in enumerate(splited):
+        if doc_utils_clean.block_has_summary(block):
+            block, summ = doc_utils_clean.extract_narrative_summary(block)
+        splited_clean[i] = doc_utils_clean.clean_text(block)
+    my_regex = {
+        "whole": defines.START_CHAR + ".*?" + defines.END_CHAR,
+        "start": defines.START_CHAR + ".*",
+        "end": ".*" + defines.END_CHAR,
+    }
+    outside_nar = par
+    for tag, regex in my_regex.items():
+        for block in re.findall(regex, outside_nar):
+            if len(block) != 0:
+                block_idx = get_index(splited_clean, block)
+                splited[block_idx] = ""
+                block_list.insert(block_idx, (tag, block))
+        outside_nar = re.sub(regex, "", outside_nar)
+    for i, block in enumerate(splited):
+        if len(block) != 0:
+            if doc_utils_clean.block_has_summary(block):
+                block, summ = doc_utils_clean.extract_narrative_summary(block)
+            block_list.insert(get_index(splited_clean, block), ("not_nar", block))
+    return block_list
+
+
+### YAP LATTICE TABLE ###
+
+
+def legacy_sent_tokens_db(lattices):
+    # reference: lattice table grown one cell at a time with .loc
+    sent_tokens_db = pd.DataFrame()
+    for sent_idx, text in enumerate(lattices):
+        for r in text.split("\n"):
+            curr_word_idx = sent_tokens_db.shape[0]
+            for j, token in enumerate(r.split("\t")):
+                if len(token) == 0:
+                    continue
+                tag = pos_yap_process.yap_tag_list[j]
+                sent_tokens_db.loc[curr_word_idx, tag] = token
+                sent_tokens_db.loc[curr_word_idx, "sent_idx"] = sent_idx
+                if tag == "FEATS" and "|" in token:
+                    for fea in token.split("|"):
+                        [name, value] = fea.split("=")
+                        sent_tokens_db.loc[curr_word_idx, "f_{}".format(name)] = value
+    return sent_tokens_db
+
+
+### POS FEATURES ###
+
+
+def legacy_save_doc_pos_features(dir_name, doc_idx):
+    # reference: lemma and count dbs each read sent_pos_db, the merge reads
+    # sent_db and the saved count db back
+    dir_path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name)
+    pos_path = os.path.join(dir_path, "{:02d}_sent_pos_db.csv".format(doc_idx))
+    sent_pos_db = pd.read_csv(pos_path, usecols=["sent_idx", "LEMMA"])
+    sent_lemma_db = pd.DataFrame()
+    sent_lemma_db["sent_lemma"] = sent_pos_db.groupby(
+        "sent_idx")["LEMMA"].apply(lambda x: "%s" % " ".join(x)).tolist()
+    sent_lemma_db.to_csv(os.path.join(dir_path, "{:02d}_sent_lemma_db.csv".format(doc_idx)), index=False)
+    sent_pos_db = pd.read_csv(pos_path)
+    sent_pos_dummies = pd.get_dummies(sent_pos_db, columns=feature_utils().POS_COUNT_COLUMNS)
+    sent_pos_dummies.fillna(value=0, inplace=True)
+    count_db = sent_pos_dummies.groupby("sent_idx").sum(numeric_only=True)
+    count_db["TOKEN"] = sent_pos_dummies.groupby("sent_idx")["TOKEN"].max()
+    count_db.drop(["FROM", "TO", "doc_idx"], inplace=True, axis=1)
+    count_db.iloc[:, 1:] = count_db.iloc[:, 1:].div(count_db.TOKEN, axis=0)
+    count_path = os.path.join(dir_path, "{:02d}_sent_pos_count_db.csv".format(doc_idx))
+    count_db.to_csv(count_path, index=False)
+    sent_db = pd.read_csv(os.path.join(dir_path, "{:02d}_sent_db.csv".format(doc_idx)),
+                          usecols=defines.SENT_FEATURES)
+    count_db = pd.read_csv(count_path)
+    merged_db = pd.merge(sent_db, count_db, left_index=True, right_index=True, validate="one_to_one")
+    merged_db.to_csv(os.path.join(dir_path, "{:02d}_merged_db.csv".format(doc_idx)), index=False)
+    return sent_lemma_db, merged_db
+
+
+### SENTENCE VECTORS ###
+
+
+def legacy_sent_vectors(dir_name, doc_idx, ft, dim=300):
+    # reference: iterrows, float64 csv text written and parsed back
+    dir_path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name)
+    sent_db = pd.read_csv(os.path.join(dir_path, "{:02d}_sent_db.csv".format(doc_idx)))
+    sent_vec_db = pd.DataFrame([ft.get_sentence_vector(row["text"]) for index, row in sent_db.iterrows()])
+    csv_path = os.path.join(dir_path, "{:02d}_sent_vec{}_db.csv".format(doc_idx, dim))
+    sent_vec_db.to_csv(csv_path, index=False)
+    return pd.read_csv(csv_path).values
+
+
+### NEIGHBOR SIMILARITY ###
+
+
+def legacy_doc_similarity(dir_name, doc_idx, sent_vectors, dim=300):
+    # reference: full n x n cosine_similarity written as csv and parsed back
+    csv_path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name,
+                            "{:02d}_sent_sim_vec{}_db.csv".format(doc_idx, dim))
+    pd.DataFrame(feature_utils().cosine_similarity(np.asarray(sent_vectors, dtype=np.float64))).to_csv(
+        csv_path, index=False)
+    return pd.read_csv(csv_path)
+
+
+### CORPUS VECTOR STORE ###
+
+
+def legacy_nearest_sentences(dir_name, doc_indices, doc_idx, sent_idx, top_n=10, dim=300):
+    # reference: every per document csv parsed to find the neighbors
+    dir_path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name)
+    doc_vectors = [pd.read_csv(os.path.join(dir_path, "{:02d}_sent_vec{}_db.csv".format(doc, dim))).values
+                   for doc in doc_indices]
+    ids = [(doc, i) for doc, vectors in zip(doc_indices, doc_vectors) for i in range(len(vectors))]
+    matrix = feature_utils().normalize(np.concatenate(doc_vectors))
+    row_idx = ids.index((doc_idx, sent_idx))
+    similarity = matrix @ matrix[row_idx]
+    similarity[row_idx] = -np.inf
+    return [ids[row] for row in np.argsort(-similarity, kind="stable")[:top_n]]
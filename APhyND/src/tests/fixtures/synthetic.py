@@ -0,0 +1,288 @@
+# synthetic transcripts, tables, lattices and vector models shared by the
+# tests and benchmarks/run_benchmarks.py
+import os
+import hashlib
+import random
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import defines
+import pos_yap_process
+
+# conversational vocabulary used to generate synthetic transcripts
+SYNTH_WORDS = [
+    "אני",
+    "לא",
+    "יודע",
+    "מה",
+    "קרה",
+    "אז",
+    "הלכתי",
+    "הביתה",
+    "ואמא",
+    "שלי",
+    "אמרה",
+    "כאילו",
+    "זהו",
+    "אבל",
+    "בעיני",
+    "זה",
+    "היה",
+    "קשה",
+    "מאוד",
+    "כן",
+    "הוא",
+    "ביום",
+    "ההוא",
+]
+
+
+def make_synthetic_sentence(rnd, min_words=1, max_words=12):
+    words = [rnd.choice(SYNTH_WORDS) for i in range(rnd.randint(min_words, max_words))]
+    return " ".join(words) + rnd.choice([".", ".", ".", "?", "..."])
+
+
+### TRANSCRIPT TABLES ###
+
+
+def make_synthetic_block_db(n_sent=5000, sent_per_block=5, seed=0):
+    # block table of a single transcript as stored in NN_block_db.csv
+    rnd = random.Random(seed)
+    n_blocks = int(np.ceil(n_sent / sent_per_block))
+    block_db = pd.DataFrame()
+    block_db["text"] = [
+        " ".join(make_synthetic_sentence(rnd) for j in range(sent_per_block))
+        for i in range(n_blocks)
+    ]
+    block_db["is_nar"] = [float(rnd.random() < 0.3) for i in range(n_blocks)]
+    block_db["doc_idx"] = 1.0
+    block_db["par_idx_in_doc"] = np.arange(n_blocks, dtype=float)
+    block_db["par_pos_in_doc"] = (block_db.index.values + 1) / n_blocks
+    block_db["par_db_idx"] = np.arange(n_blocks, dtype=float)
+    block_db["par_type"] = [rnd.choice(["client", "therapist"]) for i in range(n_blocks)]
+    block_db["block_type"] = np.where(block_db["is_nar"] == 1, "middle", "not_nar")
+    block_db["nar_idx"] = block_db["is_nar"].cumsum() * block_db["is_nar"]
+    return block_db
+
+
+def get_synthetic_block_texts(n_sent=5000, seed=0):
+    rnd = random.Random(seed)
+    noise = [" (L1 הערה-A)", " [צחוק]", " XXX מילה XX", " 125 ₪", " @ * <>", " %סיכום זהו%", "..", "?.."]
+    texts = make_synthetic_block_db(n_sent, seed=seed)["text"].tolist()
+    return [text + rnd.choice(noise) + " " + text for text in texts]
+
+
+def make_synthetic_par_db(n_par=1000, max_sent=8, seed=0):
+    # paragraph table of a single transcript as stored in NN_par_db.csv,
+    # with narrative start / end markers inside and across paragraphs
+    rnd = random.Random(seed)
+    texts = []
+    is_nar = []
+    inside = 0
+    for i in range(n_par):
+        sentences = []
+        par_is_nar = inside
+        for j in range(rnd.randint(1, max_sent)):
+            sentence = make_synthetic_sentence(rnd)
+            if not inside and rnd.random() < 0.1:
+                sentence = defines.START_CHAR + sentence
+                inside = par_is_nar = 1
+            elif inside and rnd.random() < 0.15:
+                sentence = sentence + defines.END_CHAR
+                inside = 0
+            sentences.append(sentence)
+        texts.append(" ".join(sentences))
+        is_nar.append(float(par_is_nar))
+    par_db = pd.DataFrame()
+    par_db["doc_idx"] = np.ones(n_par)
+    par_db["text"] = texts
+    par_db["par_len"] = [float(len(text)) for text in texts]
+    par_db["par_type"] = [rnd.choice(["client", "therapist"]) for i in range(n_par)]
+    par_db["par_idx_in_doc"] = np.arange(n_par, dtype=float)
+    par_db["is_nar"] = is_nar
+    par_db["par_pos_in_doc"] = (par_db.index.values + 1) / n_par
+    return par_db
+
+
+def write_synthetic_docx(path, n_par=60, max_sent=8, seed=0):
+    # transcript with CLIENT / THERAPIST tags as the parser reads it
+    import docx
+    par_db = make_synthetic_par_db(n_par, max_sent, seed)
+    doc = docx.Document()
+    for par_type, text in zip(par_db["par_type"], par_db["text"]):
+        doc.add_paragraph("{}: {}".format(par_type.upper(), text))
+    doc.save(path)
+
+
+def make_synthetic_marked_par_db(n_par=50, n_nar=40, seed=0):
+    # paragraphs holding many narrative blocks each, as in long monologues
+    rnd = random.Random(seed)
+    texts = []
+    for i in range(n_par):
+        blocks = []
+        for j in range(n_nar):
+            blocks.append(make_synthetic_sentence(rnd))
+            blocks.append(defines.START_CHAR + make_synthetic_sentence(rnd) + defines.END_CHAR)
+        texts.append(" ".join(blocks))
+    par_db = make_synthetic_par_db(n_par, seed=seed)
+    par_db["text"] = texts
+    par_db["is_nar"] = 1.0
+    return par_db
+
+
+### YAP LATTICES ###
+
+
+SYNTH_FEATS = [
+    "_",
+    "gen=M",
+    "gen=M|num=S",
+    "gen=F|num=P|per=3",
+    "num=S|suf_gen=F|suf_num=S",
+    "tense=PAST|gen=M|num=S|per=1",
+    "suf_per=2|suf_gen=M|suf_num=P",
+]
+
+
+SYNTH_POS = ["NN", "VB", "PRP", "IN", "CONJ", "RB", "DEF", "REL"]
+
+
+def make_synthetic_lattice(rnd, n_tokens=8):
+    # md_lattice of one sentence: FROM TO FORM LEMMA CPOSTAG POSTAG FEATS TOKEN
+    rows = []
+    for i in range(n_tokens):
+        pos = rnd.choice(SYNTH_POS)
+        word = rnd.choice(SYNTH_WORDS)
+        rows.append("\t".join(
+            [str(i), str(i + 1), word, word, pos, pos, rnd.choice(SYNTH_FEATS), str(i + 1)]))
+    return "\n".join(rows) + "\n"
+
+
+def get_synthetic_lattices(n_sent=1000, seed=0):
+    rnd = random.Random(seed)
+    return [make_synthetic_lattice(rnd, rnd.randint(1, 15)) for i in range(n_sent)]
+
+
+def columnar_sent_tokens_db(lattices):
+    pos_yap_process.lattice_columns = pos_yap_process.new_lattice_columns()
+    for sent_idx, text in enumerate(lattices):
+        pos_yap_process.parse_server_response(text, sent_idx)
+    return pos_yap_process.collect_sent_tokens_db()
+
+
+def write_synthetic_sent_db(path, n_sent=300, seed=0):
+    # sentence texts as they reach yap: punctuation removed, single spaced
+    rnd = random.Random(seed)
+    sent_db = pd.DataFrame()
+    sent_db["text"] = [
+        " ".join(rnd.choice(SYNTH_WORDS) for j in range(rnd.randint(2, 12)))
+        for i in range(n_sent)
+    ]
+    sent_db["doc_idx"] = 1.0
+    sent_db.to_csv(path, index=False)
+
+
+def get_file_md5(path):
+    with open(path, "rb") as fp:
+        return hashlib.md5(fp.read()).hexdigest()
+
+
+### FEATURE INPUTS ###
+
+
+def write_synthetic_doc_dbs(dir_name, doc_idx, n_sent=2000, seed=0):
+    # NN_sent_pos_db and NN_sent_db as the parsing stages leave them
+    rnd = random.Random(seed)
+    dir_path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name)
+    os.makedirs(dir_path, exist_ok=True)
+    sent_pos_db = columnar_sent_tokens_db(get_synthetic_lattices(n_sent, seed))
+    sent_pos_db["doc_idx"] = float(doc_idx)
+    sent_pos_db.to_csv(os.path.join(dir_path, "{:02d}_sent_pos_db.csv".format(doc_idx)), index=False)
+    sent_db = pd.DataFrame({col: [rnd.random() for i in range(n_sent)] for col in defines.SENT_FEATURES})
+    sent_db["text"] = [make_synthetic_sentence(rnd) for i in range(n_sent)]
+    sent_db.to_csv(os.path.join(dir_path, "{:02d}_sent_db.csv".format(doc_idx)), index=False)
+
+
+def write_synthetic_doc_vectors(dir_name, n_docs=80, min_sent=50, max_sent=400, seed=0, dim=300):
+    rng = np.random.default_rng(seed)
+    dir_path = os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name)
+    os.makedirs(dir_path, exist_ok=True)
+    doc_vectors = {}
+    for doc_idx in range(1, n_docs + 1):
+        doc_vectors[doc_idx] = rng.standard_normal(
+            (rng.integers(min_sent, max_sent), dim)).astype(np.float32)
+        np.save(os.path.join(dir_path, "{:02d}_sent_vec{}.npy".format(doc_idx, dim)), doc_vectors[doc_idx])
+        pd.DataFrame(doc_vectors[doc_idx]).to_csv(
+            os.path.join(dir_path, "{:02d}_sent_vec{}_db.csv".format(doc_idx, dim)), index=False)
+    return doc_vectors
+
+
+def get_synthetic_splits(doc_indices, n_splits=5, n_test=3, seed=0):
+    rnd = random.Random(seed)
+    splits = {}
+    for split_idx in range(n_splits):
+        test = sorted(rnd.sample(doc_indices, n_test))
+        splits[split_idx] = {"train": [doc for doc in doc_indices if not doc in test], "test": test}
+    return splits
+
+
+def same_csr(a, b):
+    return (a.shape == b.shape and np.array_equal(a.indptr, b.indptr) and
+            np.array_equal(a.indices, b.indices) and a.data.tobytes() == b.data.tobytes())
+
+
+### VECTOR MODELS ###
+
+
+class HashVectorModel:
+    # stand-in for the fastText model: a deterministic float32 vector per
+    # sentence, the cost is in the pipeline around it
+    def __init__(self, dim=300):
+        self.dim = dim
+
+    def get_dimension(self):
+        return self.dim
+
+    def get_sentence_vector(self, text):
+        rnd = np.random.default_rng(int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16))
+        return rnd.standard_normal(self.dim).astype(np.float32)
+
+
+class SubwordVectorModel:
+    # stand-in for an unsupervised fastText model: a word vector is the mean
+    # of hashed character n-gram vectors and get_sentence_vector follows
+    # FastText::getSentenceVector (normalize each word vector, skip zero
+    # ones, average) in float32
+    def __init__(self, dim=300, n_buckets=20000, min_n=3, max_n=6, seed=0):
+        self.dim = dim
+        self.min_n = min_n
+        self.max_n = max_n
+        self.buckets = np.random.default_rng(seed).standard_normal((n_buckets, dim)).astype(np.float32)
+
+    def get_dimension(self):
+        return self.dim
+
+    def get_word_vector(self, word):
+        if word == "</s>":  # a word with no subwords, its vector is zero
+            return np.zeros(self.dim, dtype=np.float32)
+        word = "<" + word + ">"
+        rows = [word] + [word[i:i + n] for n in range(self.min_n, self.max_n + 1)
+                         for i in range(len(word) - n + 1)]
+        rows = [zlib.crc32(ngram.encode("utf-8")) % len(self.buckets) for ngram in rows]
+        return self.buckets[rows].mean(axis=0)
+
+    def get_sentence_vector(self, text):
+        sent_vector = np.zeros(self.dim, dtype=np.float32)
+        count = 0
+        for word in re.findall(r"[^ \t\n\v\f\r]+", text):
+            word_vector = self.get_word_vector(word)
+            norm = np.linalg.norm(word_vector)
+            if norm > 0:
+                sent_vector += word_vector * np.float32(1.0 / norm)
+                count += 1
+        if count > 0:
+            sent_vector *= np.float32(1.0 / count)
+        return sent_vector
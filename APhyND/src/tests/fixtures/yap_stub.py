@@ -0,0 +1,142 @@
+# local stand-in for the yap api, used to test and benchmark pos_yap_process
+# without the yap binary. It answers /yap/heb/joint like yap does: the text
+# is split to tokens at spaces and a double space ends a sentence, the reply
+# holds one md_lattice per sentence separated by an empty line. Lattices are
+# deterministic fakes, latency per request and per token is configurable.
+# With cpu_bound the latency is spent busy looping, so like yap one stub
+# process serves a single request at a time and only a server pool scales.
+#   python yap_stub.py --port 8000 --latency 0.02 --cpu-bound
+import argparse
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_POS = ["NN", "VB", "PRP", "IN", "CONJ", "RB", "DEF", "REL", "JJ", "CD"]
+STUB_FEATS = [
+    "_",
+    "gen=M",
+    "gen=M|num=S",
+    "gen=F|num=S",
+    "gen=M|num=P|per=3",
+    "gen=F|num=S|per=1|tense=PAST",
+]
+
+
+def split_yap_input(text):
+    sentences = []
+    tokens = []
+    for token in text.split(" "):
+        if len(token) == 0:
+            if len(tokens) != 0:
+                sentences.append(tokens)
+                tokens = []
+        else:
+            tokens.append(token)
+    if len(tokens) != 0:
+        sentences.append(tokens)
+    return sentences
+
+
+def get_fake_lattice(tokens):
+    rows = []
+    for i, token in enumerate(tokens):
+        token_hash = zlib.crc32(token.encode("utf-8"))
+        pos = STUB_POS[token_hash % len(STUB_POS)]
+        feats = STUB_FEATS[(token_hash >> 8) % len(STUB_FEATS)]
+        rows.append(
+            "\t".join([str(i), str(i + 1), token, token, pos, pos, feats, str(i + 1)])
+        )
+    return "\n".join(rows) + "\n"
+
+
+def get_fake_md_lattice(text):
+    return "\n".join(get_fake_lattice(tokens) for tokens in split_yap_input(text)) + "\n"
+
+
+def wait_latency(seconds, cpu_bound=False):
+    if not cpu_bound:
+        time.sleep(seconds)
+        return
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:  # holds the GIL like a busy parser
+        pass
+
+
+class YapStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as the pooled client expects
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            text = json.loads(body.decode("utf-8"))["text"]
+        except (ValueError, KeyError):
+            self.send_reply(400, {"error": "expected json with a text field"})
+            return
+        n_tokens = len(text.split())
+        wait_latency(
+            self.server.latency + self.server.token_latency * n_tokens,
+            self.server.cpu_bound,
+        )
+        md_lattice = get_fake_md_lattice(text)
+        with self.server.lock:
+            self.server.n_requests += 1
+        self.send_reply(
+            200, {"ma_lattice": md_lattice, "md_lattice": md_lattice, "dep_tree": ""}
+        )
+
+    do_POST = do_GET
+
+    def send_reply(self, code, reply):
+        data = json.dumps(reply).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_stub_server(port=8000, latency=0.0, token_latency=0.0, host="localhost", cpu_bound=False):
+    server = ThreadingHTTPServer((host, port), YapStubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.token_latency = token_latency
+    server.cpu_bound = cpu_bound
+    server.n_requests = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def start_stub_server(port=8000, latency=0.0, token_latency=0.0, host="localhost", cpu_bound=False):
+    # serves in a daemon thread, stop with server.shutdown()
+    server = make_stub_server(port, latency, token_latency, host, cpu_bound)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="yap api stand-in")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per token")
+    parser.add_argument("--cpu-bound", action="store_true", help="busy loop instead of sleeping")
+    args = parser.parse_args()
+    server = make_stub_server(
+        args.port, args.latency, args.token_latency, args.host, args.cpu_bound
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
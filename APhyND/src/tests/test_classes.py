@@ -0,0 +1,57 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import classes
+import feature_utils
+from fixtures import synthetic
+
+
+@pytest.fixture
+def tf_corpus(tmp_path, monkeypatch):
+    # sent_db and sent_lemma_db of 6 docs, 2 splits
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(feature_utils, "tf_counts", {})
+    doc_indices = list(range(1, 7))
+    for doc_idx in doc_indices:
+        synthetic.write_synthetic_doc_dbs("tf", doc_idx, 200, doc_idx)
+        feature_utils.save_doc_pos_features("tf", doc_idx)
+    return "tf", synthetic.get_synthetic_splits(doc_indices, 2, 2)
+
+
+def transform_docs(tf_params, doc_indices):
+    return [feature_utils.tfidf_transform_doc(tf_params.dir_name, doc_idx, tf_params.tf, tf_params.per_lemma)
+            for doc_idx in doc_indices]
+
+
+@pytest.mark.parametrize("tf_type", ["word", "char_wb", "lemma"])
+def test_shared_counts_tfidf_pickle_round_trip(tf_corpus, tf_type):
+    dir_name, splits = tf_corpus
+    doc_indices = splits[0]["train"] + splits[0]["test"]
+    vectorizer_params = classes.TfParams(dir_name, tf_type, 0, splits, shared_counts=False)
+    tf_params = classes.TfParams(dir_name, tf_type, 0, splits)
+    loaded_params = pickle.loads(pickle.dumps(tf_params))
+
+    assert loaded_params.tf.counts is None
+    assert np.array_equal(loaded_params.features, vectorizer_params.features)
+    for expected, loaded in zip(transform_docs(vectorizer_params, doc_indices),
+                                transform_docs(loaded_params, doc_indices)):
+        assert synthetic.same_csr(expected, loaded)
+
+
+@pytest.mark.parametrize("tf_type", ["word", "lemma"])
+def test_shared_counts_follow_reparsed_docs(tf_corpus, tf_type):
+    dir_name, splits = tf_corpus
+    classes.TfParams(dir_name, tf_type, 0, splits)
+    for doc_idx in splits[1]["train"][:2]:  # parsed again with other sentences
+        synthetic.write_synthetic_doc_dbs(dir_name, doc_idx, 300, 100 + doc_idx)
+        feature_utils.save_doc_pos_features(dir_name, doc_idx)
+    doc_indices = splits[1]["train"] + splits[1]["test"]
+    vectorizer_params = classes.TfParams(dir_name, tf_type, 1, splits, shared_counts=False)
+    tf_params = classes.TfParams(dir_name, tf_type, 1, splits)
+
+    assert np.array_equal(tf_params.features, vectorizer_params.features)
+    for expected, shared in zip(transform_docs(vectorizer_params, doc_indices),
+                                transform_docs(tf_params, doc_indices)):
+        assert synthetic.same_csr(expected, shared)
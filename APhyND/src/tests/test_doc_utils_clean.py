@@ -0,0 +1,186 @@
+import filecmp
+import os
+
+import pandas as pd
+import pytest
+
+import defines
+import doc_utils_clean
+from fixtures import legacy, synthetic
+
+
+@pytest.fixture
+def doc_paths(tmp_path, monkeypatch):
+    # two transcripts, the dataframes dirs are created under tmp_path
+    monkeypatch.chdir(tmp_path)
+    for dir_name in ["chain", "in_memory"]:
+        os.makedirs(os.path.join(defines.PATH_TO_DFS, dir_name))
+    paths = []
+    for doc_idx in [1, 2]:
+        path = str(tmp_path / "{:02d}_transcript.docx".format(doc_idx))
+        synthetic.write_synthetic_docx(path, seed=doc_idx)
+        paths.append(path)
+    return paths
+
+
+def get_dir_path(dir_name):
+    return os.path.join(os.getcwd(), defines.PATH_TO_DFS, dir_name)
+
+
+def parse_csv_chain(dir_name, doc_paths, merge_short_sent):
+    # reference: every stage reads the table of the previous one from csv
+    doc_utils_clean.save_docs_db(doc_paths, dir_name)
+    doc_utils_clean.doc_db = pd.read_csv(os.path.join(get_dir_path(dir_name), "doc_db.csv"))
+    doc_utils_clean.debug_db = pd.DataFrame()
+    for doc_idx in [1, 2]:
+        doc_utils_clean.save_doc_paragraphs(dir_name, doc_idx)
+        doc_utils_clean.save_doc_blocks(dir_name, doc_idx)
+        doc_utils_clean.save_doc_sentences(dir_name, doc_idx, merge_short_sent)
+
+
+@pytest.mark.parametrize("merge_short_sent", [False, True])
+@pytest.mark.parametrize("save_intermediate", [True, False])
+def test_in_memory_parse_matches_csv_chain(doc_paths, merge_short_sent, save_intermediate):
+    parse_csv_chain("chain", doc_paths, merge_short_sent)
+    doc_utils_clean.parse_all_docs(
+        "in_memory", merge_short_sent, doc_paths, save_intermediate=save_intermediate)
+
+    db_names = ["par_db", "block_db", "sent_db"] if save_intermediate else ["sent_db"]
+    for doc_idx in [1, 2]:
+        for db_name in db_names:
+            name = "{:02d}_{}.csv".format(doc_idx, db_name)
+            assert filecmp.cmp(os.path.join(get_dir_path("chain"), name),
+                               os.path.join(get_dir_path("in_memory"), name), shallow=False), name
+
+
+def read_doc_dbs(dir_name, db_names=["par_db", "block_db", "sent_db"]):
+    return {
+        name: open(os.path.join(get_dir_path(dir_name), name), "rb").read()
+        for name in ["{:02d}_{}.csv".format(doc_idx, db_name) for doc_idx in [1, 2] for db_name in db_names]
+    }
+
+
+def test_cache_hit_requires_written_intermediates(doc_paths):
+    doc_utils_clean.parse_all_docs("chain", False, doc_paths, use_cache=True)
+    synthetic.write_synthetic_docx(doc_paths[0], seed=10)  # the transcript is edited
+    doc_utils_clean.parse_all_docs("chain", False, doc_paths, use_cache=True, save_intermediate=False)
+    doc_utils_clean.parse_all_docs("chain", False, doc_paths, use_cache=True)
+    doc_utils_clean.parse_all_docs("in_memory", False, doc_paths)
+
+    assert read_doc_dbs("chain") == read_doc_dbs("in_memory")
+
+
+def test_parse_without_cache_drops_manifest_entries(doc_paths):
+    doc_utils_clean.parse_all_docs("chain", False, doc_paths, use_cache=True)
+    synthetic.write_synthetic_docx(doc_paths[0], seed=10)
+    doc_utils_clean.parse_all_docs("chain", False, doc_paths)
+    synthetic.write_synthetic_docx(doc_paths[0], seed=1)  # back to the first version
+    doc_utils_clean.parse_all_docs("chain", False, doc_paths, use_cache=True)
+    doc_utils_clean.parse_all_docs("in_memory", False, doc_paths)
+
+    assert read_doc_dbs("chain") == read_doc_dbs("in_memory")
+
+
+def test_parse_without_cache_skips_hashing(doc_paths, monkeypatch):
+    def get_file_hash(path):
+        raise AssertionError("hashed {}".format(path))
+
+    monkeypatch.setattr(doc_utils_clean, "get_file_hash", get_file_hash)
+    doc_utils_clean.parse_all_docs("chain", False, doc_paths)
+    doc_utils_clean.parse_doc("chain", 1, False, single=True)
+
+    assert not os.path.isfile(doc_utils_clean.get_manifest_path("chain"))
+
+
+SHORT_SENT_BLOCKS = [
+    # leading / doubled / trailing dots, dots glued to words, tabs and newlines
+    "",
+    ".",
+    "..",
+    ". כן.",
+    ".כן. לא.",
+    "כן.לא.זהו.",
+    "כן . . לא",
+    "  . אני לא יודע.  ",
+    "כן.\tלא.\nאז הלכתי הביתה ואמא שלי אמרה.",
+    "אני לא יודע מה קרה. כן. לא. אז הלכתי הביתה ואמא שלי אמרה. זהו",
+]
+
+
+def test_short_sent_merge_matches_reference():
+    blocks = SHORT_SENT_BLOCKS + synthetic.get_synthetic_block_texts()
+    mismatches = [block for block in blocks if doc_utils_clean.handle_short_sent_in_block(block)
+                  != legacy.legacy_handle_short_sent_in_block(block)]
+    assert mismatches == []
+
+
+def test_parse_doc_drops_manifest_entry(doc_paths):
+    # parse_doc without single, as the notebooks call it after a cached run
+    doc_utils_clean.parse_all_docs("chain", False, doc_paths, use_cache=True)
+    doc_utils_clean.doc_db = pd.read_csv(os.path.join(get_dir_path("chain"), "doc_db.csv"))
+    doc_utils_clean.parse_doc("chain", 1, merge_short_sent=True)
+    doc_utils_clean.parse_all_docs("chain", False, doc_paths, use_cache=True)
+    doc_utils_clean.parse_all_docs("in_memory", False, doc_paths)
+
+    assert read_doc_dbs("chain") == read_doc_dbs("in_memory")
+
+
+def test_parse_doc_cache_needs_single(doc_paths):
+    with pytest.raises(ValueError):
+        doc_utils_clean.parse_doc("chain", 1, False, use_cache=True)
+
+
+def test_row_wrappers_match_parser(doc_paths, monkeypatch):
+    parser = doc_utils_clean.DocumentParser(merge_short_sent=True)
+    doc = parser.parse(doc_paths[0], 1)
+    monkeypatch.setattr(doc_utils_clean, "debug_db", pd.DataFrame(), raising=False)
+    monkeypatch.setattr(doc_utils_clean, "par_db", doc.par_db, raising=False)
+    monkeypatch.setattr(doc_utils_clean, "block_db", pd.DataFrame(), raising=False)
+    monkeypatch.setattr(doc_utils_clean, "sent_db", pd.DataFrame(), raising=False)
+
+    for par_db_idx in range(len(doc.par_db.index)):
+        doc_utils_clean.add_blocks_of_par_to_db(par_db_idx)
+    pd.testing.assert_frame_equal(doc_utils_clean.block_db, doc.block_db)
+    assert doc_utils_clean.get_last_nar_idx_from_block_db() == doc.block_db["nar_idx"].max()
+
+    doc_utils_clean.block_db = doc.block_db
+    for block_db_idx in range(len(doc.block_db.index)):
+        doc_utils_clean.add_sentences_of_blocks_to_db(block_db_idx, True)
+    pd.testing.assert_frame_equal(doc_utils_clean.sent_db,
+                                  doc.sent_db[doc_utils_clean.sent_db.columns])
+
+
+@pytest.mark.parametrize("merge_short_sent", [False, True])
+def test_sent_db_matches_cell_by_cell_build(monkeypatch, merge_short_sent):
+    block_db = synthetic.make_synthetic_block_db(500)
+    monkeypatch.setattr(doc_utils_clean, "debug_db", pd.DataFrame(), raising=False)
+    monkeypatch.setattr(doc_utils_clean, "block_db", block_db, raising=False)
+    sent_db = doc_utils_clean.build_doc_sentences(merge_short_sent)
+    legacy_db = legacy.legacy_sent_db(block_db, merge_short_sent)
+
+    assert sent_db[legacy_db.columns].to_csv(index=False) == legacy_db.to_csv(index=False)
+
+
+def test_block_db_matches_cell_by_cell_build(monkeypatch):
+    par_db = synthetic.make_synthetic_par_db(300)
+    monkeypatch.setattr(doc_utils_clean, "debug_db", pd.DataFrame(), raising=False)
+    monkeypatch.setattr(doc_utils_clean, "par_db", par_db, raising=False)
+    block_db = doc_utils_clean.build_doc_blocks()
+    legacy_db = legacy.legacy_block_db(par_db)
+
+    assert block_db["nar_idx"].max() > 1
+    pd.testing.assert_series_equal(block_db.dtypes, legacy_db.dtypes)
+    assert block_db.to_csv(index=False) == legacy_db.to_csv(index=False)
+
+
+def test_block_order_matches_list_index(monkeypatch):
+    # many narrative blocks per paragraph, plus the synthetic transcript
+    # paragraphs with markers spanning paragraphs
+    par_db = pd.concat([synthetic.make_synthetic_marked_par_db(20, 15),
+                        synthetic.make_synthetic_par_db(200)], ignore_index=True)
+    monkeypatch.setattr(doc_utils_clean, "debug_db", pd.DataFrame(), raising=False)
+    monkeypatch.setattr(doc_utils_clean, "par_db", par_db, raising=False)
+    mismatches = [i for i in par_db.index if doc_utils_clean.split_par_to_blocks_keep_order(i)
+                  != legacy.legacy_split_par_to_blocks_keep_order(i)]
+
+    assert mismatches == []
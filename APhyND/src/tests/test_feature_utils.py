@@ -0,0 +1,172 @@
+import os
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import defines
+import feature_utils
+from fixtures import legacy, synthetic
+
+
+@pytest.fixture
+def vec_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(feature_utils, "corpus_vectors", {})
+    return "vec", os.path.join(str(tmp_path), defines.PATH_TO_DFS, "vec")
+
+
+def test_corpus_vectors_per_dim(vec_dir):
+    dir_name, path = vec_dir
+    vectors = {dim: synthetic.write_synthetic_doc_vectors(dir_name, 3, 5, 20, dim, dim) for dim in [300, 100]}
+    for dim in [300, 100]:
+        feature_utils.build_corpus_vectors(dir_name, dim=dim)
+
+    matrix = feature_utils.open_corpus_vectors(path, 300)[0]
+    for dim in [300, 100, 300]:
+        for doc_idx, doc_vectors in vectors[dim].items():
+            assert np.array_equal(feature_utils.load_sent_vectors(path, doc_idx, dim), doc_vectors)
+    assert feature_utils.open_corpus_vectors(path, 300)[0] is matrix  # both dims stay open
+
+
+def test_corpus_index_replaced_after_matrix(vec_dir, monkeypatch):
+    dir_name, path = vec_dir
+    synthetic.write_synthetic_doc_vectors(dir_name, 3, 5, 20)
+    feature_utils.build_corpus_vectors(dir_name, [1, 2])
+    feature_utils.open_corpus_vectors(path)
+    replace = os.replace
+
+    def replace_matrix_only(src, dst):
+        if dst == feature_utils.get_corpus_index_path(path):
+            raise KeyboardInterrupt
+        replace(src, dst)
+
+    monkeypatch.setattr(feature_utils.os, "replace", replace_matrix_only)
+    with pytest.raises(KeyboardInterrupt):
+        feature_utils.build_corpus_vectors(dir_name, [1, 2, 3])
+
+    assert feature_utils.open_corpus_vectors(path) == (None, {})
+    for doc_idx in [1, 2, 3]:  # read from the document files
+        assert np.array_equal(feature_utils.load_sent_vectors(path, doc_idx),
+                              np.load(os.path.join(path, "{:02d}_sent_vec300.npy".format(doc_idx))))
+
+
+WORD_CACHE_TEXTS = [
+    # empty, whitespace only, words with no subwords (zero vectors), repeats,
+    # separators fastText does not split on (no-break space)
+    "", "   ", "\t", "</s>", "</s> כן", "כן כן כן", "אני\u00a0לא יודע", "מה\tקרה  אז",
+    " זהו ", "123 XXX", "ה ה ה ה ה ה ה ה ה ה ה ה",
+]
+
+
+def test_cached_sent_vectors_match_model(monkeypatch):
+    monkeypatch.setattr(feature_utils, "word_vectors", {})
+    ft = synthetic.SubwordVectorModel(dim=50)
+    rnd = random.Random(0)
+    texts = WORD_CACHE_TEXTS + [synthetic.make_synthetic_sentence(rnd) for i in range(500)]
+    expected = np.array([ft.get_sentence_vector(text) for text in texts], dtype=np.float32)
+
+    cold = feature_utils.get_cached_sent_vectors(texts, ft, ft.get_dimension())
+    warm = feature_utils.get_cached_sent_vectors(texts[::-1], ft, ft.get_dimension())[::-1]
+
+    assert cold.dtype == np.float32
+    np.testing.assert_allclose(cold, expected, rtol=0, atol=1e-6)
+    np.testing.assert_array_equal(warm, cold)
+
+
+@pytest.fixture
+def pos_doc(tmp_path, monkeypatch):
+    # sent_pos_db, sent_db and a zero similarity db of one document
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(feature_utils, "curr_doc_db", {})
+    synthetic.write_synthetic_doc_dbs("pos", 1, 200)
+    path = os.path.join(str(tmp_path), defines.PATH_TO_DFS, "pos")
+    pd.DataFrame(np.zeros((200, 200))).to_csv(os.path.join(path, "01_sent_sim_vec300_db.csv"), index=False)
+    return "pos", path
+
+
+def get_doc_features(dir_name, sent2features, merged_db=None):
+    feature_utils.load_doc_features(dir_name, 1, tf_types=[])
+    if merged_db is not None:
+        feature_utils.curr_doc_db["merged"] = merged_db
+    doc_len = len(feature_utils.curr_doc_db["merged"].index)
+    return [sent2features(sent_idx, sent_idx, doc_len) for sent_idx in range(doc_len)]
+
+
+def sent2features(sent_idx, idx_in_seq, seq_len):
+    return feature_utils.sent2features(sent_idx, idx_in_seq, seq_len, tf_to_use=[])
+
+
+def test_dense_pos_counts_replace_sparse_save(pos_doc):
+    dir_name, path = pos_doc
+    feature_utils.save_doc_pos_features(dir_name, 1, sparse_count=True)
+    feature_utils.save_doc_pos_features(dir_name, 1)
+
+    assert not os.path.isfile(os.path.join(path, "01_sent_pos_count.npz"))
+    assert not os.path.isfile(os.path.join(path, "01_sent_pos_count_columns.json"))
+    merged_db = pd.read_csv(os.path.join(path, "01_merged_db.csv"))
+    assert all(any(col.startswith(pos_col + "_") for col in merged_db.columns)
+               for pos_col in feature_utils.POS_COUNT_COLUMNS)
+    get_doc_features(dir_name, sent2features)
+    assert feature_utils.curr_doc_db["pos_count"] is None  # counts are not packed twice
+
+
+@pytest.mark.parametrize("sent2features_func", [sent2features, feature_utils.sent2features_orig])
+def test_sparse_pos_counts_same_features(pos_doc, sent2features_func):
+    # dense merged_db read back with exact float parsing against the non
+    # zeros of the sparse count matrix
+    dir_name, path = pos_doc
+    feature_utils.save_doc_pos_features(dir_name, 1)
+    merged_db = pd.read_csv(os.path.join(path, "01_merged_db.csv"), float_precision="round_trip")
+    dense_features = get_doc_features(dir_name, sent2features_func, merged_db)
+    feature_utils.save_doc_pos_features(dir_name, 1, sparse_count=True)
+    sparse_features = get_doc_features(dir_name, sent2features_func)
+
+    assert sparse_features == dense_features
+
+
+def test_sparse_pos_counts_match_dummies(pos_doc):
+    # legacy get_dummies counts went through a csv, hence the tolerance
+    dir_name, path = pos_doc
+    legacy_lemma_db, legacy_merged_db = legacy.legacy_save_doc_pos_features(dir_name, 1)
+    merged_db = feature_utils.save_doc_pos_features(dir_name, 1, sparse_count=True)
+    count_matrix, columns = feature_utils.load_sent_pos_count(path, 1)
+
+    assert sorted(columns) == sorted(set(legacy_merged_db.columns)
+                                     - set(defines.SENT_FEATURES) - {"TOKEN"})
+    np.testing.assert_allclose(count_matrix.toarray(), legacy_merged_db[columns].values,
+                               rtol=1e-12, atol=0)
+    np.testing.assert_array_equal(merged_db["TOKEN"].values, legacy_merged_db["TOKEN"].values)
+    assert pd.read_csv(os.path.join(path, "01_sent_lemma_db.csv")).equals(legacy_lemma_db)
+
+
+def get_neighbor_similarities(sim_band, sim_vec, sent_vec, neighbor_radius):
+    feature_utils.curr_doc_db.update({"sim_band": sim_band, "sim_vec": sim_vec, "sent_vec": sent_vec})
+    return [[feature_utils.get_sent_similarity(sent_idx, sent_idx + dist)
+             for dist in range(-neighbor_radius, neighbor_radius + 1)
+             if dist != 0 and 0 <= sent_idx + dist < len(sent_vec)]
+            for sent_idx in range(len(sent_vec))]
+
+
+@pytest.mark.parametrize("n_sent", [1, 4, 200])
+def test_sim_band_matches_full_similarity(tmp_path, monkeypatch, n_sent):
+    # the full matrix went through a csv, the band through no text at all
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(feature_utils, "curr_doc_db", {})
+    path = os.path.join(str(tmp_path), defines.PATH_TO_DFS, "sim")
+    os.makedirs(path)
+    sent_vectors = np.random.default_rng(n_sent).standard_normal((n_sent, 300)).astype(np.float32)
+    np.save(os.path.join(path, "01_sent_vec300.npy"), sent_vectors)
+    sim_vec = legacy.legacy_doc_similarity("sim", 1, sent_vectors)
+    feature_utils.get_and_save_doc_similarity("sim", 1, sent_vectors=sent_vectors)
+    sim_band = feature_utils.load_sim_band(path, 1)
+    sent_vec = feature_utils.load_sent_vectors(path, 1)
+
+    for neighbor_radius in [2, feature_utils.SIM_BAND_RADIUS + 2]:
+        full_features = get_neighbor_similarities(None, sim_vec, sent_vec, neighbor_radius)
+        band_features = get_neighbor_similarities(sim_band, None, sent_vec, neighbor_radius)
+        assert [len(features) for features in band_features] == [len(features) for features in full_features]
+        for full, band in zip(full_features, band_features):
+            np.testing.assert_allclose(band, full, rtol=0, atol=1e-12)
+    assert feature_utils.load_doc_similarity(path, 1)[1] is None
@@ -0,0 +1,133 @@
+import glob
+import os
+import socket
+import sys
+
+import pandas as pd
+import pytest
+
+import pos_yap_process
+from fixtures import legacy, synthetic, yap_stub
+
+
+@pytest.fixture
+def stub_yap(monkeypatch):
+    server = yap_stub.start_stub_server(0)
+    monkeypatch.setattr(pos_yap_process, "localhost_yap",
+                        "http://localhost:{}/yap/heb/joint".format(server.server_address[1]))
+    monkeypatch.setattr(pos_yap_process, "db_step", 20)
+    yield server
+    server.shutdown()
+    server.server_close()
+    pos_yap_process.close_yap_session()
+
+
+def crash_after_chunks(monkeypatch, n_chunks):
+    flush_chunk = pos_yap_process.flush_chunk
+    n_flushed = []
+
+    def flush_and_crash(*args):
+        flush_chunk(*args)
+        n_flushed.append(1)
+        if len(n_flushed) == n_chunks:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(pos_yap_process, "flush_chunk", flush_and_crash)
+
+
+@pytest.mark.parametrize("first_resume", [True, False])
+def test_crashed_run_resumes(tmp_path, monkeypatch, stub_yap, first_resume):
+    sent_db_path = str(tmp_path / "01_sent_db.csv")
+    sent_pos_path = str(tmp_path / "01_sent_pos_db.csv")
+    synthetic.write_synthetic_sent_db(sent_db_path, 100)
+    pos_yap_process.parse_all_sentenses([sent_db_path])
+    expected = synthetic.get_file_md5(sent_pos_path)
+    os.remove(sent_pos_path)
+
+    with monkeypatch.context() as patch:
+        crash_after_chunks(patch, 2)
+        with pytest.raises(KeyboardInterrupt):
+            pos_yap_process.parse_all_sentenses([sent_db_path], resume=first_resume)
+    n_requests = stub_yap.n_requests
+    pos_yap_process.parse_all_sentenses([sent_db_path], resume=True)
+
+    assert stub_yap.n_requests - n_requests == 60  # the 2 flushed chunks are not tagged again
+    assert synthetic.get_file_md5(sent_pos_path) == expected
+    assert sorted(os.listdir(tmp_path)) == ["01_sent_db.csv", "01_sent_pos_db.csv"]
+
+
+def test_stale_checkpoint_parts_removed(tmp_path, monkeypatch, stub_yap):
+    sent_db_path = str(tmp_path / "01_sent_db.csv")
+    synthetic.write_synthetic_sent_db(sent_db_path, 100)
+    with monkeypatch.context() as patch:
+        crash_after_chunks(patch, 3)
+        with pytest.raises(KeyboardInterrupt):
+            pos_yap_process.parse_all_sentenses([sent_db_path])
+    assert len(glob.glob(str(tmp_path / "*.part*.csv"))) == 3
+
+    synthetic.write_synthetic_sent_db(sent_db_path, 10, seed=1)  # other sentences
+    pos_yap_process.parse_all_sentenses([sent_db_path], resume=True)
+
+    assert sorted(os.listdir(tmp_path)) == ["01_sent_db.csv", "01_sent_pos_db.csv"]
+
+
+def test_sents_to_tags_after_doc_run(tmp_path, monkeypatch, stub_yap):
+    sent_db_path = str(tmp_path / "01_sent_db.csv")
+    synthetic.write_synthetic_sent_db(sent_db_path, 30)
+    pos_yap_process.parse_all_sentenses([sent_db_path])
+    expected = pd.read_csv(str(tmp_path / "01_sent_pos_db.csv"))
+
+    monkeypatch.setattr(pos_yap_process, "sent_text_db", pd.read_csv(sent_db_path), raising=False)
+    pos_yap_process.sents_to_tags(list(range(20)))
+    for sent_idx in range(20, 30):
+        pos_yap_process.sent_to_tags(sent_idx)
+    sent_tokens_db = pos_yap_process.collect_sent_tokens_db()
+
+    assert len(pos_yap_process.lattice_columns["sent_idx"]) == 0
+    assert sent_tokens_db["sent_idx"].tolist() == expected["sent_idx"].tolist()
+    assert sent_tokens_db["LEMMA"].tolist() == expected["LEMMA"].tolist()
+    assert pos_yap_process.collect_sent_tokens_db().empty
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"n_servers": 2}, {"cmd": "./yap api"},
+                                    {"n_servers": 2, "cmd": "./yap api"}])
+def test_yap_pool_needs_cmd_and_n_servers(kwargs):
+    with pytest.raises(ValueError):
+        pos_yap_process.YapServerPool(**kwargs)
+    assert pos_yap_process.YapServerPool(urls=["http://localhost:1/yap/heb/joint"]).ports == []
+
+
+def test_yap_pool_tags_like_one_server(tmp_path, monkeypatch, stub_yap):
+    sent_db_path = str(tmp_path / "01_sent_db.csv")
+    sent_pos_path = str(tmp_path / "01_sent_pos_db.csv")
+    synthetic.write_synthetic_sent_db(sent_db_path, 30)
+    pos_yap_process.parse_all_sentenses([sent_db_path])
+    expected = synthetic.get_file_md5(sent_pos_path)
+    os.remove(sent_pos_path)
+
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        first_port = sock.getsockname()[1]
+    cmd = "{} {} --port {{port}}".format(sys.executable, os.path.abspath(yap_stub.__file__))
+    n_requests = stub_yap.n_requests
+    pos_yap_process.start_yap_pool(2, first_port, cmd=cmd, cwd=str(tmp_path), timeout=30)
+    try:
+        pos_yap_process.parse_all_sentenses([sent_db_path], n_in_flight=2)
+    finally:
+        pos_yap_process.stop_yap_pool()
+
+    assert stub_yap.n_requests == n_requests  # tagged by the pool servers
+    assert synthetic.get_file_md5(sent_pos_path) == expected
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_sent_tokens_db_matches_cell_by_cell_build(seed):
+    lattices = synthetic.get_synthetic_lattices(100, seed)
+    # f_* columns first set after the first row, and sentences without features
+    lattices[:0] = ["0\t1\tכן\tכן\tRB\tRB\t_\t1\n",
+                    "0\t1\tהוא\tהוא\tPRP\tPRP\tgen=M|num=S\t1\n1\t2\tזה\tזה\tPRP\tPRP\t_\t2\n"]
+    sent_tokens_db = synthetic.columnar_sent_tokens_db(lattices)
+    legacy_db = legacy.legacy_sent_tokens_db(lattices)
+
+    assert list(sent_tokens_db.columns) == list(legacy_db.columns)
+    assert sent_tokens_db.to_csv(index=False) == legacy_db.to_csv(index=False)
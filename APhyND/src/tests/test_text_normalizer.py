@@ -0,0 +1,44 @@
+import re
+
+import pytest
+
+import text_normalizer
+from fixtures import legacy, synthetic
+
+EDGE_TEXTS = [
+    "",
+    ".",
+    ".. כן",
+    "כן...? לא....",
+    "?..",
+    "אז XXXX מה XX קרה XXX",
+    "125 ₪ ו 3₪",
+    "[צחוק [קטן] ] (L1 הערה-A) (הערה)",
+    "@#&<>*\t\\t טוב",
+    "%סיכום זהו% כן %עוד%",
+]
+
+
+def test_block_normalizer_matches_chained_rules():
+    texts = EDGE_TEXTS + synthetic.get_synthetic_block_texts()
+    mismatches = [text for text in texts
+                  if text_normalizer.block_normalizer(text) != legacy.legacy_block_normalize(text)]
+    assert mismatches == []
+
+
+def test_sent_normalizer_matches_clean_text():
+    # legacy clean_text compiled every summary as a regex: it missed or
+    # failed on summaries with regex characters, those are left out
+    texts = [text for text in EDGE_TEXTS + synthetic.get_synthetic_block_texts()
+             if all(re.escape(summary) == summary for summary in re.findall("%.*?%", text))]
+    mismatches = [text for text in texts
+                  if text_normalizer.sent_normalizer(text) != legacy.legacy_clean_text(text)]
+    assert mismatches == []
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("%a.b% כן", " כן"),
+    ("%(% כן %)%", " כן "),
+])
+def test_sent_normalizer_removes_summaries_literally(text, expected):
+    assert text_normalizer.sent_normalizer(text) == expected
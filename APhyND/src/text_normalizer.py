@@ -0,0 +1,156 @@
+import re
+import string
+
+import defines
+
+# A rule is (name, pattern, replacement[, guard]):
+#   pattern is a regex string -> precompiled re.sub(pattern, replacement),
+#                                replacement is a string or a match callable
+#   pattern is None           -> replacement is either a {char: str} map, adjacent
+#                                char map rules are merged into one character
+#                                class pass, or a callable text -> text
+#   guard                     -> optional tuple of substrings, the rule is
+#                                skipped when none of them is in the text
+#                                (a cheap `in` test instead of a regex scan)
+# Rules are applied in list order, exactly as the chained functions they replace.
+
+PUNCTUATION_TO_REMOVE = re.sub(r"\?", "", string.punctuation)  # keep ?
+
+
+def collapse_dots(match):
+    # one pass equal to remove_multi_dots after the leading dot is removed:
+    # '\.+?\?' -> '?' and then '\.{2,3}' -> '.' on the remaining dot runs
+    dots = match.group()
+    if dots[-1] == "?":
+        return "?"
+    return "." * (len(dots) // 3 + (1 if len(dots) % 3 else 0))
+
+
+BLOCK_RULES = [
+    # doc_utils_clean.remove_lr_annotation
+    ("lr_annotation", r"\(L[0-9].*?\-[A-Z]{1}\)", "", ("(L",)),
+    # doc_utils_clean.replace_brackets: [..] , (..), [..[.]..]
+    ("brackets", r"\([^(]*?\)|\[[^[]*?\]", "", ("(", "[")),
+    # doc_utils_clean.remove_multi_dots
+    ("leading_dot", r"\A\.", ""),
+    ("multi_dots", r"\.(?:\.+\??|\?)", collapse_dots, ("..", ".?")),
+    # doc_utils_clean.remove_multi_x
+    ("multi_x", r"X{3,4}.*?X{1,4}|X{3,}", " XXX ", ("XXX",)),
+    # doc_utils_clean.remove_symbols, the class [..\t\\t] also drops '\' and 't'
+    ("symbols", None, {c: "" for c in "@#&<>*\t\\t"}),
+    # doc_utils_clean.replase_shekel_char, runs before unify_numbers here:
+    # neither rule produces or consumes what the other matches
+    ("shekel", None, {"₪": defines.SHEKEL}),
+    # doc_utils_clean.unify_numbers
+    ("numbers", r"[0-9]{1,}", " 123 "),
+]
+
+SUMMARY_RE = re.compile(r"%.*?%")
+
+
+def remove_summaries(text):
+    # same result as doc_utils_clean.extract_narrative_summary, but every found
+    # summary is removed as a literal string instead of being compiled as a regex
+    for summary in SUMMARY_RE.findall(text):
+        text = text.replace(summary, "")
+    return text
+
+
+SENT_RULES = [
+    # doc_utils_clean.extract_narrative_summary
+    ("summary", None, remove_summaries, ("%",)),
+    # doc_utils_clean.remove_punctuation
+    ("punctuation", None, {c: "" for c in PUNCTUATION_TO_REMOVE}),
+]
+
+
+def compose_char_maps(first, second):
+    # char map equal to applying first and then second
+    composed = {c: "".join(second.get(o, o) for o in out) for c, out in first.items()}
+    for c, out in second.items():
+        if not c in composed:
+            composed[c] = out
+    return composed
+
+
+def get_char_map_pass(char_map):
+    regex = re.compile("[{}]".format("".join(re.escape(c) for c in char_map)))
+    if all(len(out) == 0 for out in char_map.values()):
+        return (regex, "", None)
+    return (regex, lambda match: char_map[match.group()], None)
+
+
+class TextNormalizer:
+    def __init__(self, rules=BLOCK_RULES, skip=()):
+        self.rule_names = []
+        self.passes = []  # (compiled regex or text callable, replacement, guard)
+        char_map = None
+        for rule in rules:
+            name, pattern, repl = rule[:3]
+            guard = rule[3] if len(rule) > 3 else None
+            if name in skip:
+                continue
+            self.rule_names.append(name)
+            if pattern is None and isinstance(repl, dict):
+                char_map = repl if char_map is None else compose_char_maps(char_map, repl)
+                continue
+            if char_map is not None:
+                self.passes.append(get_char_map_pass(char_map))
+                char_map = None
+            if pattern is None:
+                self.passes.append((repl, None, guard))
+            else:
+                self.passes.append((re.compile(pattern), repl, guard))
+        if char_map is not None:
+            self.passes.append(get_char_map_pass(char_map))
+
+    def normalize(self, text):
+        for op, repl, guard in self.passes:
+            if guard is not None and not any(g in text for g in guard):
+                continue
+            if repl is None:
+                text = op(text)
+            else:
+                text = op.sub(repl, text)
+        return text
+
+    def __call__(self, text):
+        return self.normalize(text)
+
+    def __repr__(self):
+        return "{}({}, {} passes)".format(
+            self.__class__.__name__, self.rule_names, len(self.passes))
+
+
+block_normalizer = TextNormalizer(BLOCK_RULES)
+sent_normalizer = TextNormalizer(SENT_RULES)
+
+
+# rule based sentence splitter for normalized blocks, selectable instead of
+# nltk sent_tokenize: a sentence ends at a run of . ? ! (and the closing
+# quotes / brackets right after it) followed by whitespace or the end of the
+# block. A run of dots only is an ellipsis and does not end the sentence, as
+# Punkt decides for words without letter case. Like Punkt, the first sentence
+# keeps the leading whitespace of the block
+SENT_BREAK_RE = re.compile(r"([.?!]+)[\"')\]}]*(?=\s|\Z)")
+
+
+def is_ellipsis(end_chars):
+    return len(end_chars) > 1 and end_chars.count(".") == len(end_chars)
+
+
+def get_sentence(text, start, end):
+    sentence = text[start:end].rstrip()
+    return sentence if start == 0 else sentence.lstrip()
+
+
+def split_sentences(text):
+    sentences = []
+    start = 0
+    for match in SENT_BREAK_RE.finditer(text):
+        if is_ellipsis(match.group(1)):
+            continue
+        sentences.append(get_sentence(text, start, match.end()))
+        start = match.end()
+    sentences.append(get_sentence(text, start, len(text)))
+    return [sentence for sentence in sentences if sentence]